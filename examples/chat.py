@@ -9,7 +9,8 @@ connected_clients = set() #set of currently connected clients (tasks)
         
 def handle(client_socket):
     """handles a single client connected to the chat server"""
-    stream = BufferedStream(client_socket)
+    #the lines written in the same round (e.g. from a burst of messages) are flushed together
+    stream = BufferedStream(client_socket, deferred_flush = True)
 
     client_task = Tasklet.current() #this is the current task as started by server
     connected_clients.add(client_task)
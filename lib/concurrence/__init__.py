@@ -5,7 +5,7 @@
 __version__ = '0.3.2' #remember to update setup.py
 __version_info__ = tuple([ int(num) for num in __version__.split('.')])
 
-from concurrence.core import dispatch, quit, disable_threading, get_version_info, TIMEOUT_NEVER, TIMEOUT_CURRENT
+from concurrence.core import dispatch, quit, call_soon_threadsafe, call_at_round_end, disable_threading, get_version_info, TIMEOUT_NEVER, TIMEOUT_CURRENT
 from concurrence.core import Channel, Tasklet, Message, Deque, FileDescriptorEvent, SignalEvent, TimeoutEvent
 from concurrence.core import TimeoutError, TaskletError, JoinError
 from concurrence.extra import TaskletPool, DeferredQueue, Lock, Semaphore, QueueChannel
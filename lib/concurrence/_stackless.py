@@ -66,6 +66,8 @@ class tasklet(object):
 
     def __init__(self, f = None, greenlet = None, alive = False):
         self.greenlet = greenlet
+        if greenlet is not None:
+            greenlet.tasklet = self #so that we can find the tasklet of a greenlet in the schedule callback
         self.func = f
         self.alive = alive
         self.blocked = False
@@ -81,32 +83,44 @@ class tasklet(object):
         and the 'task' is first scheduled to run"""
         if self.func is None:
             raise TypeError('tasklet function must be a callable')
-
-        def _func(*_args, **_kwargs):
-            try:
-                self.func(*args, **kwargs)
-            except TaskletExit:
-                pass #let it pass silently
-            except:
-                import logging
-                logging.exception('unhandled exception in greenlet')
-                #don't propagate to parent
-            finally:
-                assert _scheduler.current == self
-                _scheduler.remove(self)
-                if _scheduler._runnable: #there are more tasklets scheduled to run next
-                    #this make sure that flow will continue in the correct greenlet, e.g. the next in the schedule
-                    self.greenlet.parent = _scheduler._runnable[0].greenlet
-                self.alive = False
-                del self.greenlet
-                del self.func
-                del self.data
-
-        self.greenlet = greenlet(_func)
+        #all greenlets are children of the main greenlet, this way we never create cycles when
+        #we change the parent of a greenlet that exits (see _run)
+        self.greenlet = greenlet(self._run, _scheduler._main_task.greenlet)
+        self.greenlet.tasklet = self
+        self.data = (args, kwargs) #the arguments for the first switch into _run
         self.alive = True
-        _scheduler.append(self)
+        _scheduler._runnable.append(self)
         return self
 
+    def _run(self, *_):
+        #the greenlet of a task that exits before us might start us with its (None) result
+        args, kwargs = self.data
+        self.data = None
+        try:
+            self.func(*args, **kwargs)
+        except TaskletExit:
+            pass #let it pass silently
+        except:
+            import logging
+            logging.exception('unhandled exception in greenlet')
+            #don't propagate to parent
+        finally:
+            #when our greenlet exits, flow will continue in its parent, make sure this is the next runnable task
+            _scheduler._exit(self)
+            self.alive = False
+            del self.greenlet
+            del self.func
+            del self.data
+
+    @property
+    def frame(self):
+        """the innermost frame of a suspended tasklet (as in stackless), None when it is not started or finished,
+        note that unlike stackless this is also None for the running tasklet"""
+        g = getattr(self, 'greenlet', None)
+        if g is None:
+            return None
+        return g.gr_frame
+
     def kill(self):
         _scheduler.throw(self, TaskletExit)
 
@@ -126,38 +140,55 @@ class tasklet(object):
 class scheduler(object):
     def __init__(self):
         self._main_task = tasklet(greenlet = greenlet.getcurrent(), alive = True)
-        #all non blocked tast are in this queue
-        #all tasks are only onces in this queue
-        #the current task is the first item in the queue
-        self._runnable = deque([self._main_task])
+        #the task that is currently running
+        self.current = self._main_task
+        #all other non blocked tasks are in this queue, in the order in which they will run
+        #all tasks are only once in this queue
+        self._runnable = deque()
+
+    #note that the switches are inlined below, as they are the hot path of the scheduler
 
     def schedule(self):
         """schedules the next tasks and puts the current task back at the queue of runnables"""
-        self._runnable.rotate(-1)
-        next_task = self._runnable[0]
-        next_task.greenlet.switch()
+        runnable = self._runnable
+        if runnable:
+            runnable.append(self.current)
+            self.current = task = runnable.popleft()
+            task.greenlet.switch()
 
     def schedule_block(self):
         """blocks the current task and schedules next"""
-        self._runnable.popleft()
-        next_task = self._runnable[0]
-        next_task.greenlet.switch()
+        if not self._runnable:
+            raise RuntimeError("Deadlock: the last runnable tasklet cannot be blocked.")
+        self.current = task = self._runnable.popleft()
+        task.greenlet.switch()
+
+    def _exit(self, task):
+        #called when the current task exits, its greenlet will switch to its parent when it returns
+        if self._runnable:
+            self.current = self._runnable.popleft()
+        else:
+            self.current = self._main_task
+        task.greenlet.parent = self.current.greenlet
 
     def throw(self, task, *args):
         if not task.alive: return #this is what stackless does
 
         assert task.blocked or task in self._runnable
 
-        task.greenlet.parent = self._runnable[0].greenlet
-        if task.blocked:
-            self._runnable.appendleft(task)
-        else:
+        if not task.greenlet:
+            #the task did not start running yet, it just goes away
             self._runnable.remove(task)
-            self._runnable.appendleft(task)
+            task.alive = False
+            return
 
+        #the task runs right away, the current task continues right after it
+        if not task.blocked:
+            self._runnable.remove(task)
+        self._runnable.appendleft(self.current)
+        self.current = task
         task.greenlet.throw(*args)
 
-
     def _receive(self, channel, preference):
         #Receiving 1):
         #A tasklet wants to receive and there is
@@ -177,16 +208,15 @@ class scheduler(object):
             sender.blocked = False
             data, sender.data = sender.data, None
             if preference == 1:
-                #sender preference
-                self._runnable.rotate(-1)
-                self._runnable.appendleft(sender)
-                self._runnable.rotate(1)
-                self.schedule()
+                #sender preference, hand off directly to the sender
+                self._runnable.append(self.current)
+                self.current = sender
+                sender.greenlet.switch()
             else:
                 #receiver preference
                 self._runnable.append(sender)
         else: #no sender
-            current = self._runnable[0]
+            current = self.current
             channel.queue.append(current)
             channel.balance -= 1
             current.blocked = True
@@ -200,7 +230,7 @@ class scheduler(object):
 
             data, current.data = current.data, None
 
-        if isinstance(data, bomb):
+        if type(data) is bomb:
             data.raise_()
         else:
             return data
@@ -218,18 +248,16 @@ class scheduler(object):
         #    The sender will become blocked and inserted
         #    into the queue. The next receiver will
         #    handle the rest through "Receiving 1)".
-        #print 'send q', channel.queue
         if channel.balance < 0: #some receiver
             channel.balance += 1
             receiver = channel.queue.popleft()
             receiver.data = data
             receiver.blocked = False
-            #put receiver just after current task in runnable and schedule (which will pick it up)
-            if preference == -1: #receiver pref
-                self._runnable.rotate(-1)
-                self._runnable.appendleft(receiver)
-                self._runnable.rotate(1)
-                self.schedule()
+            if preference == -1:
+                #receiver preference, hand off directly to the receiver
+                self._runnable.append(self.current)
+                self.current = receiver
+                receiver.greenlet.switch()
             else: #sender pref
                 self._runnable.append(receiver)
         else: #no receiver
@@ -247,28 +275,15 @@ class scheduler(object):
                 current.blocked = False
                 raise
 
-    def remove(self, task):
-        assert task.blocked or task in self._runnable
-        if task in self._runnable:
-            self._runnable.remove(task)
-
-    def append(self, task):
-        assert task not in self._runnable
-        self._runnable.append(task)
-
     @property
     def runcount(self):
-        return len(self._runnable)
-
-    @property
-    def current(self):
-        return self._runnable[0]
+        return len(self._runnable) + 1 #the current task is runnable as well
 
 #there is only 1 scheduler, this is it:
 _scheduler = scheduler()
 
 def getruncount():
-    return _scheduler.runcount
+    return len(_scheduler._runnable) + 1
 
 def getcurrent():
     return _scheduler.current
@@ -276,4 +291,19 @@ def getcurrent():
 def schedule():
     return _scheduler.schedule()
 
+def set_schedule_callback(callback):
+    """Installs *callback* to be called as callback(prev, next) on every switch between tasklets, like
+    stackless.set_schedule_callback. Use None to remove the callback. This costs nothing when no callback
+    is installed, as it uses the trace function of the greenlet module."""
+    if not hasattr(greenlet, 'settrace'):
+        raise RuntimeError("set_schedule_callback needs a greenlet version that supports settrace")
+    if callback is None:
+        greenlet.settrace(None)
+    else:
+        def trace(event, args):
+            if event == 'switch' or event == 'throw':
+                origin, target = args
+                callback(getattr(origin, 'tasklet', None), getattr(target, 'tasklet', None))
+        greenlet.settrace(trace)
+
 
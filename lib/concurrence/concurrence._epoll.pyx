@@ -0,0 +1,605 @@
+# Copyright (C) 2009, Hyves (Startphone Ltd.)
+#
+# This module is part of the Concurrence Framework and is released under
+# the New BSD License: http://www.opensource.org/licenses/bsd-license.php
+
+"""Native Linux epoll event backend
+
+This module provides the same API as concurrence._event, but is built
+directly on epoll instead of on libevent.
+
+Every fd is registered with epoll only once (when its first event is added) and stays
+registered while it has events. After an event fires, the interest for that fd is not
+removed right away. Most of the time the event is re-added before the next
+loop (e.g. the next read on a keep-alive connection), and then no epoll_ctl call is
+needed at all. The interest is only removed when epoll reports the fd ready for an
+event that was not re-added.
+
+Only one read event and one write event can be added for a single fd at the same time.
+Timeouts on events are supported, but are meant for the few timeouts that are not
+kept by the scheduler's timer wheel. They are kept in a heap, so that finding the next
+deadline and the expired events does not depend on the number of events with a timeout.
+"""
+
+import heapq
+
+EV_TIMEOUT      = 0x01
+EV_READ         = 0x02
+EV_WRITE        = 0x04
+EV_SIGNAL       = 0x08
+EV_PERSIST      = 0x10
+
+class EventError(Exception):
+    def __init__(self, msg):
+        Exception.__init__(self, msg + ": " + strerror(errno))
+
+cdef class __event
+cdef struct __list
+cdef struct __fdinfo
+
+ctypedef void (*signal_handler)(int signo)
+
+cdef extern from "string.h":
+    char *strerror(int errno)
+
+cdef extern from "errno.h":
+    int errno
+    int EINTR
+    int EEXIST
+    int ENOENT
+
+cdef extern from "stdlib.h":
+    void *realloc(void *, int)
+    void free(void *)
+
+cdef extern from "unistd.h":
+    int read(int, void *, int) nogil
+    int write(int, void *, int) nogil
+    int close(int) nogil
+    int pipe(int *) nogil
+
+cdef extern from "fcntl.h":
+    int fcntl(int, int, int) nogil
+    int F_SETFL
+    int F_GETFL
+    int O_NONBLOCK
+
+cdef extern from "signal.h":
+    signal_handler signal(int signo, signal_handler handler) nogil
+    signal_handler SIG_ERR
+
+cdef extern from "sys/time.h":
+    struct timeval:
+        long tv_sec
+        long tv_usec
+    int gettimeofday(timeval *tv, void *tz) nogil
+
+cdef extern from "sys/epoll.h":
+    ctypedef union epoll_data_t:
+        int fd
+
+    struct epoll_event:
+        unsigned int events
+        epoll_data_t data
+
+    int epoll_create(int size) nogil
+    int epoll_ctl(int epfd, int op, int fd, epoll_event *event) nogil
+    int epoll_wait(int epfd, epoll_event *events, int maxevents, int timeout) nogil
+
+    int EPOLLIN
+    int EPOLLOUT
+    int EPOLLERR
+    int EPOLLHUP
+    int EPOLL_CTL_ADD
+    int EPOLL_CTL_MOD
+    int EPOLL_CTL_DEL
+
+cdef enum:
+    MAX_EVENTS = 1024 #max nr of fds returned by 1 epoll_wait
+    MAX_SIGNAL = 65
+
+cdef enum:
+    C_EV_TIMEOUT = 0x01
+    C_EV_READ = 0x02
+    C_EV_WRITE = 0x04
+    C_EV_SIGNAL = 0x08
+    C_EV_PERSIST = 0x10
+
+#keep a singly-linked list of events that are triggered during 1 call to 'loop'
+#this works exactly the same as in concurrence._event
+cdef struct __list:
+    void *event
+    short flags
+    int fd
+    __list *next
+
+#for every fd we keep the (at most 1) read and write event and the epoll interest
+#that is currently registered
+cdef struct __fdinfo:
+    void *reader
+    void *writer
+    unsigned int registered
+
+cdef __list* head
+cdef __list* tail
+head = NULL
+tail = NULL
+
+cdef int epfd
+epfd = -1
+
+cdef __fdinfo *fdtable
+cdef int fdtable_size
+fdtable = NULL
+fdtable_size = 0
+
+cdef epoll_event events[MAX_EVENTS]
+
+#signals are delivered trough a pipe by a C signal handler
+cdef int signal_pipe[2]
+signal_pipe[0] = -1
+signal_pipe[1] = -1
+cdef void *signal_events[MAX_SIGNAL]
+cdef signal_handler signal_previous[MAX_SIGNAL]
+
+_triggered = [] #the list returned by 'triggered', reused on every call
+_timed = [] #heap of (deadline, seq, event) for the events that have a timeout, see __timed_add
+cdef long _timed_seq
+_timed_seq = 0
+cdef int _timed_count
+_timed_count = 0 #nr of events that have a timeout, the heap also has stale entries
+
+cdef int __timed_add(__event ev, double deadline) except -1:
+    #the heap is not updated when the timeout of an event changes or is removed, instead a new entry is pushed
+    #and the old one becomes stale (its seq no longer matches the event), stale entries are skipped when they come on top
+    global _timed_seq, _timed_count, _timed
+    if ev.deadline < 0.0:
+        _timed_count = _timed_count + 1
+    _timed_seq = _timed_seq + 1
+    ev.deadline = deadline
+    ev.timed_seq = _timed_seq
+    heapq.heappush(_timed, (deadline, _timed_seq, ev))
+    if len(_timed) > 2 * _timed_count + 64:
+        #too many stale entries, e.g. events that were re-added with a later timeout many times
+        _timed = [entry for entry in _timed if (<__event>entry[2]).deadline >= 0.0 and (<__event>entry[2]).timed_seq == entry[1]]
+        heapq.heapify(_timed)
+    return 0
+
+cdef void __timed_remove(__event ev):
+    global _timed_count
+    if ev.deadline >= 0.0:
+        ev.deadline = -1.0
+        _timed_count = _timed_count - 1
+
+cdef double __timed_next() except? -2.0:
+    #the earliest deadline, or -1.0 when no event has a timeout
+    cdef __event ev
+    while _timed:
+        deadline, seq, ev = _timed[0]
+        if ev.deadline >= 0.0 and ev.timed_seq == seq:
+            return deadline
+        heapq.heappop(_timed) #stale
+    return -1.0
+
+cdef double __now():
+    cdef timeval tv
+    gettimeofday(&tv, NULL)
+    return <double>tv.tv_sec + (<double>tv.tv_usec / 1000000.0)
+
+cdef void __trigger(__list *trig, short flags):
+    global head
+    global tail
+    if trig.next != NULL or tail == trig:
+        #already triggered during this loop
+        trig.flags = trig.flags | flags
+        return
+    trig.flags = flags
+    trig.next = NULL
+    if head == NULL:
+        head = trig
+        tail = trig
+    else:
+        tail.next = trig
+        tail = trig
+
+cdef void __signal_handler(int signo):
+    cdef char c
+    c = <char>signo
+    write(signal_pipe[1], &c, 1)
+
+cdef int __ctl(int fd, unsigned int interest) except -1:
+    #makes sure that epoll has *interest* registered for fd
+    cdef epoll_event ev
+    cdef __fdinfo *info
+    cdef int op
+    info = &fdtable[fd]
+    if info.registered == interest:
+        return 0
+    ev.events = interest
+    ev.data.fd = fd
+    if interest == 0:
+        #the fd might already be closed, in which case it was removed from epoll automatically
+        epoll_ctl(epfd, EPOLL_CTL_DEL, fd, &ev)
+    else:
+        if info.registered == 0:
+            op = EPOLL_CTL_ADD
+        else:
+            op = EPOLL_CTL_MOD
+        if epoll_ctl(epfd, op, fd, &ev) == -1:
+            #we might have lost track of this fd, because it was closed (and reused) without deleting its events
+            if op == EPOLL_CTL_ADD and errno == EEXIST:
+                op = EPOLL_CTL_MOD
+            elif op == EPOLL_CTL_MOD and errno == ENOENT:
+                op = EPOLL_CTL_ADD
+            else:
+                raise EventError("could not register fd in epoll")
+            if epoll_ctl(epfd, op, fd, &ev) == -1:
+                raise EventError("could not register fd in epoll")
+    info.registered = interest
+    return 0
+
+cdef unsigned int __interest(__fdinfo *info):
+    #the interest needed for the armed events of an fd, together with what is already registered
+    cdef unsigned int interest
+    interest = info.registered
+    if info.reader != NULL and (<__event>info.reader).armed:
+        interest = interest | EPOLLIN
+    if info.writer != NULL and (<__event>info.writer).armed:
+        interest = interest | EPOLLOUT
+    return interest
+
+cdef int __grow_fdtable(int fd) except -1:
+    global fdtable
+    global fdtable_size
+    cdef int size
+    cdef int i
+    cdef __fdinfo *table
+    size = fdtable_size
+    if size == 0:
+        size = 1024
+    while size <= fd:
+        size = size * 2
+    table = <__fdinfo *>realloc(fdtable, size * sizeof(__fdinfo))
+    if table == NULL:
+        raise MemoryError()
+    for i from fdtable_size <= i < size:
+        table[i].reader = NULL
+        table[i].writer = NULL
+        table[i].registered = 0
+    fdtable = table
+    fdtable_size = size
+    return 0
+
+cdef class __event:
+    cdef public object data
+
+    cdef int fd
+    cdef short event_type
+    cdef int armed
+    cdef int attached
+    cdef double deadline
+    cdef long timed_seq
+    cdef __list trig
+    cdef int triggered_index
+
+    def __init__(self, object data):
+        self.data = data
+        self.fd = -1
+        self.event_type = 0
+        self.armed = 0
+        self.attached = 0
+        self.deadline = -1.0
+        self.timed_seq = 0
+        self.trig.event = <void *>self
+        self.trig.flags = 0
+        self.trig.fd = 0
+        self.trig.next = NULL
+        self.triggered_index = -1
+
+    def _set(self, int fd, short event_type):
+        if (event_type & C_EV_READ) and (event_type & C_EV_WRITE):
+            raise ValueError("an event can be either EV_READ or EV_WRITE, not both")
+        self.fd = fd
+        self.trig.fd = fd
+        self.event_type = event_type
+
+    cdef int _attach(self) except -1:
+        cdef __fdinfo *info
+        if self.event_type & C_EV_SIGNAL:
+            if self.fd <= 0 or self.fd >= MAX_SIGNAL:
+                raise ValueError("invalid signal number")
+            if signal_events[self.fd] != NULL:
+                raise EventError("there is already an event for this signal")
+            signal_events[self.fd] = <void *>self
+            signal_previous[self.fd] = signal(self.fd, __signal_handler)
+        elif self.event_type & (C_EV_READ | C_EV_WRITE):
+            if self.fd >= fdtable_size:
+                __grow_fdtable(self.fd)
+            info = &fdtable[self.fd]
+            #if there still is another event for this fd, its fd was closed without deleting the event
+            #(e.g. the event is waiting for the gc), the new event takes its place. epoll removed the closed
+            #fd by itself, so we forget what was registered
+            if self.event_type & C_EV_READ:
+                if info.reader != NULL:
+                    (<__event>info.reader)._detached()
+                    info.registered = 0
+                info.reader = <void *>self
+            else:
+                if info.writer != NULL:
+                    (<__event>info.writer)._detached()
+                    info.registered = 0
+                info.writer = <void *>self
+        self.attached = 1
+        return 0
+
+    cdef void _detached(self):
+        self.attached = 0
+        self.armed = 0
+        __timed_remove(self)
+
+    cdef int _detach(self) except -1:
+        cdef __fdinfo *info
+        if self.event_type & C_EV_SIGNAL:
+            signal_events[self.fd] = NULL
+            signal(self.fd, signal_previous[self.fd])
+        elif self.event_type & (C_EV_READ | C_EV_WRITE):
+            info = &fdtable[self.fd]
+            if self.event_type & C_EV_READ:
+                info.reader = NULL
+                if info.writer == NULL:
+                    __ctl(self.fd, 0)
+            else:
+                info.writer = NULL
+                if info.reader == NULL:
+                    __ctl(self.fd, 0)
+            #else the interest for this event will be removed when epoll reports it
+        self.attached = 0
+        return 0
+
+    def add(self, float timeout = -1):
+        """Add event to be executed after an optional timeout."""
+        if not self.attached:
+            self._attach()
+        self.armed = 1
+        if self.event_type & (C_EV_READ | C_EV_WRITE):
+            __ctl(self.fd, __interest(&fdtable[self.fd]))
+        if timeout >= 0.0:
+            __timed_add(self, __now() + timeout)
+        else:
+            __timed_remove(self)
+
+    def pending(self, int event_type):
+        """Return 1 if the event is scheduled to run, or else 0."""
+        if self.armed and ((self.event_type & event_type) or (event_type & C_EV_TIMEOUT and self.deadline >= 0.0)):
+            return 1
+        else:
+            return 0
+
+    cdef void _fire(self, short flags):
+        if not (self.event_type & C_EV_PERSIST) or (flags & C_EV_TIMEOUT):
+            self.armed = 0
+        if not self.armed:
+            __timed_remove(self)
+        __trigger(&self.trig, flags)
+
+    def delete(self):
+        global head
+        global tail
+        cdef __list* cur
+        cdef __list* prev
+        cdef int i
+        self.armed = 0
+        __timed_remove(self)
+        if self.attached:
+            self._detach()
+        # Remove the trigger from list of already triggered (but not processed) events
+        cur = head
+        prev = NULL
+        while cur != NULL:
+            if cur == &self.trig:
+                if cur == tail:
+                    tail = prev
+                if cur == head:
+                    head = cur.next
+                else:
+                    prev.next = cur.next
+                cur.next = NULL
+                break
+            prev = cur
+            cur = cur.next
+        # Remove from the list of triggered events returned by 'triggered' (but not processed)
+        i = self.triggered_index
+        if i >= 0:
+            #_triggered is None when the module is cleared at exit
+            if _triggered is not None and i < len(_triggered) and _triggered[i] is self:
+                _triggered[i] = None
+            self.triggered_index = -1
+
+    def __dealloc__(self):
+        self.delete()
+
+    def __repr__(self):
+        return '<_epoll.event id=0x%x, fd=%d, armed=%d, data=%s>' % (id(self), self.fd, self.armed, self.data)
+
+def event(fd, event_type, data):
+    e = __event(data)
+    e._set(fd, event_type)
+    return e
+
+def version():
+    return 'native'
+
+def method():
+    return 'epoll'
+
+def has_next():
+    global head
+    return head != NULL
+
+def next():
+    global head
+    if head == NULL:
+        return None
+    else:
+        triggered = (<__event>head.event, head.flags, head.fd)
+        __pop()
+        return triggered
+
+cdef void __pop():
+    #removes the first event from the list of triggered events
+    global head
+    global tail
+    cdef __list *cur
+    cur = head
+    head = cur.next
+    cur.next = NULL
+    if head == NULL:
+        tail = NULL
+
+def triggered():
+    """Returns all events that were triggered during the last call to 'loop' in a single
+    list [event, event_type, event, event_type, ...], see concurrence._event.triggered."""
+    global head
+    cdef __event ev
+    cdef int i
+    del _triggered[:]
+    i = 0
+    while head != NULL:
+        ev = <__event>head.event
+        ev.triggered_index = i
+        _triggered.append(ev)
+        _triggered.append(head.flags)
+        __pop()
+        i = i + 2
+    return _triggered
+
+cdef void __read_signals():
+    cdef char buf[64]
+    cdef int n
+    cdef int i
+    cdef int signo
+    cdef __event ev
+    while 1:
+        n = read(signal_pipe[0], buf, 64)
+        if n <= 0:
+            break
+        for i from 0 <= i < n:
+            signo = buf[i]
+            if signo > 0 and signo < MAX_SIGNAL and signal_events[signo] != NULL:
+                ev = <__event>signal_events[signo]
+                if ev.armed:
+                    ev._fire(C_EV_SIGNAL)
+
+cdef void __process(int fd, unsigned int ready):
+    cdef __fdinfo *info
+    cdef __event ev
+    cdef unsigned int interest
+    info = &fdtable[fd]
+    interest = info.registered
+    if ready & (EPOLLIN | EPOLLHUP | EPOLLERR):
+        if info.reader != NULL and (<__event>info.reader).armed:
+            ev = <__event>info.reader
+            ev._fire(C_EV_READ)
+        else:
+            interest = interest & ~EPOLLIN
+    if ready & (EPOLLOUT | EPOLLHUP | EPOLLERR):
+        if info.writer != NULL and (<__event>info.writer).armed:
+            ev = <__event>info.writer
+            ev._fire(C_EV_WRITE)
+        else:
+            interest = interest & ~EPOLLOUT
+    if interest != info.registered:
+        __ctl(fd, interest)
+
+def loop():
+    cdef int n
+    cdef int i
+    cdef int fd
+    cdef int timeout
+    cdef double now
+    cdef double deadline
+    global head
+    if head != NULL:
+        raise EventError("can only enter loop when all previous events have been read")
+
+    timeout = -1
+    deadline = __timed_next()
+    if deadline >= 0.0:
+        now = __now()
+        if deadline <= now:
+            timeout = 0
+        else:
+            timeout = <int>((deadline - now) * 1000.0) + 1 #round up to ms
+
+    with nogil:
+        n = epoll_wait(epfd, events, MAX_EVENTS, timeout)
+
+    if n == -1:
+        if errno == EINTR:
+            n = 0 #a signal was received, it is processed trough the signal pipe
+        else:
+            raise EventError("error in epoll_wait")
+
+    for i from 0 <= i < n:
+        fd = events[i].data.fd
+        if fd == signal_pipe[0]:
+            __read_signals()
+        else:
+            __process(fd, events[i].events)
+
+    if _timed_count:
+        now = __now()
+        expired = []
+        deadline = __timed_next()
+        while deadline >= 0.0 and deadline <= now:
+            expired.append(heapq.heappop(_timed)[2])
+            deadline = __timed_next()
+        for e in expired:
+            (<__event>e)._fire(C_EV_TIMEOUT)
+
+    return head != NULL
+
+cdef int __init_signal_pipe() except -1:
+    cdef epoll_event ev
+    if pipe(signal_pipe) == -1:
+        raise EventError("could not create signal pipe")
+    fcntl(signal_pipe[0], F_SETFL, fcntl(signal_pipe[0], F_GETFL, 0) | O_NONBLOCK)
+    fcntl(signal_pipe[1], F_SETFL, fcntl(signal_pipe[1], F_GETFL, 0) | O_NONBLOCK)
+    ev.events = EPOLLIN
+    ev.data.fd = signal_pipe[0]
+    if epoll_ctl(epfd, EPOLL_CTL_ADD, signal_pipe[0], &ev) == -1:
+        raise EventError("could not register signal pipe")
+    return 0
+
+def init():
+    global epfd
+    cdef int i
+    if epfd != -1:
+        return
+    for i from 0 <= i < MAX_SIGNAL:
+        signal_events[i] = NULL
+    epfd = epoll_create(MAX_EVENTS)
+    if epfd == -1:
+        raise EventError("could not create epoll fd")
+    __init_signal_pipe()
+
+def reinit():
+    #reinit epoll in a forked process, the child must not share the epoll fd or signal pipe with its parent
+    global epfd
+    cdef int fd
+    cdef epoll_event ev
+    if epfd == -1:
+        raise EventError("can only re-init when we did init first")
+    close(epfd)
+    close(signal_pipe[0])
+    close(signal_pipe[1])
+    epfd = epoll_create(MAX_EVENTS)
+    if epfd == -1:
+        raise EventError("could not create epoll fd")
+    __init_signal_pipe()
+    for fd from 0 <= fd < fdtable_size:
+        if fdtable[fd].registered != 0:
+            ev.events = fdtable[fd].registered
+            ev.data.fd = fd
+            if epoll_ctl(epfd, EPOLL_CTL_ADD, fd, &ev) == -1:
+                fdtable[fd].registered = 0
@@ -85,6 +85,10 @@ cdef __list* tail
 head = NULL
 tail = NULL
 
+#the list returned by 'triggered', it is reused for every call so that we don't
+#allocate a new list every time
+_triggered = []
+
 cdef void __event_handler(int fd, short flags, void* arg) nogil:
     cdef __list *tmp
     cdef __list *trig
@@ -107,6 +111,7 @@ cdef class __event:
 
     cdef event_t ev
     cdef __list trig
+    cdef int triggered_index
 
     def __init__(self, object data):
         self.data = data
@@ -114,6 +119,7 @@ cdef class __event:
         self.trig.flags = 0
         self.trig.fd = 0
         self.trig.next = NULL
+        self.triggered_index = -1
 
     def _set(self, int fd, short event_type):
         event_set(&self.ev, fd, event_type, __event_handler, <void *>&self.trig)
@@ -157,6 +163,14 @@ cdef class __event:
                     prev.next = cur.next
             prev = cur
             cur = cur.next
+        # Remove from the list of triggered events returned by 'triggered' (but not processed)
+        cdef int i
+        i = self.triggered_index
+        if i >= 0:
+            #_triggered is None when the module is cleared at exit
+            if _triggered is not None and i < len(_triggered) and _triggered[i] is self:
+                _triggered[i] = None
+            self.triggered_index = -1
 
     def __dealloc__(self):
         self.delete()
@@ -188,6 +202,26 @@ def next():
         head = head.next
         return triggered
 
+def triggered():
+    """Returns all events that were triggered during the last call to 'loop' in a single
+    list [event, event_type, event, event_type, ...]. This is cheaper than
+    calling 'has_next' and 'next' for every event. If an event is deleted
+    before it is processed, its entry in the list is replaced by None.
+    Note that the same list is reused on the next call."""
+    global head
+    cdef __event ev
+    cdef int i
+    del _triggered[:]
+    i = 0
+    while head != NULL:
+        ev = <__event>head.event
+        ev.triggered_index = i
+        _triggered.append(ev)
+        _triggered.append(head.flags)
+        head = head.next
+        i = i + 2
+    return _triggered
+
 def loop():
     cdef int result
     global head
@@ -3,8 +3,11 @@
 # This module is part of the Concurrence Framework and is released under
 # the New BSD License: http://www.opensource.org/licenses/bsd-license.php
 
+import os
 import sys
 import time
+import fcntl
+import errno
 import logging
 import weakref
 import collections
@@ -47,6 +50,9 @@ TIMEOUT_ABSOLUTE_CUTOFF = 3600 * 24
 TIMEOUT_NEVER = -1
 TIMEOUT_CURRENT = -2
 
+TIMER_WHEEL_RESOLUTION = 0.01 #seconds per tick of the scheduler timer wheel
+TIMER_WHEEL_SIZE = 1024 #nr of slots in the timer wheel, e.g. one revolution takes ~10 seconds
+
 class TimeoutError(Exception):
     """This exception can be raised by various methods that accept *timeout* parameters."""
     pass
@@ -65,7 +71,7 @@ class Event(object):
     pass
 
 class FileDescriptorEvent(Event):
-    __slots__ = ['_event', '_channel', '_current_callback']
+    __slots__ = ['_event', '_channel', '_current_callback', '_timer']
 
     def __init__(self, fd, rw):
         if rw == 'r':
@@ -77,15 +83,26 @@ class FileDescriptorEvent(Event):
         self._event = event.event(fd, event_type, self._on_event)
         self._channel = Channel() #this is were wait will block on
         self._current_callback = None
+        self._timer = None
 
     def _on_event(self, event_type):
         if self._current_callback is None:
             return #already closed
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
         if event_type & event.EV_TIMEOUT:
             self._current_callback(True)
         else:
             self._current_callback(False)
 
+    def _on_timeout(self):
+        self._timer = None
+        if self._current_callback is None:
+            return #already closed
+        self._event.delete() #we are no longer interested in the fd
+        self._current_callback(True)
+
     def _channel_callback(self, has_timedout):
         if has_timedout:
             self._channel.send_exception(TimeoutError, "timeout on fd event")
@@ -94,22 +111,35 @@ class FileDescriptorEvent(Event):
 
     def notify(self, callback, timeout = TIMEOUT_CURRENT):
         self._current_callback = callback
-        if timeout == TIMEOUT_NEVER:
-            self._event.add() #no timeout
-        elif timeout == TIMEOUT_CURRENT:
-            timeout = Tasklet.get_current_timeout() #tasklet defined timeout
-            if timeout == TIMEOUT_NEVER:
-                self._event.add() #no timeout
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if timeout == TIMEOUT_CURRENT:
+            if Tasklet._deadline_count:
+                timeout = Tasklet.get_current_timeout() #tasklet defined timeout
             else:
-                self._event.add(timeout)
-        else:
-            self._event.add(timeout) #specific timeout
+                timeout = TIMEOUT_NEVER #no task has a timeout
+        #the timeout is kept in the scheduler's timer wheel instead of in libevent
+        self._event.add()
+        if timeout >= 0:
+            self._timer = _timers.add(timeout, self._on_timeout)
 
     def wait(self, timeout = TIMEOUT_CURRENT):
         self.notify(self._channel_callback, timeout)
         return self._channel.receive(TIMEOUT_NEVER) #note that we always return from notify based on timeout
 
+    def cancel(self):
+        """Cancels the pending :func:`notify` (if any), the callback will not be called."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._current_callback = None
+        self._event.delete()
+
     def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
         self._event.delete()
         self._event = None
         self._channel = None
@@ -152,6 +182,238 @@ class TimeoutEvent(Event):
         del self._event
         del self._callback
 
+class Timer(object):
+    """A callback that was scheduled on the :class:`TimerWheel`. Use :func:`cancel` to
+    prevent the callback from being called."""
+    __slots__ = ['_wheel', '_slot', '_tick', '_deadline', '_callback', '_args']
+
+    def __init__(self, wheel, deadline, callback, args):
+        self._wheel = wheel
+        self._slot = None
+        self._tick = 0
+        self._deadline = deadline
+        self._callback = callback
+        self._args = args
+
+    def cancel(self):
+        """Cancels this timer, it is safe to call this more than once or after the timer has fired."""
+        self._wheel._cancel(self)
+
+class TimerWheel(object):
+    """A hashed timer wheel. All timeouts of the scheduler (channel timeouts, fd event timeouts, sleeps)
+    are kept here instead of in individual libevent timeout events. Timers are hashed into one of
+    *size* slots based on the tick (of *resolution* seconds) at which they expire, so that adding and cancelling
+    a timer is O(1). The dispatch loop only needs a single libevent timeout to wake up at the next tick
+    that has timers (see :func:`next_timeout`) and then calls :func:`advance` to fire the expired timers."""
+
+    def __init__(self, resolution = TIMER_WHEEL_RESOLUTION, size = TIMER_WHEEL_SIZE):
+        self._resolution = resolution
+        self._size = size
+        self._slots = [set() for _ in range(size)]
+        self._expired = [] #timers that are due and will be fired on the next advance (in order)
+        self._tick = int(time.time() / resolution) #last tick that was processed
+        self._next_tick = None #no timer in the slots expires before this tick, None when unknown
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, timeout, callback, *args):
+        """Schedules *callback* to be called with *args* after *timeout* seconds. Returns a :class:`Timer`."""
+        deadline = time.time() + timeout
+        timer = Timer(self, deadline, callback, args)
+        if timeout <= 0.0:
+            #expire on next advance, without waiting for the next tick
+            slot = self._expired
+            slot.append(timer)
+        else:
+            #the first tick that starts after deadline, so that we will never fire early
+            tick = int(deadline / self._resolution) + 1
+            slot = self._slots[tick % self._size]
+            slot.add(timer)
+            timer._tick = tick
+            if self._next_tick is not None and tick < self._next_tick:
+                self._next_tick = tick
+        timer._slot = slot
+        self._count += 1
+        return timer
+
+    def _cancel(self, timer):
+        slot = timer._slot
+        if slot is None:
+            return #already fired or cancelled
+        timer._slot = None
+        timer._callback = None
+        timer._args = None
+        self._count -= 1
+        if type(slot) is set:
+            slot.discard(timer)
+            if not slot and self._next_tick is not None and slot is self._slots[self._next_tick % self._size]:
+                self._next_tick = None #the earliest slot became empty, next_timeout has to look again
+        #else it is in an expired list and will be skipped when that list is processed
+
+    def next_timeout(self, now = None):
+        """Returns the number of seconds until the next tick that has timers in it, or TIMEOUT_NEVER
+        if there are no timers."""
+        if self._expired:
+            return 0.0
+        if not self._count:
+            return TIMEOUT_NEVER
+        if now is None:
+            now = time.time()
+        if self._next_tick is None:
+            #scan for the first slot that has timers, this is remembered until that slot is processed or becomes empty,
+            #so the wheel is not scanned on every loop of the dispatcher when the timers are far away
+            slots = self._slots
+            size = self._size
+            start = self._tick + 1
+            for tick in xrange(start, start + size):
+                if slots[tick % size]:
+                    self._next_tick = tick
+                    break
+            else:
+                return self._resolution
+        return max(0.0, self._next_tick * self._resolution - now)
+
+    def advance(self, now = None):
+        """Fires all timers that have expired up until *now*."""
+        if now is None:
+            now = time.time()
+        now_tick = int(now / self._resolution)
+        if now_tick > self._tick and self._count:
+            slots = self._slots
+            size = self._size
+            due = []
+            for tick in xrange(max(self._tick + 1, now_tick - size + 1), now_tick + 1):
+                slot = slots[tick % size]
+                if slot:
+                    #a slot may also contain timers that expire in later revolutions of the wheel
+                    for timer in [timer for timer in slot if timer._tick <= now_tick]:
+                        slot.remove(timer)
+                        due.append(timer)
+            if due:
+                due.sort(key = lambda timer: timer._deadline)
+                expired = self._expired
+                for timer in due:
+                    timer._slot = expired
+                expired.extend(due)
+        self._tick = max(self._tick, now_tick)
+        if self._next_tick is not None and self._next_tick <= self._tick:
+            self._next_tick = None
+        if not self._expired:
+            return
+        #new timers added by the callbacks will go into a fresh list and are handled on the next advance
+        expired, self._expired = self._expired, []
+        for timer in expired:
+            if timer._slot is not expired:
+                continue #was cancelled
+            timer._slot = None
+            self._count -= 1
+            callback, args = timer._callback, timer._args
+            timer._callback = None
+            timer._args = None
+            try:
+                callback(*args)
+            except Exception:
+                logging.exception("unhandled exception in timer callback")
+
+#the scheduler's timer wheel, driven by the dispatch loop
+_timers = TimerWheel()
+
+class _Wakeup(object):
+    """A self-pipe trough which other threads (or signal handlers) hand callables to the dispatcher,
+    see :func:`call_soon_threadsafe`."""
+    def __init__(self):
+        self._calls = collections.deque() #appended by any thread, popped by the dispatcher
+        self._pending = False #whether a wakeup was written that the dispatcher did not yet read
+        self._event = None
+        self._r = self._w = -1
+
+    def open(self):
+        self.close()
+        self._r, self._w = os.pipe()
+        for fd in (self._r, self._w):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._event = event.event(self._r, event.EV_READ | event.EV_PERSIST, self._on_event)
+        self._event.add()
+        self._pending = False
+        if self._calls:
+            self.wakeup() #calls made before the dispatcher was started
+
+    def close(self):
+        if self._event is not None:
+            self._event.delete()
+            self._event = None
+            os.close(self._r)
+            os.close(self._w)
+            self._r = self._w = -1
+
+    def wakeup(self):
+        #only write when no wakeup is pending, the dispatcher clears the flag after draining the pipe
+        if not self._pending and self._w != -1:
+            self._pending = True
+            try:
+                os.write(self._w, 'x')
+            except OSError, e:
+                if e.errno != errno.EAGAIN:
+                    raise #if the pipe is full, a wakeup is pending anyway
+
+    def call(self, f, args):
+        self._calls.append((f, args))
+        self.wakeup()
+
+    def _on_event(self, event_type):
+        try:
+            while os.read(self._r, 4096):
+                pass
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+        self._pending = False
+        calls = self._calls
+        while calls:
+            f, args = calls.popleft()
+            try:
+                f(*args)
+            except Exception:
+                logging.exception("unhandled exception in threadsafe call")
+
+_wakeup = _Wakeup()
+
+def call_soon_threadsafe(f, *args):
+    """Schedules callable *f* to be called with *args* by the dispatcher as soon as possible. This is the
+    only function of Concurrence that may be called from another OS thread (or from a signal handler).
+    *f* is called from the dispatch loop, so it must not block; start a new :class:`Tasklet` from it for
+    anything that might (see also :func:`Channel.send_threadsafe`)."""
+    _wakeup.call(f, args)
+
+_round_callbacks = [] #called by the dispatcher at the end of the current round
+
+def call_at_round_end(f, *args):
+    """Schedules callable *f* to be called once with *args* at the end of the current round of the dispatcher, that is when
+    all runnable tasks have run and before the dispatcher waits for IO. This lets work that was requested by many tasks during
+    a round be done once (e.g. the deferred flushes of :class:`~concurrence.io.buffered.BufferedWriter`). *f* is called from
+    the dispatch loop, so it must not block. Tasks that become runnable because of *f* are run before the dispatcher waits."""
+    _round_callbacks.append((f, args))
+
+def _end_round():
+    global _round_callbacks
+    callbacks, _round_callbacks = _round_callbacks, []
+    for f, args in callbacks:
+        try:
+            f(*args)
+        except Exception:
+            logging.exception("unhandled exception in round end callback")
+
+#monkey patch fork, so that a forked child gets its own wakeup pipe
+_os_fork = os.fork
+def _fork():
+    pid = _os_fork()
+    if pid == 0 and _wakeup._event is not None:
+        _wakeup.open()
+    return pid
+os.fork = _fork
+
 class Message():
     def __init__(self, reply_channel = None):
         self._reply_channel = reply_channel
@@ -245,6 +507,13 @@ class Tasklet(stackless.tasklet):
 
     all = set() #list of all currently alive tasklets (e.g. tasklets that have not finished execution yet).
 
+    _pool = [] #finished tasklets that are waiting to be reused by spawn_pooled
+    POOL_SIZE = 1024 #max nr of finished tasklets that are kept in the pool
+
+    #nr of tasklets that currently have a deadline (timeout time) set. as long as this is 0 the blocking
+    #primitives don't need to look up the current tasklet and its timeout at all
+    _deadline_count = 0
+
     def __init__(self):
         """Please use :func:`new` to create new tasklets"""
         stackless.tasklet.__init__(self)
@@ -254,6 +523,7 @@ class Tasklet(stackless.tasklet):
         self._join_channel = None
         self._mailbox = None
         self._timeout_time = TIMEOUT_NEVER #the timeout time (unix timestamp) at which this task will timeout
+        self._timeout_stack = None #previous timeout times, see push_timeout/pop_timeout
         self.all.add(self)
 
     def __exec__(self, f, *args, **kwargs):
@@ -284,23 +554,49 @@ class Tasklet(stackless.tasklet):
             else:
                 raise
         finally:
-            #i am finished so remove myself from my parents child list
-            parent = self.parent()
-            if parent:
-                parent._remove_child(self)
-            children = self.children()
-            if children:
-                for child in children:
-                    if parent:
-                        child._set_parent(parent)
-                        parent._add_child(child)
-                    else:
-                        child._set_parent(None)
-            self._parent = None
-            self._children = None
-            self._join_channel = None
-            self._mailbox = None
-            self.all.remove(self)
+            self._finish()
+
+    def _finish(self):
+        #i am finished so remove myself from my parents child list
+        parent = self.parent()
+        if parent:
+            parent._remove_child(self)
+        children = self.children()
+        if children:
+            for child in children:
+                if parent:
+                    child._set_parent(parent)
+                    parent._add_child(child)
+                else:
+                    child._set_parent(None)
+        self._parent = None
+        self._children = None
+        self._join_channel = None
+        self._mailbox = None
+        self._timeout_stack = None
+        self._set_deadline(TIMEOUT_NEVER)
+        self.all.discard(self)
+
+    def _pooled_loop(self, f, args, kwargs):
+        #runs the functions given to spawn_pooled, putting itself back in the pool in between
+        pool = self._pool
+        pool_channel = self._pool_channel
+        while True:
+            try:
+                f(*args, **kwargs)
+            except Exception:
+                logging.exception("unhandled exception in pooled tasklet")
+            finally:
+                self._finish()
+            f = args = kwargs = None #don't keep these alive while waiting in the pool
+            if len(pool) >= self.POOL_SIZE:
+                return
+            pool.append(self)
+            try:
+                f, args, kwargs = pool_channel.receive()
+            except:
+                pool.remove(self)
+                raise
 
     def has_finished(self):
         """Returns whether this Tasklet has already finished or not (either with a result of with an exception)."""
@@ -407,23 +703,24 @@ class Tasklet(stackless.tasklet):
         results is returned. If a task finishes with an exception the result value for that task will be an instance of :class:`JoinError`.
         Optionally a *timeout* for the wait can be specified. If all *tasks* do not finish within *timeout* a :class:`TimeoutError` will be
         raised."""
-        #TODO honor current tasklet timeout
-
-        if timeout != -1:
-            deadline = time.time() + timeout
+        if timeout < 0:
+            #TIMEOUT_NEVER, or TIMEOUT_CURRENT in which case every join honors the deadline of the current task
+            deadline = None
         else:
-            deadline = -1
+            deadline = time.time() + timeout
 
         results = {}
 
         for t in tasks[:]: #tasks are copied to prevent modification during iteration
             try:
-                if deadline == -1:
-                    results[t] = cls.join(t, -1)
+                if deadline is None:
+                    results[t] = cls.join(t, timeout)
                 else:
-                    results[t] = cls.join(t, deadline - time.time())
+                    results[t] = cls.join(t, max(0.0, deadline - time.time()))
             except JoinError, je:
                 results[je.tasklet] = je
+            except TimeoutError:
+                raise
             except Exception:
                 assert False, "expecting only join errors here"
 
@@ -517,11 +814,21 @@ class Tasklet(stackless.tasklet):
     @classmethod
     def sleep(cls, timeout):
         """Blocks the current task for the given *timeout* in seconds."""
-        sleep_channel = Channel()
-        try:
-            sleep_channel.receive(timeout)
-        except TimeoutError:
-            pass #expected to happen after timeout
+        if timeout < 0:
+            sleep_channel = Channel()
+            try:
+                sleep_channel.receive(timeout)
+            except TimeoutError:
+                pass #expected to happen after timeout
+        else:
+            #wake up trough the timer wheel, this is cheaper than raising a TimeoutError in the task
+            sleep_channel = stackless.channel()
+            sleep_channel.preference = -1
+            timer = _timers.add(timeout, sleep_channel.send, None)
+            try:
+                sleep_channel.receive()
+            finally:
+                timer.cancel()
 
     @classmethod
     def current(cls):
@@ -564,6 +871,49 @@ class Tasklet(stackless.tasklet):
 
         return t
 
+    @classmethod
+    def spawn_pooled(cls, f, name = '', track = False):
+        """Like :func:`new`, creates a new task that will run callable *f*, but reuses a task from a pool of finished
+        tasks when one is available. This is a lot cheaper than creating a new task, and is meant for the
+        many short lived tasks of a server (e.g. a task per request).
+
+        Unlike tasks created by :func:`new`, the result of *f* is discarded and an exception raised by *f* is logged;
+        a pooled task cannot be joined. Unless *track* is True, the task is not added to :attr:`all` and does
+        not become a child of the current task. As the task is reused once *f* has finished, don't keep a reference to it
+        and don't leave any :class:`~concurrence.local.TaskLocal` state behind for it."""
+        if name is '':
+            name = f.__name__
+        def start(*args, **kwargs):
+            pool = cls._pool
+            if pool:
+                t = pool.pop()
+                t._pool_channel.send((f, args, kwargs))
+            else:
+                t = cls()
+                cls.all.discard(t) #pooled tasks are only in 'all' when tracked
+                t._pool_channel = stackless.channel()
+                t._pool_channel.preference = 1 #like a new task, a reused task is scheduled, but does not run right away
+                t.bind(t._pooled_loop)
+                t(f, args, kwargs)
+            t.name = name
+            if track:
+                cls.all.add(t)
+                parent = cls.current()
+                if isinstance(parent, cls):
+                    t._set_parent(parent)
+                    parent._add_child(t)
+            return t
+        return start
+
+    @classmethod
+    def run_in_thread(cls, f, *args, **kwargs):
+        """Calls *f* with the given arguments in an OS thread of the default
+        :class:`~concurrence.threadpool.ThreadPool`, so that a blocking call does not block the dispatcher.
+        The current task blocks until the call has completed, while other tasks keep running.
+        Returns the result of *f*, or raises the exception that was raised by *f*."""
+        from concurrence import threadpool
+        return threadpool.default().run(f, *args, **kwargs)
+
     def __str__(self):
         return "<tasklet id='%0x' name='%s'>" % (id(self), self.name)
 
@@ -600,14 +950,49 @@ class Tasklet(stackless.tasklet):
         """Sets the time at which this task will timeout to *timeout* seconds in the future."""
         assert timeout != TIMEOUT_CURRENT
         if timeout < 0:
-            self._timeout_time = TIMEOUT_NEVER
+            self._set_deadline(TIMEOUT_NEVER)
         elif relative:
-            self._timeout_time = time.time() + timeout
+            self._set_deadline(time.time() + timeout)
         else:
-            self._timeout_time = timeout
+            self._set_deadline(timeout)
 
     timeout = property(get_timeout, set_timeout)
 
+    def _set_deadline(self, deadline):
+        #keeps track of the nr of tasks that have a deadline
+        if self._timeout_time < 0:
+            if deadline >= 0:
+                Tasklet._deadline_count += 1
+        elif deadline < 0:
+            Tasklet._deadline_count -= 1
+        self._timeout_time = deadline
+
+    def push_timeout(self, timeout):
+        """Pushes a new *timeout* in seconds for this task. The resulting timeout will never be later than the current
+        timeout of the task. Every push must be matched by a :func:`pop_timeout`. Normally you would use :class:`~concurrence.timer.Timeout`."""
+        current_timeout = self._timeout_time
+        if self._timeout_stack is None:
+            self._timeout_stack = [current_timeout]
+        else:
+            self._timeout_stack.append(current_timeout)
+        if timeout >= 0:
+            deadline = time.time() + timeout
+            if current_timeout < 0 or deadline < current_timeout:
+                self._set_deadline(deadline)
+        #else TIMEOUT_NEVER or TIMEOUT_CURRENT, both keep the current timeout
+
+    def pop_timeout(self):
+        """Restores the timeout of this task to what it was before the last :func:`push_timeout`.
+        Returns whether there are still pushed timeouts left."""
+        timeout_stack = self._timeout_stack
+        assert timeout_stack, "unmatched pop, did you forget to push?"
+        self._set_deadline(timeout_stack.pop())
+        if timeout_stack:
+            return True
+        else:
+            self._timeout_stack = None
+            return False
+
     @classmethod
     def get_current_timeout(cls):
         """Returns the time in seconds left before the current task will timeout."""
@@ -622,6 +1007,31 @@ class Tasklet(stackless.tasklet):
     def count(cls):
         return len(cls.all)
 
+class _Selector(object):
+    """a task that is blocked in :func:`Channel.select`, it is woken up by the first of its sources that becomes ready"""
+    __slots__ = ['channel', 'fired']
+
+    pool = [] #selectors are reused
+
+    def __init__(self):
+        self.channel = stackless.channel()
+        self.channel.preference = -1 #like a receive, the selecting task continues right away
+        self.fired = False
+
+    def fire(self, result):
+        if self.fired:
+            return False
+        self.fired = True
+        self.channel.send(result)
+        return True
+
+    def fire_exception(self, args, kwargs):
+        if self.fired:
+            return False
+        self.fired = True
+        self.channel.send_exception(*args, **kwargs)
+        return True
+
 class Channel(object):
     """A Channel is a method for transfering control and/or communicate between Tasklets.
     Please note that the Channel class is basically a small wrapper around a
@@ -637,11 +1047,12 @@ class Channel(object):
     as a receiver arrives, the value of the sender is passed and execution continues with the receiver (The sender will become `runnable`
     again, but will be placed at the end of the scheduling queue).
     """
-    __slots__ = ['_channel']
+    __slots__ = ['_channel', '_selectors']
 
     def __init__(self, preference = -1):
         self._channel = stackless.channel()
         self._channel.preference = preference
+        self._selectors = None #the tasks that are blocked in select on this channel
 
     def _set_preference(self, p):
         self._channel.preference = p
@@ -665,6 +1076,10 @@ class Channel(object):
 
     def send_exception(self, *args, **kwargs):
         """Send an exception trough the channel instead of some value. This will immediatly raise the exception in the receiver."""
+        if self.balance >= 0 and self._selectors is not None:
+            for selector in self._selectors:
+                if selector.fire_exception(args, kwargs):
+                    return
         self._channel.send_exception(*args, **kwargs)
 
     def receive(self, timeout = TIMEOUT_CURRENT):
@@ -677,6 +1092,9 @@ class Channel(object):
         elif timeout == TIMEOUT_NEVER:
             #no timeout
             return self._channel.receive()
+        elif timeout == TIMEOUT_CURRENT and not Tasklet._deadline_count:
+            #no task has a timeout, so neither has the current one
+            return self._channel.receive()
         else:
             #either tasklet defined or specific timeout
             current_task = Tasklet.current()
@@ -684,18 +1102,16 @@ class Channel(object):
                 #tasklet defines the timeout
                 timeout = current_task.timeout
             #
-            if timeout == TIMEOUT_NEVER:
-                #still no timeout
+            if timeout < 0:
+                #still no timeout (TIMEOUT_NEVER)
                 return self._channel.receive()
             else:
                 #with timeout
-                def on_timeout():
-                    current_task.raise_exception(TimeoutError)
-                event_timeout = TimeoutEvent(timeout, on_timeout)
+                timer = _timers.add(timeout, current_task.raise_exception, TimeoutError)
                 try:
                     return self._channel.receive()
                 finally:
-                    event_timeout.close()
+                    timer.cancel()
 
     def receive_n(self, n):
         for i in range(n):
@@ -714,37 +1130,112 @@ class Channel(object):
         if self.balance < 0: 
             #if we know there is a receiver, we don't need timeout logic
             self._channel.send(value) 
-        elif timeout == TIMEOUT_NEVER:
+            return
+        if self._selectors is not None:
+            #no plain receiver, but a task might be blocked in select on this channel
+            for selector in self._selectors:
+                if selector.fire((self, value)):
+                    return
+        if timeout == TIMEOUT_NEVER:
             #no timeout
             self._channel.send(value)
+        elif timeout == TIMEOUT_CURRENT and not Tasklet._deadline_count:
+            #no task has a timeout, so neither has the current one
+            self._channel.send(value)
         else:
             #setup timeout event
             current_task = Tasklet.current()
             if timeout == TIMEOUT_CURRENT:
                 timeout = current_task.timeout
             #
-            if timeout == TIMEOUT_NEVER:
-                #still no timeout
+            if timeout < 0:
+                #still no timeout (TIMEOUT_NEVER)
                 self._channel.send(value)
             else:
                 #with timeout
-                def on_timeout():
-                    current_task.raise_exception(TimeoutError)
-                event_timeout = TimeoutEvent(timeout, on_timeout)
+                timer = _timers.add(timeout, current_task.raise_exception, TimeoutError)
                 try:
                     self._channel.send(value)
                 finally:
-                    event_timeout.close()
+                    timer.cancel()
+
+    def send_threadsafe(self, value):
+        """Sends *value* on the channel from another OS thread. Unlike :func:`send`, this never blocks the caller:
+        the value is passed to the dispatcher (see :func:`call_soon_threadsafe`), that sends it from a new task
+        when there is no receiver waiting."""
+        call_soon_threadsafe(self._send_later, value)
+
+    def _send_later(self, value):
+        if self.has_receiver():
+            self.send(value)
+        else:
+            Tasklet.new(self.send)(value, TIMEOUT_NEVER)
+
+    @classmethod
+    def select(cls, sources, timeout = TIMEOUT_CURRENT):
+        """Blocks the current task until one of *sources* is ready, where a source is either a :class:`Channel` or
+        a :class:`FileDescriptorEvent`. A channel is ready when it has a sender, an event when its file descriptor has become
+        readable or writable. Returns a tuple (source, value) of the first source that is ready, where value is the value
+        received from the channel, or None for an event. When several channels already have a sender, the first
+        one in *sources* is chosen.
+        Optionally you can specify a *timeout*. If no source becomes ready within the *timeout* period a :class:`TimeoutError`
+        is raised. No helper tasks are used; the sources are only watched for the duration of the call."""
+        if timeout == TIMEOUT_CURRENT:
+            if Tasklet._deadline_count:
+                timeout = Tasklet.get_current_timeout()
+            else:
+                timeout = TIMEOUT_NEVER
+        if _Selector.pool:
+            selector = _Selector.pool.pop()
+        else:
+            selector = _Selector()
+        n = 0 #nr of sources that are being watched
+        try:
+            for source in sources:
+                if isinstance(source, Channel):
+                    if source._channel.balance > 0:
+                        return source, source._channel.receive()
+                    if source._selectors is None:
+                        source._selectors = [selector]
+                    else:
+                        source._selectors.append(selector)
+                else:
+                    source.notify(lambda has_timedout, source = source: selector.fire((source, None)), TIMEOUT_NEVER)
+                n += 1
+            if timeout < 0:
+                return selector.channel.receive()
+            else:
+                timer = _timers.add(timeout, Tasklet.current().raise_exception, TimeoutError)
+                try:
+                    return selector.channel.receive()
+                finally:
+                    timer.cancel()
+        finally:
+            selector.fired = True
+            for source in sources[:n]:
+                if isinstance(source, Channel):
+                    selectors = source._selectors
+                    if len(selectors) == 1:
+                        source._selectors = None
+                    else:
+                        selectors.remove(selector)
+                else:
+                    source.cancel()
+            if len(_Selector.pool) < 64:
+                selector.fired = False
+                _Selector.pool.append(selector)
 
 _running = False #whether we are currently in dispatch, used stop the dispatch (use quit method)
 _exitcode = EXIT_CODE_OK
+_instrument = None #the scheduler instrumentation when enabled, see concurrence.instrument
 
 def quit(exitcode = EXIT_CODE_OK):
-    """Quits the concurrence program and exit to the OS with *exitcode*"""
+    """Quits the concurrence program and exit to the OS with *exitcode*. This may also be called from another OS thread."""
     global _running
     global _exitcode
     _exitcode = exitcode
     _running = False
+    _wakeup.wakeup() #make sure the dispatcher does not block in the event loop anymore
 
 #monkey patch sys exit to call our quit in order
 #to properly finish our dispatch loop
@@ -782,11 +1273,13 @@ def _dispatch(f = None):
         quit(EXIT_CODE_SIGINT)
     event_interrupt = SignalEvent(SIGINT, interrupt)
 
-    #the heartbeat makes sure the main loop below at least
-    #makes a cycle every second. otherwise, if there are no pending signals
-    #libevent._loop would block indefinitly, causing our loop never to check
-    #if it still must be _running...
-    event_heartbeat = TimeoutEvent(1.0, None, True)
+    #other threads hand callables to the dispatcher trough the wakeup pipe, this is also how
+    #quit wakes up the event loop, so that our loop below notices that it must stop _running
+    _wakeup.open()
+
+    #a single libevent timeout that wakes up the loop for the next tick
+    #of the timer wheel that has timers in it
+    event_timers = event.event(-1, event.EV_TIMEOUT, lambda event_type: None)
 
     #as a convenience, user can provide a callable *f* to start a new task
     #lets start it here
@@ -803,10 +1296,15 @@ def _dispatch(f = None):
         #that will trigger tasks to become runnable
         #ad infinitum...
         while _running:
-            #first let any tasklets run until they have all become blocked on IO
+            #first let any tasklets run until they have all become blocked on IO,
+            #then end the round, which may make tasks runnable again
             try:
-                while stackless.getruncount() > 1:
-                    stackless.schedule()
+                while True:
+                    while stackless.getruncount() > 1:
+                        stackless.schedule()
+                    if not _round_callbacks:
+                        break
+                    _end_round()
             except Exception:
                 logging.exception("unhandled exception in dispatch schedule")
 
@@ -816,7 +1314,17 @@ def _dispatch(f = None):
             #make stackless need to use hard-switching, which is slow.
             #so we call 'loop' which blocks until something available.
             try:
-                event.loop()
+                timeout = _timers.next_timeout()
+                if timeout >= 0.0:
+                    event_timers.add(timeout)
+                if _instrument is None:
+                    event.loop()
+                else:
+                    _instrument.on_loop_enter()
+                    try:
+                        event.loop()
+                    finally:
+                        _instrument.on_loop_exit()
             except Exception:
                 logging.exception("unhandled exception in event loop")
 
@@ -824,19 +1332,30 @@ def _dispatch(f = None):
             #call the callback which is available as the 'data' object of the event
             #some callbacks may trigger direct action (for instance timeouts, signals)
             #others might resume a waiting task (socket io).
-            while event.has_next():
-                try:
-                    e, event_type, fd = event.next()
-                    e.data(event_type)
-                except Exception:
-                    logging.exception("unhandled exception in event callback")
+            #the triggered events are retrieved in 1 call as a flat list of (event, event_type) pairs,
+            #an event that was deleted by an earlier callback is replaced by None.
+            triggered = event.triggered()
+            i, n = 0, len(triggered)
+            while i < n:
+                e = triggered[i]
+                if e is not None:
+                    try:
+                        e.data(triggered[i + 1])
+                    except Exception:
+                        logging.exception("unhandled exception in event callback")
+                i += 2
+
+            #finally fire any expired timers, these may resume tasks that
+            #were waiting with a timeout
+            _timers.advance()
 
     finally:
         del e
         event_interrupt.close()
         del event_interrupt
-        event_heartbeat.close()
-        del event_heartbeat
+        _wakeup.close()
+        event_timers.delete()
+        del event_timers
 
     if DEBUG_LEAK:
         logging.warn("alive objects:")
@@ -848,6 +1367,16 @@ def _dispatch(f = None):
     sys._exit(_exitcode)
 
 def _profile(f = None):
+    #samples the stacks of the tasklets during the whole run, and writes them as collapsed stacks at exit
+    from concurrence import profiler
+    prof = profiler.enable()
+    try:
+        _dispatch(f)
+    finally:
+        profiler.disable()
+        logging.warn("wrote profile to %s", prof.write())
+
+def _cprofile(f = None):
     from cProfile import Profile
     prof = Profile()
     try:
@@ -864,6 +1393,8 @@ def _profile(f = None):
 def dispatch(f = None):
     if '-Xprofile' in sys.argv:
         _profile(f)
+    elif '-Xcprofile' in sys.argv:
+        _cprofile(f)
     else:
         #_profile(f)
         _dispatch(f)
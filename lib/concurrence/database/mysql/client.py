@@ -6,7 +6,7 @@
 #TODO supporting closing a halfread resultset (e.g. automatically read and discard rest)
 
 from concurrence import TimeoutError, TIMEOUT_CURRENT
-from concurrence.io import Buffer
+from concurrence.io import bufferpool
 from concurrence.io.socket import Socket
 from concurrence.database.mysql import BufferedPacketReader, BufferedPacketWriter, PACKET_READ_RESULT, CAPS, COMMAND
 
@@ -81,7 +81,7 @@ class Connection(object):
 
     def __init__(self):
         self.state = self.STATE_INIT
-        self.buffer = Buffer(1024 * 16)
+        self.buffer = None #taken from the buffer pool while connected
         self.socket = None
         self.reader = None
         self.writer = None
@@ -209,6 +209,12 @@ class Connection(object):
             self.socket = None
             self.state = self.STATE_ERROR
             raise
+        finally:
+            if self.buffer is not None:
+                bufferpool.default().put(self.buffer)
+                self.buffer = None
+                self.reader = None
+                self.writer = None
 
     def connect(self, host = "localhost", port = 3306, user = "", passwd = "", db = "", autocommit = None, charset = None):
         """connects to the given host and port with user and passwd"""
@@ -230,6 +236,8 @@ class Connection(object):
 
             self.state = self.STATE_CONNECTING
             self.socket = Socket.connect(addr, TIMEOUT_CURRENT)
+            if self.buffer is None:
+                self.buffer = bufferpool.default().get(1024 * 16)
             self.reader = BufferedPacketReader(self.socket, self.buffer)
             self.writer = BufferedPacketWriter(self.socket, self.buffer)
             self._handshake(user, passwd, db)
@@ -249,14 +257,31 @@ class Connection(object):
             return self
         except TimeoutError:
             self.state = self.STATE_INIT
+            self._connect_failed()
             raise
         except ClientLoginError:
             self.state = self.STATE_INIT
+            self._connect_failed()
             raise
         except Exception:
             self.state = self.STATE_ERROR
+            self._connect_failed()
             raise
 
+    def _connect_failed(self):
+        #a failed connect does not keep its socket and pooled buffer
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except Exception:
+                pass #don't hide the error of the connect
+            self.socket = None
+        if self.buffer is not None:
+            bufferpool.default().put(self.buffer)
+            self.buffer = None
+            self.reader = None
+            self.writer = None
+
     def close(self):
         """close this connection"""
         assert self.socket, "make sure socket is opened when calling close"
@@ -1,49 +1,510 @@
-from stackless import *
-import adns
+# Copyright (C) 2009, Hyves (Startphone Ltd.)
+#
+# This module is part of the Concurrence Framework and is released under
+# the New BSD License: http://www.opensource.org/licenses/bsd-license.php
+
+"""A stub resolver that looks up host names without blocking the dispatcher.
+
+Queries are sent over UDP to the name servers of ``/etc/resolv.conf`` (and again over TCP when the answer was truncated).
+Answers are cached for as long as their TTL says. Names that don't exist are cached as well (for the TTL of the SOA record
+in the answer, or :data:`NEGATIVE_TTL`). Tasks that look up the same name at the same time share a single query.
+The entries of ``/etc/hosts`` take precedence over the name servers. Like the resolver of the C library, a name with less
+dots than the ``ndots`` option is looked up in the domains of the ``search`` (or ``domain``) list of ``/etc/resolv.conf``
+first, so that short names such as ``memcache1`` resolve as before::
+
+    from concurrence import dns
+
+    addresses = dns.resolve('www.google.com') #['74.125.77.147', ...]
+
+:class:`~concurrence.io.Connector` (and the clients that connect trough it) looks up the host of a (host, port) endpoint
+with the default resolver.
+"""
+from __future__ import with_statement
+
 import sys
+import time
+import random
+import struct
+import logging
+import _socket
+
+from concurrence import Channel, TimeoutError, TIMEOUT_CURRENT
+from concurrence.timer import Timeout
+from concurrence.io import Buffer, Socket, DatagramSocket, BufferedStream
+
+RESOLV_CONF = '/etc/resolv.conf'
+HOSTS = '/etc/hosts'
+
+DNS_PORT = 53
+TIMEOUT = 5.0 #default seconds to wait for an answer of a name server (as 'options timeout:n' in resolv.conf)
+ATTEMPTS = 2 #default nr of times the name servers are tried in turn (as 'options attempts:n' in resolv.conf)
+NDOTS = 1 #default nr of dots from which a name is tried as is before the search list (as 'options ndots:n' in resolv.conf)
+NEGATIVE_TTL = 60 #seconds a name that does not exist is cached when the answer does not tell
+MAX_CACHED = 10000 #max nr of names in the cache
+MAX_CNAMES = 16 #max length of a chain of CNAME records that is followed
+MAX_UDP_MESSAGE = 4096 #receive buffer size for answers over UDP
+
+TYPE_A = 1
+TYPE_NS = 2
+TYPE_CNAME = 5
+TYPE_SOA = 6
+TYPE_AAAA = 28
+CLASS_IN = 1
+
+RCODE_NOERROR = 0
+RCODE_SERVFAIL = 2
+RCODE_NXDOMAIN = 3
+
+class DNSError(IOError):
+    """Raised when a name could not be looked up"""
+
+class HostNotFoundError(DNSError):
+    """Raised when a name does not exist, or has no addresses"""
+
+class Record(object):
+    """A resource record. The *data* is the address of an A or AAAA record (as a string), the name of a CNAME record,
+    a tuple (mname, rname, serial, refresh, retry, expire, minimum) for a SOA record and the raw bytes for other records."""
+    __slots__ = ['name', 'type', 'ttl', 'data']
+
+    def __init__(self, name, type, ttl, data):
+        self.name = name
+        self.type = type
+        self.ttl = ttl
+        self.data = data
+
+    def __repr__(self):
+        return '<Record %s %d %d %r>' % (self.name, self.type, self.ttl, self.data)
+
+def _encode_name(name):
+    labels = [label for label in name.split('.') if label]
+    for label in labels:
+        if len(label) > 63:
+            raise DNSError("invalid name: %s" % name)
+    return ''.join([chr(len(label)) + label for label in labels]) + '\0'
+
+def _decode_name(data, offset):
+    #returns the (possibly compressed) name at offset and the offset right after it
+    labels = []
+    end = None
+    jumps = 0
+    while True:
+        n = ord(data[offset])
+        if n & 0xc0 == 0xc0:
+            if end is None:
+                end = offset + 2
+            jumps += 1
+            if jumps > 64:
+                raise DNSError("invalid message: compression loop")
+            offset = ((n & 0x3f) << 8) | ord(data[offset + 1])
+        elif n == 0:
+            offset += 1
+            break
+        else:
+            labels.append(data[offset + 1:offset + 1 + n])
+            offset += 1 + n
+    if end is None:
+        end = offset
+    return '.'.join(labels), end
+
+class Message(object):
+    """A DNS message, the *questions* are (name, type) tuples, the *answers* and *authority* are :class:`Record` objects.
+    Only class IN is supported, and the additional section is ignored."""
+    FLAG_QR = 0x8000 #this is a response
+    FLAG_AA = 0x0400
+    FLAG_TC = 0x0200 #the message was truncated
+    FLAG_RD = 0x0100 #recursion desired
+    FLAG_RA = 0x0080
+
+    def __init__(self, id = 0, flags = 0, questions = None, answers = None, authority = None):
+        self.id = id
+        self.flags = flags
+        self.questions = questions or []
+        self.answers = answers or []
+        self.authority = authority or []
+
+    @property
+    def rcode(self):
+        return self.flags & 0xf
+
+    def _encode_record(self, record):
+        if record.type == TYPE_A:
+            rdata = _socket.inet_pton(_socket.AF_INET, record.data)
+        elif record.type == TYPE_AAAA:
+            rdata = _socket.inet_pton(_socket.AF_INET6, record.data)
+        elif record.type in (TYPE_CNAME, TYPE_NS):
+            rdata = _encode_name(record.data)
+        elif record.type == TYPE_SOA:
+            rdata = _encode_name(record.data[0]) + _encode_name(record.data[1]) + struct.pack('!5I', *record.data[2:])
+        else:
+            rdata = record.data
+        return _encode_name(record.name) + struct.pack('!HHIH', record.type, CLASS_IN, record.ttl, len(rdata)) + rdata
+
+    def encode(self):
+        """returns the message in wire format"""
+        parts = [struct.pack('!6H', self.id, self.flags, len(self.questions), len(self.answers), len(self.authority), 0)]
+        for name, type in self.questions:
+            parts.append(_encode_name(name) + struct.pack('!HH', type, CLASS_IN))
+        for record in self.answers + self.authority:
+            parts.append(self._encode_record(record))
+        return ''.join(parts)
+
+    @classmethod
+    def _decode_record(cls, data, offset):
+        name, offset = _decode_name(data, offset)
+        type, _, ttl, length = struct.unpack('!HHIH', data[offset:offset + 10])
+        offset += 10
+        end = offset + length
+        if end > len(data):
+            raise DNSError("invalid message: truncated record")
+        if type == TYPE_A:
+            rdata = _socket.inet_ntop(_socket.AF_INET, data[offset:end])
+        elif type == TYPE_AAAA:
+            rdata = _socket.inet_ntop(_socket.AF_INET6, data[offset:end])
+        elif type in (TYPE_CNAME, TYPE_NS):
+            rdata = _decode_name(data, offset)[0]
+        elif type == TYPE_SOA:
+            mname, offset = _decode_name(data, offset)
+            rname, offset = _decode_name(data, offset)
+            rdata = (mname, rname) + struct.unpack('!5I', data[offset:offset + 20])
+        else:
+            rdata = data[offset:end]
+        return Record(name, type, ttl, rdata), end
+
+    @classmethod
+    def decode(cls, data):
+        """returns the :class:`Message` of wire format *data*, raises :class:`DNSError` when it is invalid"""
+        try:
+            id, flags, qdcount, ancount, nscount, _ = struct.unpack('!6H', data[:12])
+            message = cls(id, flags)
+            offset = 12
+            for i in range(qdcount):
+                name, offset = _decode_name(data, offset)
+                type, _ = struct.unpack('!HH', data[offset:offset + 4])
+                offset += 4
+                message.questions.append((name, type))
+            for records, count in [(message.answers, ancount), (message.authority, nscount)]:
+                for i in range(count):
+                    record, offset = cls._decode_record(data, offset)
+                    records.append(record)
+            return message
+        except (struct.error, IndexError, ValueError, _socket.error), e:
+            raise DNSError("invalid message: %s" % e)
+
+def _family(host):
+    #the address family of a numeric host, or None when it is a name
+    for family in (_socket.AF_INET, _socket.AF_INET6):
+        try:
+            _socket.inet_pton(family, host)
+            return family
+        except (_socket.error, ValueError, TypeError):
+            pass
+    return None
+
+class Resolver(object):
+    """A stub resolver that sends its queries to *nameservers* (a list of numeric hosts or (host, port) tuples, by default
+    the name servers of *resolv_conf*) and looks in the *hosts* file first. The *timeout* and *attempts* (by default from
+    *resolv_conf*) determine how long to wait for a name server, and how many times to try each of them. The domains of
+    *search* are appended to names with less than *ndots* dots (both by default from *resolv_conf*), see :func:`resolve`."""
+    log = logging.getLogger('Resolver')
+
+    def __init__(self, nameservers = None, timeout = None, attempts = None, hosts = HOSTS, resolv_conf = RESOLV_CONF,
+                 search = None, ndots = None):
+        self.nameservers = []
+        self.timeout = TIMEOUT
+        self.attempts = ATTEMPTS
+        self.search = []
+        self.ndots = NDOTS
+        if resolv_conf is not None:
+            self._read_resolv_conf(resolv_conf)
+        if nameservers is not None:
+            self.nameservers = [type(nameserver) is tuple and nameserver or (nameserver, DNS_PORT) for nameserver in nameservers]
+        if not self.nameservers:
+            self.nameservers = [('127.0.0.1', DNS_PORT)]
+        if timeout is not None:
+            self.timeout = timeout
+        if attempts is not None:
+            self.attempts = attempts
+        if search is not None:
+            self.search = list(search)
+        if ndots is not None:
+            self.ndots = ndots
+        self._hosts = {} #(name, type) -> [addresses]
+        if hosts is not None:
+            self._read_hosts(hosts)
+        self._cache = {} #(name, type) -> (expires, addresses, error)
+        self._pending = {} #(name, type) -> [channels of the tasks waiting for the query in flight]
+        self._queries = 0
+        self._hits = 0
+        self._coalesced = 0
+        self._failures = 0
+
+    def _read_resolv_conf(self, path):
+        try:
+            f = open(path)
+        except IOError:
+            return
+        try:
+            for line in f:
+                fields = line.split('#')[0].split()
+                if len(fields) >= 2 and fields[0] == 'nameserver' and _family(fields[1]) is not None:
+                    self.nameservers.append((fields[1], DNS_PORT))
+                elif len(fields) >= 2 and fields[0] in ('search', 'domain'):
+                    #the last of these lines wins
+                    self.search = [domain.lower().rstrip('.') for domain in fields[1:]]
+                elif fields and fields[0] == 'options':
+                    for option in fields[1:]:
+                        if option.startswith('timeout:'):
+                            self.timeout = float(option[8:])
+                        elif option.startswith('attempts:'):
+                            self.attempts = int(option[9:])
+                        elif option.startswith('ndots:'):
+                            self.ndots = min(int(option[6:]), 15)
+        finally:
+            f.close()
+
+    def _read_hosts(self, path):
+        try:
+            f = open(path)
+        except IOError:
+            return
+        try:
+            for line in f:
+                fields = line.split('#')[0].split()
+                if len(fields) < 2:
+                    continue
+                family = _family(fields[0])
+                if family is not None:
+                    type = family == _socket.AF_INET6 and TYPE_AAAA or TYPE_A
+                    for name in fields[1:]:
+                        self._hosts.setdefault((name.lower(), type), []).append(fields[0])
+        finally:
+            f.close()
+
+    def query(self, name, type = TYPE_A):
+        """Returns the addresses of the A (or AAAA) records of *name*, following CNAME records. Raises
+        :class:`HostNotFoundError` when the name does not exist, or has no such records, and :class:`DNSError` when the
+        name servers could not be queried."""
+        key = (name.lower().rstrip('.'), type)
+        entry = self._cache.get(key)
+        if entry is not None:
+            expires, addresses, error = entry
+            if expires > time.time():
+                self._hits += 1
+                if error is not None:
+                    raise error
+                return list(addresses)
+            del self._cache[key]
+        waiting = self._pending.get(key)
+        if waiting is not None:
+            #a query for this name is in flight, wait for its result
+            self._coalesced += 1
+            channel = Channel()
+            waiting.append(channel)
+            return self._result(channel.receive(TIMEOUT_CURRENT))
+        self._pending[key] = waiting = []
+        result = (False, (DNSError, DNSError("query for %s was interrupted" % name), None))
+        try:
+            result = (True, self._lookup(key))
+        except Exception:
+            result = (False, sys.exc_info())
+        finally:
+            del self._pending[key]
+            for channel in waiting:
+                if channel.has_receiver():
+                    channel.send(result)
+                #else the task is gone (e.g. it timed out)
+        return self._result(result)
+
+    def _result(self, result):
+        ok, value = result
+        if ok:
+            return list(value)
+        else:
+            raise value[0], value[1], value[2]
+
+    def _store(self, key, ttl, addresses, error):
+        if len(self._cache) >= MAX_CACHED:
+            now = time.time()
+            for k, entry in self._cache.items():
+                if entry[0] <= now:
+                    del self._cache[k]
+            if len(self._cache) >= MAX_CACHED:
+                self._cache.clear()
+        self._cache[key] = (time.time() + ttl, addresses, error)
+
+    def _lookup(self, key):
+        #queries the name servers for key and caches the answer
+        name, type = key
+        try:
+            message = self._query(name, type)
+        except DNSError:
+            self._failures += 1
+            raise
+        if message.rcode == RCODE_NOERROR:
+            addresses, ttl = self._addresses(name, type, message.answers)
+            if addresses:
+                self._store(key, ttl, addresses, None)
+                return addresses
+        #the name does not exist or has no records of the type, the SOA record tells how long to cache that
+        ttl = NEGATIVE_TTL
+        for record in message.authority:
+            if record.type == TYPE_SOA:
+                ttl = min(record.ttl, record.data[6])
+        error = HostNotFoundError("host not found: %s" % name)
+        self._store(key, ttl, None, error)
+        raise error
+
+    def _addresses(self, name, type, answers):
+        #the addresses for name, following CNAME records, and the smallest TTL of the records that were used
+        ttl = None
+        for i in range(MAX_CNAMES):
+            addresses = []
+            cname = None
+            for record in answers:
+                if record.name.lower() == name:
+                    if record.type == type:
+                        addresses.append(record.data)
+                    elif record.type == TYPE_CNAME:
+                        cname = record.data.lower()
+                    else:
+                        continue
+                    if ttl is None or record.ttl < ttl:
+                        ttl = record.ttl
+            if addresses or cname is None:
+                return addresses, ttl
+            name = cname
+        return [], ttl
+
+    def _query(self, name, type):
+        #asks the name servers in turn until one of them answers
+        error = None
+        for attempt in range(self.attempts):
+            for nameserver in self.nameservers:
+                try:
+                    message = self._query_udp(nameserver, name, type)
+                    if message.flags & Message.FLAG_TC:
+                        message = self._query_tcp(nameserver, name, type)
+                    if message.rcode in (RCODE_NOERROR, RCODE_NXDOMAIN):
+                        return message
+                    error = "name server %s:%d failed with rcode %d" % (nameserver[0], nameserver[1], message.rcode)
+                except TimeoutError:
+                    error = "timeout of name server %s:%d" % nameserver
+                except (IOError, EOFError), e:
+                    error = "error of name server %s:%d: %s" % (nameserver[0], nameserver[1], e)
+                self.log.debug("query for %s: %s", name, error)
+        raise DNSError("could not look up %s: %s" % (name, error))
+
+    def _query_udp(self, nameserver, name, type):
+        self._queries += 1
+        id = random.randint(0, 0xffff)
+        query = Message(id, Message.FLAG_RD, [(name, type)]).encode()
+        sock = DatagramSocket.new(_family(nameserver[0]))
+        try:
+            sock.send_many([(query, nameserver)])
+            buffer = Buffer(MAX_UDP_MESSAGE)
+            with Timeout.push(self.timeout):
+                while True:
+                    buffer.clear()
+                    n, address = sock.recvfrom(buffer)
+                    buffer.flip()
+                    try:
+                        message = Message.decode(buffer.read_bytes(n))
+                    except DNSError:
+                        continue
+                    #ignore anything that is not the answer to our query (e.g. a late answer, or a spoofed one)
+                    if address == nameserver and message.id == id and message.flags & Message.FLAG_QR and \
+                       [(q_name.lower(), q_type) for q_name, q_type in message.questions] == [(name, type)]:
+                        return message
+        finally:
+            sock.close()
+
+    def _query_tcp(self, nameserver, name, type):
+        self._queries += 1
+        id = random.randint(0, 0xffff)
+        query = Message(id, Message.FLAG_RD, [(name, type)]).encode()
+        with Timeout.push(self.timeout):
+            sock = Socket.connect(nameserver)
+            try:
+                stream = BufferedStream(sock)
+                stream.writer.write_bytes(struct.pack('!H', len(query)) + query)
+                stream.writer.flush()
+                n = struct.unpack('!H', stream.reader.read_bytes(2))[0]
+                message = Message.decode(stream.reader.read_bytes(n))
+                if message.id != id:
+                    raise DNSError("invalid message: unexpected id")
+                return message
+            finally:
+                sock.close()
+
+    def _names(self, host):
+        #the names to try for host, as the C library resolver does
+        name = host.lower()
+        if name.endswith('.'):
+            return [name.rstrip('.')] #fully qualified
+        searched = [name + '.' + domain for domain in self.search]
+        if name.count('.') >= self.ndots:
+            return [name] + searched
+        else:
+            return searched + [name]
+
+    def resolve(self, host, family = _socket.AF_INET):
+        """Returns the addresses of *host* as a list of numeric hosts of address *family* (AF_INET or AF_INET6).
+        A numeric *host* is returned as is. A *host* that does not end with a dot is also looked up in the domains of
+        the search list: before *host* itself when it has less than :attr:`ndots` dots, after it otherwise.
+        Raises :class:`HostNotFoundError` when none of these names exist."""
+        if _family(host) is not None:
+            return [host]
+        type = family == _socket.AF_INET6 and TYPE_AAAA or TYPE_A
+        addresses = self._hosts.get((host.lower().rstrip('.'), type))
+        if addresses is not None:
+            return list(addresses)
+        for name in self._names(host):
+            addresses = self._hosts.get((name, type))
+            if addresses is not None:
+                return list(addresses)
+            try:
+                return self.query(name, type)
+            except HostNotFoundError:
+                pass #try the next name
+        raise HostNotFoundError("host not found: %s" % host)
+
+    def resolve_endpoint(self, endpoint, family = _socket.AF_INET):
+        """Returns the (host, port) *endpoint* with its host replaced by its first address. Other endpoints (e.g. the path of
+        a unix domain socket) are returned as is."""
+        if type(endpoint) is tuple and _family(endpoint[0]) is None:
+            return (self.resolve(endpoint[0], family)[0],) + endpoint[1:]
+        return endpoint
+
+    def statistics(self):
+        """Returns the nr of *queries* sent, the nr of lookups answered from the cache (*hits*), the nr of lookups that
+        shared a query in flight (*coalesced*), the nr of queries that got no answer (*failures*) and the nr of names
+        *cached* as a dict"""
+        return {'queries': self._queries,
+                'hits': self._hits,
+                'coalesced': self._coalesced,
+                'failures': self._failures,
+                'cached': len(self._cache)}
+
+_default = None
+
+def default():
+    """Returns the default :class:`Resolver`, as used by :class:`~concurrence.io.Connector`.
+    It is created on first use from ``/etc/resolv.conf`` and ``/etc/hosts``."""
+    global _default
+    if _default is None:
+        _default = Resolver()
+    return _default
+
+def resolve(host, family = _socket.AF_INET):
+    """Returns the addresses of *host* using the default resolver, see :func:`Resolver.resolve`"""
+    return default().resolve(host, family)
+
+def resolve_endpoint(endpoint, family = _socket.AF_INET):
+    """Returns *endpoint* with its host looked up using the default resolver, see :func:`Resolver.resolve_endpoint`"""
+    return default().resolve_endpoint(endpoint, family)
 
-class QueryEngine(object):
-    """
-    Usage:
-    create 1: engine = QueryEngine()
-    create 2: engine = QueryEngine(configtext="nameserver 8.8.8.8")
-    sync query: result = engine.synchronous("www.google.com", adns.rr.ADDR)
-    run async engine: engine.run()
-    async query: result = engine.asynchronous("www.google.com", adns.rr.ADDR)
-    """
-    def __init__(self, s=None, configtext=None):
-        if s is None:
-            flags = adns.iflags.noautosys | adns.iflags.noserverwarn | adns.iflags.noerrprint
-            if configtext is None:
-                s = adns.init(flags)
-            else:
-                s = adns.init(flags, sys.stderr, configtext)
-        self._s = s
-        self._queries = {}
-        self._running = False
-
-    def synchronous(self, qname, rr, flags=0):
-        return self._s.synchronous(qname, rr, flags)
-
-    def asynchronous(self, qname, rr, flags=0):
-        response_channel = stackless.channel()
-        q = self._s.submit(qname, rr, flags)
-        self._queries[q] = response_channel
-        if not self._running:
-            self._running = True
-            stackless.tasklet(self._run)()
-        return response_channel.receive()
-
-    def _run(self):
-        while True:
-            # stop if no pending queries
-            if not len(self._queries):
-                break
-            # check completeness
-            for q in self._s.completed(0):
-                answer = q.check()
-                response_channel = self._queries[q]
-                del self._queries[q]
-                response_channel.send(answer)
-            stackless.schedule()
-        self._running = False
+def statistics():
+    """Returns the statistics of the default resolver as a dict"""
+    if _default is None:
+        return {}
+    return _default.statistics()
@@ -1,35 +1,52 @@
-from concurrence._event import event, version, method, has_next, next, loop, EventError
-from concurrence._event import EV_TIMEOUT, EV_READ, EV_WRITE, EV_SIGNAL, EV_PERSIST
-
 import os
+import sys
 
-try:
-    #try to import some extra features available from libevent14+
-    from concurrence._event14 import init
-    from concurrence._event14 import reinit
+#the event backend can be selected at startup, either with the -Xepoll command line option
+#or by setting environment variable CONCURRENCE_EVENT_BACKEND to 'epoll' (default is 'libevent')
+if '-Xepoll' in sys.argv or os.environ.get('CONCURRENCE_EVENT_BACKEND', 'libevent') == 'epoll':
+    from concurrence._epoll import event, version, method, has_next, next, triggered, loop, EventError
+    from concurrence._epoll import EV_TIMEOUT, EV_READ, EV_WRITE, EV_SIGNAL, EV_PERSIST
+    from concurrence._epoll import init, reinit
 
-    #monkey path fork, so that we reinit event after fork automatically
+    #monkey path fork, so that we reinit epoll after fork automatically
     os_fork = os.fork
     def fork():
         pid = os_fork()
         if pid == 0:
-            #we are child, we must reinit libevent
+            #we are child, we must reinit epoll
             reinit()
         return pid
     os.fork = fork
 
-except ImportError:
-    #fall back to <1.4 init
-    from concurrence._event import init
-    #monkey path fork, to warn that it does not work < libevent14
-    os_fork = os.fork
-    def fork():
-        raise EventError("fork does not work with libevent < 1.4")
-    os.fork = fork
-    def reinit():
-        raise EventError("unavailable with libevent < 1.4")
+else:
+    from concurrence._event import event, version, method, has_next, next, triggered, loop, EventError
+    from concurrence._event import EV_TIMEOUT, EV_READ, EV_WRITE, EV_SIGNAL, EV_PERSIST
 
-#make sure libevent is inited
-init()
+    try:
+        #try to import some extra features available from libevent14+
+        from concurrence._event14 import init
+        from concurrence._event14 import reinit
+
+        #monkey path fork, so that we reinit event after fork automatically
+        os_fork = os.fork
+        def fork():
+            pid = os_fork()
+            if pid == 0:
+                #we are child, we must reinit libevent
+                reinit()
+            return pid
+        os.fork = fork
 
+    except ImportError:
+        #fall back to <1.4 init
+        from concurrence._event import init
+        #monkey path fork, to warn that it does not work < libevent14
+        os_fork = os.fork
+        def fork():
+            raise EventError("fork does not work with libevent < 1.4")
+        os.fork = fork
+        def reinit():
+            raise EventError("unavailable with libevent < 1.4")
 
+#make sure the event backend is inited
+init()
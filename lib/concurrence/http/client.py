@@ -4,7 +4,6 @@
 # the New BSD License: http://www.opensource.org/licenses/bsd-license.php
 
 #TODO timeout
-#TODO asyn dns resolve
 from __future__ import with_statement
 
 import time
@@ -41,18 +40,28 @@ class HTTPConnection(object):
 
     log = logging.getLogger('HTTPConnection')
 
-    def __init__(self):
+    def __init__(self, pool = None):
+        """When a :class:`~concurrence.io.connectionpool.ConnectionPool` is given as *pool*, the connection is taken from it
+        in :func:`connect` and given back to it in :func:`close` (unless it cannot be reused)."""
         self.limit = None
+        self._pool = pool
 
     def connect(self, endpoint):
-        """Connect to the webserver at *endpoint*. *endpoint* is a tuple (<host>, <port>)."""
+        """Connect to the webserver at *endpoint*. *endpoint* is a tuple (<host>, <port>), the host is looked up with
+        :mod:`concurrence.dns`."""
         self._host = None
         if type(endpoint) == type(()):
             try:
                 self._host = endpoint[0]
             except Exception:
                 pass
-        self._stream = BufferedStream(Connector.connect(endpoint), read_buffer_size = 1024 * 8, write_buffer_size = 1024 * 4)
+        if self._pool is None:
+            self._socket = Connector.connect(endpoint)
+        else:
+            self._socket = self._pool.get(endpoint)
+        self._reusable = True
+        self._pending = 0 #nr of requests sent for which the response was not received yet
+        self._stream = BufferedStream(self._socket, read_buffer_size = 1024 * 8, write_buffer_size = 1024 * 4)
 
     def set_limit(self, limit):
         self.limit = limit
@@ -60,7 +69,18 @@ class HTTPConnection(object):
     def receive(self):
         """Receive the next :class:`HTTPResponse` from the connection."""
         try:
-            return self._receive()
+            response = self._receive()
+        except:
+            self._reusable = False #we don't know where we are in the response
+            raise
+        self._pending -= 1
+        if (response.get_header('Connection', '') or '').lower() == 'close':
+            self._reusable = False
+        return response
+
+    def _receive(self):
+        try:
+            return self._receive_response()
         except TaskletExit:
             raise
         except EOFError:
@@ -73,7 +93,7 @@ class HTTPConnection(object):
             self.log.exception('')
             raise HTTPError("Exception while reading response")
 
-    def _receive(self):
+    def _receive_response(self):
 
         response = HTTPResponse()
 
@@ -123,6 +143,8 @@ class HTTPConnection(object):
                         chunks.append(data)
                         content_length -= len(data)
                 else:
+                    #the response ends when the server closes the connection
+                    self._reusable = False
                     content_length = 0
                     while True:
                         try:
@@ -186,8 +208,15 @@ class HTTPConnection(object):
             writer.write_bytes("\r\n")
             if request.body is not None:
                writer.write_bytes(request.body)
+            self._pending += 1
             writer.flush()
 
     def close(self):
-        """Close this connection."""
-        self._stream.close()
+        """Close this connection, or give it back to its pool when it can be reused."""
+        if self._pool is not None and self._reusable and not self._pending and \
+           self._stream.release_reader() and self._stream.release_writer():
+            self._pool.put(self._socket)
+        else:
+            self._stream.close()
+            if self._pool is not None:
+                self._pool.put(self._socket, close = True)
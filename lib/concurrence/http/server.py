@@ -7,6 +7,7 @@
 
 from __future__ import with_statement
 
+import os
 import logging
 import urlparse
 import httplib
@@ -100,6 +101,36 @@ class WSGIErrorStream(object):
         assert False, 'TODO'
 
 
+class WSGIFileWrapper(object):
+    """The wsgi.file_wrapper of the server. When an application returns a file wrapper for a real file, its contents are sent
+    to the client with :func:`~concurrence.io.socket.Socket.sendfile`, e.g. without reading the file into memory.
+    Otherwise it is iterated in blocks of *block_size* bytes like any other response."""
+    def __init__(self, filelike, block_size = CHUNK_SIZE * 8):
+        self.filelike = filelike
+        self.block_size = block_size
+        if hasattr(filelike, 'close'):
+            self.close = filelike.close
+
+    def fileno(self):
+        """returns the file descriptor of the file, or None if it is not a real file"""
+        if hasattr(self.filelike, 'fileno') and hasattr(self.filelike, 'tell'):
+            try:
+                return self.filelike.fileno()
+            except (IOError, ValueError, AttributeError):
+                pass
+        return None
+
+    def length(self):
+        """returns the nr of bytes from the current position up to the end of the (real) file"""
+        return os.fstat(self.fileno()).st_size - self.filelike.tell()
+
+    def __iter__(self):
+        while True:
+            data = self.filelike.read(self.block_size)
+            if not data:
+                break
+            yield data
+
 class WSGIRequest(object):
     log = logging.getLogger('WSGIRequest')
 
@@ -139,9 +170,23 @@ class WSGIRequest(object):
         return self.environ.get(http_key, None)
 
     def write_response(self, response, writer):
+        try:
+            self._write_response(response, writer)
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+
+    def _write_response(self, response, writer):
         self.state = self.STATE_WRITING_HEADER
 
-        if self.version == 'HTTP/1.0':
+        fd = None
+        if type(response) is WSGIFileWrapper and hasattr(writer.stream, 'sendfile'):
+            fd = response.fileno()
+
+        if fd is not None:
+            length = response.length() #known up front, so no need for chunking
+            chunked = False
+        elif self.version == 'HTTP/1.0':
             chunked = False
         else:
             chunked = True
@@ -151,13 +196,19 @@ class WSGIRequest(object):
         writer.write_bytes("%s %s\r\n" % (self.version, self.status))
         for header_name, header_value in self.response_headers:
             if header_name in self._disallowed_application_headers: continue
+            if not chunked and header_name.lower() == 'content-length': continue #we send our own
             writer.write_bytes("%s: %s\r\n" % (header_name, header_value))
         writer.write_bytes("Date: %s\r\n" % rfc822.formatdate())
         writer.write_bytes("Server: %s\r\n" % SERVER_ID)
 
         if chunked and self.method != 'HEAD':
             writer.write_bytes("Transfer-Encoding: chunked\r\n")
+        elif fd is not None:
+            writer.write_bytes("Content-length: %d\r\n" % length)
         else:
+            #the response can only be iterated once (e.g. a generator, or a file wrapper of a non-file), so the chunks
+            #are kept to send them after the header
+            response = [chunk if type(chunk) == str else str(chunk) for chunk in response]
             l = 0
             for chunk in response:
                 l += len(chunk)
@@ -168,16 +219,19 @@ class WSGIRequest(object):
         if self.method != 'HEAD':
             self.state = self.STATE_WRITING_DATA
 
-            if chunked:
+            if fd is not None:
+                offset = response.filelike.tell()
+                if writer.write_file(fd, offset, length) != length:
+                    raise EOFError("file was truncated while sending it")
+            elif chunked:
                 for chunk in response:
-                    writer.write_bytes("%x;\r\n" % len(chunk))
-                    writer.write_bytes(chunk)
-                    writer.write_bytes("\r\n")
+                    #large chunks are sent without copying them into the write buffer
+                    writer.write_many(["%x;\r\n" % len(chunk), chunk, "\r\n"])
 
                 writer.write_bytes("0\r\n\r\n")
             else:
                 for chunk in response:
-                    writer.write_bytes(chunk if type(chunk) == str else str(chunk))
+                    writer.write_large(chunk)
 
         writer.flush() #TODO use special header to indicate no flush needed
 
@@ -253,6 +307,7 @@ class WSGIRequest(object):
         #setup required wsgi streams
         self.environ['wsgi.input'] = WSGIInputStream(self, reader)
         self.environ['wsgi.errors'] = WSGIErrorStream()
+        self.environ['wsgi.file_wrapper'] = WSGIFileWrapper
 
         if not 'HTTP_HOST' in self.environ:
             if self.version == 'HTTP/1.0':
@@ -292,7 +347,9 @@ class HTTPHandler(object):
     def write_responses(self, control, stream):
         try:
             for msg, (request, response), kwargs in Tasklet.receive():
-                request.write_response(response, stream.writer)
+                #the write buffer goes back to the pool after each response
+                with stream.get_writer() as writer:
+                    request.write_response(response, writer)
                 self.MSG_RESPONSE_WRITTEN.send(control)(request, response)
         except Exception, e:
             self.log.exception("Exception in writer")
@@ -302,6 +359,9 @@ class HTTPHandler(object):
         try:
             while True:
                 request = WSGIRequest(self._server)
+                with Timeout.push(self._server.read_timeout):
+                    #an idle keep-alive connection does not hold a read buffer
+                    stream.wait_readable()
                 request.read_request(stream.reader)
                 self.MSG_REQUEST_READ.send(control)(request, None)
                 request.read_request_data()
@@ -348,7 +408,7 @@ class HTTPHandler(object):
             if msg.match(self.MSG_REQUEST_READ):
                 #we use reque to be able to send the responses back in the correct order later
                 self._reque.start(request)
-                Tasklet.new(self.handle_request, name = 'request_handler')(control, request, application)
+                Tasklet.spawn_pooled(self.handle_request, name = 'request_handler')(control, request, application)
 
             elif msg.match(self.MSG_REQUEST_HANDLED):
                 #request.environ["wsgi.input"].read(request.environ["wsgi.input"]._n)
@@ -424,8 +484,9 @@ class WSGIServer(object):
         This method provides a hook for logging, statistics and or further processing w.r.t. the connection."""
         HTTPHandler(self).handle(socket, self._application)
 
-    def serve(self, endpoint):
-        """Serves the application at the given *endpoint*. The *endpoint* must be a tuple (<host>, <port>)."""
-        return Server.serve(endpoint, self.handle_connection)
+    def serve(self, endpoint, workers = 0):
+        """Serves the application at the given *endpoint*. The *endpoint* must be a tuple (<host>, <port>).
+        If *workers* > 0, the application is served by that many forked worker processes."""
+        return Server.serve(endpoint, self.handle_connection, workers)
 
 
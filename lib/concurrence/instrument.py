@@ -0,0 +1,180 @@
+# Copyright (C) 2009, Hyves (Startphone Ltd.)
+#
+# This module is part of the Concurrence Framework and is released under
+# the New BSD License: http://www.opensource.org/licenses/bsd-license.php
+
+"""Optional instrumentation of the scheduler.
+
+When enabled, it records for every tasklet (and for every tasklet name) the total time it ran, the
+number of times it was switched to and its longest run without yielding. It also records a histogram
+of the time the dispatcher spends running tasklets between 2 calls to the event loop, e.g. the time an
+IO event or timer could have to wait before it is handled. A hook is called whenever a tasklet runs
+longer than a threshold without yielding.
+
+When disabled (the default) it costs nothing, as no hooks are installed::
+
+    from concurrence import instrument
+
+    instrument.enable(slice_threshold = 0.05)
+    ...
+    print instrument.statistics()
+"""
+
+import time
+import bisect
+import logging
+import weakref
+
+from concurrence import core
+from concurrence.core import stackless
+
+LAG_BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0] #upper bounds in seconds
+
+class TaskletStatistic(object):
+    """run statistics of a single tasklet, or of all tasklets with the same name"""
+    __slots__ = ['name', 'run_time', 'switches', 'longest_slice']
+
+    def __init__(self, name):
+        self.name = name
+        self.run_time = 0.0
+        self.switches = 0
+        self.longest_slice = 0.0
+
+    def add_slice(self, duration):
+        self.run_time += duration
+        self.switches += 1
+        if duration > self.longest_slice:
+            self.longest_slice = duration
+
+    def __str__(self):
+        return "%s: run_time:%3.6f;switches:%d;longest_slice:%3.6f" % (self.name, self.run_time, self.switches, self.longest_slice)
+
+    def __json__(self):
+        return {'run_time': self.run_time, 'switches': self.switches, 'longest_slice': self.longest_slice}
+
+class Histogram(object):
+    """counts values in buckets, the last bucket counts the values larger than the largest bound"""
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+
+    def add(self, v):
+        self.counts[bisect.bisect_left(self.bounds, v)] += 1
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def __str__(self):
+        labels = ['<=%s' % b for b in self.bounds] + ['>%s' % self.bounds[-1]]
+        return ';'.join(['%s:%d' % (l, c) for l, c in zip(labels, self.counts)])
+
+    def __json__(self):
+        return {'bounds': self.bounds, 'counts': self.counts}
+
+def _log_long_slice(task, duration):
+    logging.warn("tasklet %s ran for %3.3f seconds without yielding", _name(task), duration)
+
+def _name(task):
+    if task is None:
+        return '<none>'
+    return getattr(task, 'name', None) or '<main>'
+
+class SchedulerInstrument(object):
+    """records the run statistics of tasklets, see the module documentation"""
+    log = logging.getLogger('SchedulerInstrument')
+
+    def __init__(self, slice_threshold = None, on_long_slice = _log_long_slice, lag_buckets = LAG_BUCKETS):
+        """*on_long_slice* (task, duration) is called when a tasklet runs longer than *slice_threshold*
+        seconds without yielding."""
+        self.slice_threshold = slice_threshold
+        self.on_long_slice = on_long_slice
+        self._lag_buckets = lag_buckets
+        self.reset()
+
+    def reset(self):
+        self.by_tasklet = weakref.WeakKeyDictionary()
+        self.by_name = {}
+        self.lag = Histogram(self._lag_buckets)
+        self.longest_lag = 0.0
+        self._current = stackless.getcurrent()
+        self._slice_start = time.time()
+        self._loop_exit = None
+
+    def _account(self, task, now):
+        #adds the slice that *task* just ran
+        duration = now - self._slice_start
+        try:
+            self.by_tasklet[task].add_slice(duration)
+        except KeyError:
+            stat = self.by_tasklet[task] = TaskletStatistic(_name(task))
+            stat.add_slice(duration)
+        except TypeError:
+            pass #task is None or cannot be weakly referenced
+        name = _name(task)
+        if name in self.by_name:
+            self.by_name[name].add_slice(duration)
+        else:
+            stat = self.by_name[name] = TaskletStatistic(name)
+            stat.add_slice(duration)
+        if self.slice_threshold is not None and duration > self.slice_threshold and self.on_long_slice is not None:
+            try:
+                self.on_long_slice(task, duration)
+            except Exception:
+                self.log.exception("unhandled exception in long slice hook")
+
+    def on_switch(self, prev, next):
+        now = time.time()
+        if self._slice_start is not None:
+            self._account(prev, now)
+            self._slice_start = now
+        self._current = next
+
+    def on_loop_enter(self):
+        #called by the dispatcher just before it blocks in the event loop
+        now = time.time()
+        if self._slice_start is not None:
+            self._account(self._current, now)
+        self._slice_start = None #blocking in the loop is not accounted to the dispatcher
+        if self._loop_exit is not None:
+            lag = now - self._loop_exit
+            self.lag.add(lag)
+            if lag > self.longest_lag:
+                self.longest_lag = lag
+
+    def on_loop_exit(self):
+        #called by the dispatcher after the event loop returned
+        self._loop_exit = self._slice_start = time.time()
+
+    def statistics(self):
+        return {'by_name': dict([(name, stat.__json__()) for name, stat in self.by_name.items()]),
+                'lag': self.lag.__json__(),
+                'longest_lag': self.longest_lag}
+
+_instrument = None
+
+def enable(slice_threshold = None, on_long_slice = _log_long_slice, lag_buckets = LAG_BUCKETS):
+    """Enables the instrumentation of the scheduler, and returns the :class:`SchedulerInstrument` that records
+    the statistics. See :class:`SchedulerInstrument` for a description of the arguments."""
+    global _instrument
+    disable()
+    _instrument = SchedulerInstrument(slice_threshold, on_long_slice, lag_buckets)
+    stackless.set_schedule_callback(_instrument.on_switch)
+    core._instrument = _instrument
+    return _instrument
+
+def disable():
+    """Disables the instrumentation of the scheduler. The statistics that were recorded are still available."""
+    if core._instrument is not None:
+        stackless.set_schedule_callback(None)
+        core._instrument = None
+
+def current():
+    """Returns the current :class:`SchedulerInstrument`, or None when instrumentation was never enabled."""
+    return _instrument
+
+def statistics():
+    """Returns the recorded statistics as a dict"""
+    if _instrument is None:
+        return {}
+    return _instrument.statistics()
@@ -5,7 +5,7 @@
 
 
 from concurrence import TIMEOUT_CURRENT
-from _io import Buffer, BufferOverflowError, BufferUnderflowError, BufferInvalidArgumentError, get_errno
+from _io import Buffer, RingBuffer, BufferOverflowError, BufferUnderflowError, BufferInvalidArgumentError, get_errno
 
 class IOStream(object):
     """abstract class to indicate that something is a stream and capable
@@ -20,7 +20,7 @@ class IOStream(object):
         or raise error, or timeout"""
         pass
 
-from concurrence.io.socket import Socket, SocketServer
+from concurrence.io.socket import Socket, SocketServer, DatagramSocket
 from concurrence.io.buffered import BufferedReader, BufferedWriter, BufferedStream
 
 #TODO what if more arguments are needed for connect?, eg. passwords etc?
@@ -32,22 +32,24 @@ class Connector(object):
         if isinstance(endpoint, Connector):
             assert False, "TODO"
         else:
-            #default is to connect to Socket and endpoint is address
+            #default is to connect to Socket and endpoint is address, its host name is looked up without blocking
             from concurrence.io.socket import Socket
-            from concurrence.timer import Timeout
-            return Socket.connect(endpoint, TIMEOUT_CURRENT)
+            from concurrence import dns
+            return Socket.connect(dns.resolve_endpoint(endpoint), TIMEOUT_CURRENT)
 
 class Server(object):
     """server class for connection oriented IO (TCP), prevents the need for server protocol libraries to hardcode a
     particular way to serve a connection (e.g. no need to explicitly reference Server Sockets"""
     @classmethod
-    def serve(cls, endpoint, handler):
+    def serve(cls, endpoint, handler, workers = 0):
+        """serves *handler* at *endpoint*. If *workers* > 0, that many worker processes are forked to serve
+        the connections (see :func:`SocketServer.serve`)"""
         if isinstance(endpoint, Server):
             assert False, "TODO"
         else:
             #default is to server using SocketServer, endpoint is addresss
             from concurrence.io.socket import SocketServer
             socket_server = SocketServer(endpoint, handler)
-            socket_server.serve()
+            socket_server.serve(workers)
             return socket_server
 
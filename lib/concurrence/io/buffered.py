@@ -3,18 +3,41 @@
 # This module is part of the Concurrence Framework and is released under
 # the New BSD License: http://www.opensource.org/licenses/bsd-license.php
 
-from concurrence import TIMEOUT_CURRENT
-from concurrence.io import IOStream, Buffer, BufferOverflowError, BufferUnderflowError, BufferInvalidArgumentError
+from concurrence import Tasklet, Channel, TIMEOUT_CURRENT, call_at_round_end
+from concurrence.io import IOStream, Buffer, RingBuffer, BufferOverflowError, BufferUnderflowError, BufferInvalidArgumentError
+from concurrence.io import bufferpool
+from concurrence.statistic import Statistic
 
+MAX_LINE_LENGTH = 1024 * 64 #default maximum length of a line read by a BufferedReader
+FLUSH_TIMEOUT = 60.0 #default seconds the rest of a deferred flush may wait for the stream to become writable
+
+class _Counters(object):
+    def __init__(self):
+        self.flushes = Statistic(0) #nr of calls to BufferedWriter.flush
+        self.coalesced = Statistic(0) #nr of deferred flushes that were added to an already pending flush
+        self.syscalls = Statistic(0) #nr of writes to the underlying streams
+        self.bytes = Statistic(0) #nr of bytes written by these
+
+_counters = _Counters()
+
+_deferred = [] #the deferred writers that are flushed at the end of the current round
+
+def _flush_deferred():
+    global _deferred
+    writers, _deferred = _deferred, []
+    for writer in writers:
+        writer._flush_round()
 
 class BufferedReader(object):
+    max_line_length = MAX_LINE_LENGTH
+
     def __init__(self, stream, buffer):
         assert stream is None or isinstance(stream, IOStream)
         self.stream = stream
         self.buffer = buffer
         #assume no reading from underlying stream was done, so make sure buffer reflects this:
-        self.buffer.position = 0
-        self.buffer.limit = 0
+        self.buffer.clear()
+        self.buffer.flip()
 
     def file(self):
         return CompatibleFile(self, None)
@@ -44,25 +67,63 @@ class BufferedReader(object):
             raise EOFError("while reading")
         self.buffer.flip() #prepare to read from buffer
 
-    def read_lines(self):
-        """note that it cant read line accross buffer"""
-        if self.buffer.remaining == 0:
-            self.fill()
+    def _read_long_line(self, include_separator = False, partial_at_eof = False):
+        #reads a line that does not end within the current bytes of the buffer. the bytes read so far are collected
+        #before each fill, so that only the newly read bytes are scanned and a line can be longer than the buffer
+        buffer = self.buffer
+        parts = []
+        n = 0
         while True:
+            part = buffer.read_bytes(-1)
+            n += len(part)
+            if n > self.max_line_length + 1: #+1 for the CR of a CRLF that was split by a fill
+                raise BufferOverflowError("line longer than %d bytes" % self.max_line_length)
+            parts.append(part)
             try:
-                yield self.buffer.read_line()
-            except BufferUnderflowError:
                 self.fill()
+            except EOFError:
+                if not partial_at_eof:
+                    raise
+                buffer.flip() #fill left the buffer ready for writing
+                return ''.join(parts)
+            try:
+                parts.append(buffer.read_line(True))
+                break
+            except BufferUnderflowError:
+                pass
+        line = ''.join(parts)
+        if line.endswith('\r\n'):
+            n = len(line) - 2
+        else:
+            n = len(line) - 1
+        if n > self.max_line_length:
+            raise BufferOverflowError("line longer than %d bytes" % self.max_line_length)
+        if include_separator:
+            return line
+        else:
+            return line[:n]
 
-    def read_line(self):
-        """note that it cant read line accross buffer"""
-        if self.buffer.remaining == 0:
+    def read_lines(self):
+        """reads lines (ending in LF or CRLF, the separator is not returned). lines may be longer than the buffer, but not
+        longer than :attr:`max_line_length`, otherwise a :exc:`BufferOverflowError` is raised"""
+        buffer = self.buffer
+        if buffer.remaining == 0:
             self.fill()
         while True:
             try:
-                return self.buffer.read_line()
+                yield buffer.read_line()
             except BufferUnderflowError:
-                self.fill()
+                yield self._read_long_line()
+
+    def read_line(self):
+        """reads a single line, see :func:`read_lines`"""
+        buffer = self.buffer
+        if buffer.remaining == 0:
+            self.fill()
+        try:
+            return buffer.read_line()
+        except BufferUnderflowError:
+            return self._read_long_line()
 
     def read_bytes_available(self):
         if self.buffer.remaining == 0:
@@ -84,6 +145,28 @@ class BufferedReader(object):
 
         return ''.join(s)
 
+    def read_into(self, target, offset = 0):
+        """reads exactly enough bytes from stream to fill the writable buffer object *target* (e.g. a bytearray)
+        from *offset* onwards, without creating intermediate strings. returns the number of bytes read."""
+        buffer = self.buffer
+        n = len(target) - offset
+        while offset < len(target):
+            if buffer.remaining > 0:
+                offset += buffer.read_into(target, offset)
+            else:
+                self.fill()
+        return n
+
+    def read_view(self, n):
+        """reads exactly n bytes from stream and returns a read-only view on them without copying (see :func:`Buffer.read_view`).
+        n must not be larger than the capacity of the buffer. the view is only valid until the next read from this reader."""
+        buffer = self.buffer
+        if n > buffer.capacity:
+            raise BufferOverflowError("view larger than buffer")
+        while buffer.remaining < n:
+            self.fill()
+        return buffer.read_view(n)
+
     def read_int(self):
         if self.buffer.remaining == 0:
             self.fill()
@@ -103,10 +186,18 @@ class BufferedReader(object):
                 self.fill()
 
 class BufferedWriter(object):
-    def __init__(self, stream, buffer):
+    """Buffers the bytes written to *stream*. A *deferred* writer coalesces its flushes, see :func:`flush`."""
+    flush_timeout = FLUSH_TIMEOUT
+
+    def __init__(self, stream, buffer, deferred = False):
         assert stream is None or isinstance(stream, IOStream)
         self.stream = stream
         self.buffer = buffer
+        self.deferred = deferred
+        self._scheduled = False #whether a deferred flush is pending for the end of the current round
+        self._flusher = None #the task that writes what a deferred flush could not write without waiting
+        self._flushed = None #channel on which tasks wait for the flusher to finish
+        self._error = None #the error of the last deferred flush, raised by the next flush
 
     def file(self):
         return CompatibleFile(None, self)
@@ -124,7 +215,31 @@ class BufferedWriter(object):
                 r = self.buffer.remaining
                 part, s = s[:r], s[r:]
                 self.buffer.write_bytes(part)
-                self.flush()
+                self._flush()
+
+    def write_many(self, strings):
+        """writes the list of *strings*, when they don't fit in the buffer, they are sent directly from the strings
+        together with the bytes already in the buffer (in a single writev call when the stream supports it)"""
+        total = 0
+        for s in strings:
+            total += len(s)
+        if total <= self.buffer.remaining or self.deferred or not hasattr(self.stream, 'writev'):
+            for s in strings:
+                self.write_bytes(s)
+        else:
+            self.buffer.flip()
+            self.stream.writev([self.buffer] + list(strings), TIMEOUT_CURRENT)
+            self.buffer.clear()
+
+    def write_large(self, s):
+        """writes the string *s*, which may be larger than the buffer, see :func:`write_many`"""
+        self.write_many([s])
+
+    def write_file(self, fd, offset = 0, count = -1):
+        """writes *count* bytes of the file *fd* starting at *offset* (see :func:`Socket.sendfile`), after flushing the bytes
+        buffered so far. returns the number of bytes written"""
+        self._flush()
+        return self.stream.sendfile(fd, offset, count, TIMEOUT_CURRENT)
 
     def write_byte(self, ch):
         assert type(ch) == int, "ch arg must be int"
@@ -133,7 +248,7 @@ class BufferedWriter(object):
                 self.buffer.write_byte(ch)
                 return
             except BufferOverflowError:
-                self.flush()
+                self._flush()
 
     def write_short(self, i):
         while True:
@@ -141,7 +256,7 @@ class BufferedWriter(object):
                 self.buffer.write_short(i)
                 return
             except BufferOverflowError:
-                self.flush()
+                self._flush()
 
     def write_int(self, i):
         while True:
@@ -149,28 +264,150 @@ class BufferedWriter(object):
                 self.buffer.write_int(i)
                 return
             except BufferOverflowError:
-                self.flush()
-
-    def flush(self):
-        self.buffer.flip()
-        while self.buffer.remaining:
-            if not self.stream.write(self.buffer, TIMEOUT_CURRENT):
+                self._flush()
+
+    def flush(self, force = False):
+        """Writes the buffered bytes to the stream. A deferred writer does not write right away, but once at the end of
+        the current round of the dispatcher (see :func:`~concurrence.core.call_at_round_end`), so that the bytes of all flushes
+        done in a round (e.g. by different tasks writing to the same connection) are written with a single syscall.
+        If not all bytes can be written then, a new task writes the rest when the stream becomes writable (waiting at most
+        :attr:`flush_timeout` seconds for that). An error of a deferred flush is raised by the next call to flush. Pass *force* to write the bytes right away (also waiting
+        for a pending deferred flush to complete)."""
+        _counters.flushes += 1
+        if not self.deferred or force:
+            self._flush()
+        elif self._error is not None:
+            self._raise_error()
+        elif self._scheduled or self._flusher is not None:
+            _counters.coalesced += 1
+        elif self.buffer.position:
+            self._scheduled = True
+            if not _deferred:
+                call_at_round_end(_flush_deferred)
+            _deferred.append(self)
+
+    def _flush(self):
+        #writes the buffered bytes right away
+        if self.deferred:
+            self._flush_all()
+            return
+        buffer = self.buffer
+        buffer.flip()
+        while buffer.remaining:
+            n = self.stream.write(buffer, TIMEOUT_CURRENT)
+            if not n:
                 raise EOFError("while writing")
-        self.buffer.clear()
+            _counters.syscalls += 1
+            _counters.bytes += n
+        buffer.clear()
 
-class BufferedStream(object):
+    def _raise_error(self):
+        error, self._error = self._error, None
+        raise error
 
-    _reader_pool = {} #buffer_size -> [list of readers]
-    _writer_pool = {} #bufffer_size -> [list of writers]
+    def _write_nowait(self):
+        #a single write that does not wait, the bytes that were not written are moved to the start of the buffer.
+        #a deferred writer only flips its buffer for the duration of this call, so other tasks may add bytes while it waits
+        buffer = self.buffer
+        buffer.flip()
+        try:
+            n = self.stream.write_nowait(buffer)
+        finally:
+            buffer.compact()
+        _counters.syscalls += 1
+        _counters.bytes += n
+
+    def _flush_all(self):
+        #writes all bytes of a deferred writer right away. only the flusher task waits for the stream to become
+        #writable, other tasks wait for the flusher to finish, so that many tasks can share a deferred writer
+        buffer = self.buffer
+        while True:
+            if self._error is not None:
+                self._raise_error()
+            if self._flusher is None:
+                if not buffer.position:
+                    return
+                self._write_nowait()
+                if not buffer.position:
+                    return
+                self._flusher = Tasklet.new(self._flush_rest)()
+            if self._flushed is None:
+                self._flushed = Channel()
+            self._flushed.receive()
+
+    def _flush_round(self):
+        #called by the dispatcher at the end of the round in which flush was called, this must not block
+        self._scheduled = False
+        if not self.buffer.position or self._flusher is not None:
+            return #flushed by force in the meantime, or the flusher task will write the bytes
+        try:
+            self._write_nowait()
+        except Exception, e:
+            self._error = e
+            self.buffer.clear()
+            return
+        if self.buffer.position:
+            self._flusher = Tasklet.new(self._flush_rest)()
+
+    def _flush_rest(self):
+        #the task that writes the rest of a deferred flush when the stream becomes writable
+        try:
+            try:
+                while self.buffer.position:
+                    self.stream.writable.wait(timeout = self.flush_timeout)
+                    self._write_nowait()
+            except Exception, e:
+                self._error = e
+                self.buffer.clear()
+        finally:
+            self._flusher = None
+            flushed = self._flushed
+            while flushed is not None and flushed.has_receiver():
+                flushed.send(None)
+
+    def _close(self):
+        #called when the stream is closed with a deferred flush pending: writes what can be written without waiting,
+        #the rest is dropped (the peer may not be reading at all)
+        self._scheduled = False
+        if self.buffer.position and self._error is None:
+            try:
+                self._write_nowait()
+            except Exception:
+                pass
+        if self.buffer.position:
+            self._error = EOFError("stream was closed before all bytes were written")
+            self.buffer.clear()
+        if self._flusher is not None:
+            self._flusher.kill()
+
+_RELEASED_BUFFER = Buffer(0) #replaces the buffer of a released reader or writer, so that it cannot touch the pooled buffer
 
-    __slots__ = ['_stream', '_writer', '_reader', '_read_buffer_size', '_write_buffer_size']
+def _release(reader_or_writer):
+    bufferpool.default().put(reader_or_writer.buffer)
+    reader_or_writer.buffer = _RELEASED_BUFFER
 
-    def __init__(self, stream, buffer_size = 1024 * 8, read_buffer_size = 0, write_buffer_size = 0):
+class BufferedStream(object):
+    """A stream with a :class:`BufferedReader` and a :class:`BufferedWriter`. The buffers of these are taken from
+    the default :class:`~concurrence.io.bufferpool.BufferPool` on first use, and are given back when the stream is closed,
+    when a reader or writer borrowed with :func:`get_reader` or :func:`get_writer` is done and has no buffered bytes
+    left, or when the stream is released explicitly (see :func:`release_reader` and :func:`wait_readable`)."""
+
+    __slots__ = ['_stream', '_writer', '_reader', '_read_buffer_size', '_write_buffer_size', '_read_buffer_class', '_deferred_flush']
+
+    def __init__(self, stream, buffer_size = 1024 * 8, read_buffer_size = 0, write_buffer_size = 0, read_buffer_class = Buffer,
+                 deferred_flush = False):
+        """Creates a buffered stream on top of *stream*. The reader uses a buffer of class *read_buffer_class*,
+        pass :class:`~concurrence.io.RingBuffer` to avoid moving left over bytes on every read (e.g. for pipelined protocols),
+        this requires a stream that reads using buffer.recv, like :class:`~concurrence.io.socket.Socket`.
+        With *deferred_flush* the flushes of the writer are coalesced and done once per round of the dispatcher
+        (see :func:`BufferedWriter.flush`), this requires a :class:`~concurrence.io.socket.Socket` as well."""
         self._stream = stream
         self._writer = None
         self._reader = None
         self._read_buffer_size = read_buffer_size or buffer_size
         self._write_buffer_size = write_buffer_size or buffer_size
+        self._read_buffer_class = read_buffer_class
+        self._deferred_flush = deferred_flush
 
     def flush(self):
         if self._writer:
@@ -179,27 +416,50 @@ class BufferedStream(object):
     @property
     def reader(self):
         if self._reader is None:
-            self._reader = BufferedReader(self._stream, Buffer(self._read_buffer_size))
+            self._reader = BufferedReader(self._stream, bufferpool.default().get(self._read_buffer_size, self._read_buffer_class))
         return self._reader
 
     @property
     def writer(self):
         if self._writer is None:
-            self._writer = BufferedWriter(self._stream, Buffer(self._write_buffer_size))
+            self._writer = BufferedWriter(self._stream, bufferpool.default().get(self._write_buffer_size), self._deferred_flush)
         return self._writer
 
+    def release_reader(self):
+        """Gives the buffer of the reader back to the pool if it holds no unread bytes. The next use of :attr:`reader`
+        takes a new buffer from the pool. Returns whether the reader is released (also when it already was)."""
+        reader = self._reader
+        if reader is None:
+            return True
+        elif not reader.buffer.remaining:
+            self._reader = None
+            _release(reader)
+            return True
+        return False
+
+    def release_writer(self):
+        """Gives the buffer of the writer back to the pool if it holds no unflushed bytes. The next use of :attr:`writer`
+        takes a new buffer from the pool. Returns whether the writer is released (also when it already was)."""
+        writer = self._writer
+        if writer is None:
+            return True
+        elif writer.buffer.position == 0:
+            self._writer = None
+            _release(writer)
+            return True
+        return False
+
+    def wait_readable(self, timeout = TIMEOUT_CURRENT):
+        """Waits until there are bytes to read, without holding a read buffer while waiting (e.g. for an idle connection).
+        Returns right away if the reader still has unread bytes, otherwise the reader is released (see :func:`release_reader`)
+        and this waits for the underlying stream to become readable."""
+        if self._reader is not None and not self.release_reader():
+            return
+        self._stream.readable.wait(timeout = timeout)
+
     class _borrowed_writer(object):
         def __init__(self, stream):
-            buffer_size = stream._write_buffer_size
-            if stream._writer is None:
-                if stream._writer_pool.get(buffer_size, []):
-                    writer = stream._writer_pool[buffer_size].pop()
-                else:
-                    writer = BufferedWriter(None, Buffer(buffer_size))
-            else:
-                writer = stream._writer
-            writer.stream = stream._stream
-            self._writer = writer
+            self._writer = stream.writer
             self._stream = stream
 
         def __enter__(self):
@@ -207,25 +467,12 @@ class BufferedStream(object):
 
         def __exit__(self, type, value, traceback):
             #TODO!!! handle exception case/exit
-            if self._writer.buffer.position != 0:
-                self._stream._writer = self._writer
-            else:
-                writer_pool = self._stream._writer_pool.setdefault(self._stream._write_buffer_size, [])
-                writer_pool.append(self._writer)
-                self._stream._writer = None
+            if self._stream._writer is self._writer: #else the stream was closed or released in the meantime
+                self._stream.release_writer()
 
     class _borrowed_reader(object):
         def __init__(self, stream):
-            buffer_size = stream._read_buffer_size
-            if stream._reader is None:
-                if stream._reader_pool.get(buffer_size, []):
-                    reader = stream._reader_pool[buffer_size].pop()
-                else:
-                    reader = BufferedReader(None, Buffer(buffer_size))
-            else:
-                reader = stream._reader
-            reader.stream = stream._stream
-            self._reader = reader
+            self._reader = stream.reader
             self._stream = stream
 
         def __enter__(self):
@@ -233,24 +480,48 @@ class BufferedStream(object):
 
         def __exit__(self, type, value, traceback):
             #TODO!!! handle exception case/exit
-            if self._reader.buffer.remaining:
-                self._stream._reader = self._reader
-            else:
-                reader_pool = self._stream._reader_pool.setdefault(self._stream._read_buffer_size, [])
-                reader_pool.append(self._reader)
-                self._stream._reader = None
+            if self._stream._reader is self._reader: #else the stream was closed or released in the meantime
+                self._stream.release_reader()
 
     def get_writer(self):
+        """Returns a context manager that provides the writer. When it exits and all written bytes were flushed, the
+        writer's buffer is given back to the pool"""
         return self._borrowed_writer(self)
 
     def get_reader(self):
+        """Returns a context manager that provides the reader. When it exits and all bytes were read, the
+        reader's buffer is given back to the pool"""
         return self._borrowed_reader(self)
 
     def close(self):
+        """Closes the underlying stream and gives the buffers back to the pool. The reader and writer must not be used anymore.
+        The bytes of a pending deferred flush that can be written without waiting are written first, the rest is dropped."""
+        writer = self._writer
+        if writer is not None and (writer._scheduled or writer._flusher is not None):
+            writer._close()
         self._stream.close()
         del self._stream
-        del self._reader
-        del self._writer
+        if self._reader is not None:
+            _release(self._reader)
+            self._reader = None
+        if self._writer is not None:
+            _release(self._writer)
+            self._writer = None
+
+def statistics():
+    """Returns the nr of *flushes* of all buffered writers, the nr of deferred flushes that were *coalesced* with a flush that
+    was already pending, the nr of writes to the underlying streams (*syscalls*) and the nr of *bytes* they wrote, as
+    :class:`~concurrence.statistic.Statistic` objects, and the average nr of bytes per write (*bytes_per_syscall*)."""
+    syscalls = _counters.syscalls.count
+    if syscalls:
+        bytes_per_syscall = float(_counters.bytes.count) / syscalls
+    else:
+        bytes_per_syscall = 0.0
+    return {'flushes': _counters.flushes,
+            'coalesced': _counters.coalesced,
+            'syscalls': _counters.syscalls,
+            'bytes': _counters.bytes,
+            'bytes_per_syscall': bytes_per_syscall}
 
 class CompatibleFile(object):
     """A wrapper that implements python's file like object semantics on top
@@ -267,11 +538,7 @@ class CompatibleFile(object):
             try:
                 yield buffer.read_line(True)
             except BufferUnderflowError:
-                try:
-                    reader.fill()
-                except EOFError:
-                    buffer.flip()
-                    yield buffer.read_bytes(-1)
+                yield reader._read_long_line(True, True)
 
     def readline(self, n = -1):
         return self.readlines().next()
@@ -303,6 +570,23 @@ class CompatibleFile(object):
                         break
         return ''.join(s)
 
+    def readinto(self, target):
+        """reads up to len(target) bytes into the writable buffer object *target*, returns the number of bytes read
+        (less than len(target) only at EOF)"""
+        reader = self._reader
+        buffer = reader.buffer
+        n, size = 0, len(target)
+        while n < size:
+            if buffer.remaining > 0:
+                n += buffer.read_into(target, n)
+            else:
+                try:
+                    reader.fill()
+                except EOFError:
+                    buffer.flip()
+                    break
+        return n
+
     def write(self, s):
         self._writer.write_bytes(s)
 
@@ -0,0 +1,120 @@
+# Copyright (C) 2009, Hyves (Startphone Ltd.)
+#
+# This module is part of the Concurrence Framework and is released under
+# the New BSD License: http://www.opensource.org/licenses/bsd-license.php
+
+"""A central pool of :class:`~concurrence.io.Buffer` objects, shared by all clients and servers.
+
+Buffers are allocated in a fixed set of size classes (a requested size is rounded up to the next size class).
+Clients and servers take a buffer from the pool when a connection needs one, and give it back when the connection
+is idle or closed, so that many idle connections don't hold on to buffer memory::
+
+    from concurrence.io import bufferpool
+
+    buffer = bufferpool.default().get(16 * 1024)
+    ...
+    bufferpool.default().put(buffer)
+
+Sizes that are smaller than the smallest or larger than the largest size class are allocated with their exact size
+and are not pooled. The idle buffers kept per size class are capped, buffers that are returned to a full size class
+are freed.
+
+The counters of the pool are :mod:`concurrence.statistic` objects (see :func:`BufferPool.statistics`).
+"""
+
+import bisect
+
+from concurrence.io import Buffer
+from concurrence.statistic import Statistic, StatisticMinMax
+
+SIZE_CLASSES = [1024, 4 * 1024, 8 * 1024, 16 * 1024, 32 * 1024, 64 * 1024]
+MAX_POOLED_BYTES = 1024 * 1024 * 4 #default maximum nr of bytes of idle buffers kept per size class
+
+class _SizeClass(object):
+    def __init__(self, size, max_pooled):
+        self.size = size
+        self.max_pooled = max_pooled #maximum nr of idle buffers kept
+        self.free = {} #buffer class -> [list of idle buffers]
+        self.handed_out = set() #ids of the buffers that are in use
+        self.allocated = Statistic(0) #nr of buffers allocated
+        self.in_use = StatisticMinMax() #nr of buffers handed out and not yet returned
+        self.pooled = StatisticMinMax() #nr of idle buffers
+
+class BufferPool(object):
+    """A pool of buffers with the given *size_classes*, keeping at most *max_pooled_bytes* of idle buffers per size class."""
+
+    def __init__(self, size_classes = SIZE_CLASSES, max_pooled_bytes = MAX_POOLED_BYTES):
+        self._sizes = sorted(size_classes)
+        self._classes = {}
+        for size in self._sizes:
+            self._classes[size] = _SizeClass(size, max_pooled_bytes // size)
+        self._unpooled = Statistic(0) #nr of buffers allocated outside of the size classes
+
+    def get(self, size, buffer_class = Buffer):
+        """Returns an empty buffer of class *buffer_class* (:class:`~concurrence.io.Buffer` or :class:`~concurrence.io.RingBuffer`)
+        with a capacity of at least *size* bytes."""
+        i = bisect.bisect_left(self._sizes, size)
+        if i == len(self._sizes) or size < self._sizes[0]:
+            self._unpooled += 1
+            return buffer_class(size)
+        size_class = self._classes[self._sizes[i]]
+        size_class.in_use += 1
+        free = size_class.free.get(buffer_class)
+        if free:
+            size_class.pooled -= 1
+            buffer = free.pop()
+            buffer.clear()
+        else:
+            size_class.allocated += 1
+            buffer = buffer_class(size_class.size)
+        size_class.handed_out.add(id(buffer))
+        return buffer
+
+    def put(self, buffer):
+        """Gives *buffer* (as returned by :func:`get`) back to the pool. The caller must not use the buffer anymore
+        (nor any duplicate of it). Buffers that were not handed out by this pool, or that were already given back, are ignored."""
+        size_class = self._classes.get(buffer.capacity)
+        if size_class is None:
+            return #not pooled
+        if id(buffer) not in size_class.handed_out:
+            return #not ours, or put twice; pooling it would hand it out to 2 users
+        size_class.handed_out.remove(id(buffer))
+        size_class.in_use -= 1
+        free = size_class.free.setdefault(type(buffer), [])
+        if len(free) < size_class.max_pooled:
+            size_class.pooled += 1
+            free.append(buffer)
+        #else the pool is full for this size, the buffer is freed
+
+    def trim(self):
+        """Frees all idle buffers"""
+        for size_class in self._classes.values():
+            size_class.free.clear()
+            size_class.pooled.set_count(0)
+
+    def statistics(self):
+        """Returns the counters per size class, as a dict size -> dict with the number of buffers *allocated*,
+        *in_use* and *pooled* (as :class:`~concurrence.statistic.Statistic` objects) and the number of bytes
+        *in_use_bytes* and *pooled_bytes*. The number of allocations outside of the size classes is under the key *unpooled*."""
+        stats = {'unpooled': self._unpooled}
+        for size, size_class in self._classes.items():
+            stats[size] = {'allocated': size_class.allocated,
+                           'in_use': size_class.in_use,
+                           'pooled': size_class.pooled,
+                           'in_use_bytes': size_class.in_use.count * size,
+                           'pooled_bytes': size_class.pooled.count * size}
+        return stats
+
+_default = None
+
+def default():
+    """Returns the default :class:`BufferPool`, as used by the clients and servers of concurrence.
+    It is created on first use with the default :data:`SIZE_CLASSES`."""
+    global _default
+    if _default is None:
+        _default = BufferPool()
+    return _default
+
+def statistics():
+    """Returns the statistics of the default pool as a dict"""
+    return default().statistics()
@@ -16,3 +16,15 @@ cdef class Buffer:
     cdef int _write_byte(self, unsigned int b) except -1
 
     cdef object _read_bytes(self, int n)
+
+cdef class RingBuffer:
+    cdef unsigned char *_buff
+    cdef readonly int capacity
+    cdef int _start
+    cdef int _length
+
+    cdef void _consume(self, int n)
+    cdef int _byte_at(self, int i)
+    cdef int _find(self, int b)
+    cdef void _copy_out(self, char *dst, int n)
+    cdef object _read_bytes(self, int n)
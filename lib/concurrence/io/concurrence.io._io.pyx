@@ -10,6 +10,13 @@ cdef extern from "unistd.h":
    int write(int, void *, int)
    int read(int, void *, int) 
 
+cdef extern from "sys/uio.h":
+    struct iovec:
+        void *iov_base
+        int iov_len
+    int c_writev "writev"(int, iovec *, int)
+    int c_readv "readv"(int, iovec *, int)
+
 cdef extern from "string.h":
     cdef void *memmove(void *, void *, int)
     cdef void *memcpy(void *, void *, int)
@@ -25,7 +32,10 @@ cdef extern from "errno.h":
 cdef extern from "Python.h":
     object PyString_FromStringAndSize(char *, int)
     object PyString_FromString(char *)
+    char *PyString_AS_STRING(object)
     int PyString_AsStringAndSize(object obj, char **s, Py_ssize_t *len) except -1
+    int PyObject_AsWriteBuffer(object obj, void **buffer, Py_ssize_t *buffer_len) except -1
+    object PyBuffer_FromObject(object base, Py_ssize_t offset, Py_ssize_t size)
 
 cdef extern from "pyerrors.h":    
     object PyErr_SetFromErrno(object)
@@ -33,6 +43,17 @@ cdef extern from "pyerrors.h":
 cdef extern from "io_base.h":
     int sendfd(int, int)
     int recvfd(int)
+    long long io_sendfile(int, int, long long, long long)
+    ctypedef struct io_datagram:
+        char *data
+        int len
+    int io_recvmmsg(int, io_datagram *, int)
+    int io_sendmmsg(int, io_datagram *, int)
+    int io_sockaddr_set(io_datagram *, int, char *, int)
+    int io_sockaddr_get(io_datagram *, char *, int, int *)
+
+cdef extern from "sys/socket.h":
+    int AF_UNIX
     
 def error_from_errno(object exc):
     return PyErr_SetFromErrno(exc)
@@ -62,6 +83,8 @@ cdef class Buffer:
     If an operation tries to read beyond the current :attr:`limit` a BufferUnderflowError is raised. If an operation 
     tries to write beyond the current :attr:`limit` a BufferOverflowError is raised.
     The general idea of the :class:`Buffer` was shamelessly copied from java NIO. 
+    The buffer implements the (read-only) python buffer protocol, exposing all of its bytes (from 0 up to its :attr:`capacity`),
+    use :func:`read_view` to get a view of the bytes at the current position.
     """
 
     def __cinit__(self, int capacity, Buffer parent = None):
@@ -276,6 +299,17 @@ cdef class Buffer:
              s = self._buff[self._position] + (self._buff[self._position + 1] << 8)
              self._position = self._position + 2
              return s
+
+    def read_int(self):
+        """Read a 4 byte little endian unsigned integer from buffer and updates position."""
+        cdef unsigned int i
+        if 4 > (self._limit - self._position):
+            raise BufferUnderflowError()
+        else:
+             i = self._buff[self._position] + (self._buff[self._position + 1] << 8) + \
+                 (self._buff[self._position + 2] << 16) + (<unsigned int>self._buff[self._position + 3] << 24)
+             self._position = self._position + 4
+             return i
         
     cdef object _read_bytes(self, int n):
         """reads n bytes from buffer, updates position, and returns bytes as a python string"""
@@ -325,7 +359,7 @@ cdef class Buffer:
         if zpos == NULL:
             raise BufferUnderflowError()
         n = zpos - start
-        if self._buff[self._position + n - 1] == 13: #\r\n
+        if n > 0 and self._buff[self._position + n - 1] == 13: #\r\n
             if include_separator:
                 s = PyString_FromStringAndSize(start, n + 1)
                 self._position = self._position + n + 1
@@ -341,6 +375,52 @@ cdef class Buffer:
                 self._position = self._position + n + 1                                    
         return s
     
+    def read_view(self, int n = -1):
+        """Reads n bytes (or all remaining bytes if n is -1) from the buffer without copying them and updates position.
+        Returns a read-only view (a python buffer object) of the bytes, that can be passed to anything accepting a buffer,
+        e.g. file.write, zlib or struct.unpack_from. Note that the view shares the memory of the buffer, so it is only valid
+        until the buffer is written to again (e.g. by compact or the next read from a stream)."""
+        if n == -1:
+            n = self._limit - self._position
+        if n < 0 or n > (self._limit - self._position):
+            raise BufferUnderflowError()
+        view = PyBuffer_FromObject(self, self._position, n)
+        self._position = self._position + n
+        return view
+
+    def read_into(self, target, Py_ssize_t offset = 0):
+        """Copies as many of the remaining bytes as fit into the writable python buffer object *target* (e.g. a bytearray or array)
+        starting at *offset* in the target, and updates position. Returns the number of bytes copied."""
+        cdef void *b
+        cdef Py_ssize_t size
+        cdef int n
+        PyObject_AsWriteBuffer(target, &b, &size)
+        if offset < 0 or offset > size:
+            raise BufferInvalidArgumentError("offset must be in range [0..len(target)]")
+        n = self._limit - self._position
+        if n > size - offset:
+            n = size - offset
+        memcpy(<char *>b + offset, self._buff + self._position, n)
+        self._position = self._position + n
+        return n
+
+    def __getsegcount__(self, Py_ssize_t *p):
+        if p != NULL:
+            p[0] = self.capacity
+        return 1
+
+    def __getreadbuffer__(self, Py_ssize_t i, void **p):
+        if i != 0:
+            raise SystemError("accessing non-existent buffer segment")
+        p[0] = self._buff
+        return self.capacity
+
+    def __getcharbuffer__(self, Py_ssize_t i, char **p):
+        if i != 0:
+            raise SystemError("accessing non-existent buffer segment")
+        p[0] = <char *>self._buff
+        return self.capacity
+
     def write_bytes(self, s):
         """Writes a number of bytes given by the python string s to the buffer and updates position. Raises 
         :exc:`BufferOverflowError` if you try to write beyond the current :attr:`limit`."""
@@ -436,7 +516,401 @@ cdef class Buffer:
     
     def __str__(self):
         return repr(self)
-    
+
+cdef class RingBuffer:
+    """Creates a :class:`RingBuffer` object, a variant of :class:`Buffer` for reading from streams.
+    Unlike a :class:`Buffer` it is always ready for both receiving and reading; the unread bytes (:attr:`remaining`) 
+    wrap around the end of the buffer, so that bytes left over from a partial read never need to be moved to the front 
+    (e.g. :func:`compact` and :func:`flip` are no-ops). :func:`recv` fills all :attr:`free` space with a single readv call.
+    It can be used by a :class:`~concurrence.io.buffered.BufferedReader` of a :class:`~concurrence.io.socket.Socket`
+    in place of a :class:`Buffer` (see :class:`~concurrence.io.buffered.BufferedStream`).
+    """
+
+    def __cinit__(self, int capacity):
+        self.capacity = capacity
+        self._buff = <unsigned char *>(calloc(1, self.capacity))
+
+    def __dealloc__(self):
+        free(self._buff)
+
+    def __init__(self, int capacity):
+        """Create a new empty ring buffer with the given *capacity*."""
+        self.clear()
+
+    def clear(self):
+        """Discards all unread bytes."""
+        self._start = 0
+        self._length = 0
+
+    def compact(self):
+        """Does nothing, a ring buffer is always ready for receiving"""
+        pass
+
+    def flip(self):
+        """Does nothing, a ring buffer is always ready for reading"""
+        pass
+
+    property remaining:
+        """The nr of unread bytes"""
+        def __get__(self):
+            return self._length
+
+    property free:
+        """The nr of bytes that can be received before the buffer is full"""
+        def __get__(self):
+            return self.capacity - self._length
+
+    cdef void _consume(self, int n):
+        self._length = self._length - n
+        if self._length == 0:
+            self._start = 0 #keeps the next recv and read contiguous
+        else:
+            self._start = (self._start + n) % self.capacity
+
+    cdef int _byte_at(self, int i):
+        return self._buff[(self._start + i) % self.capacity]
+
+    cdef int _find(self, int b):
+        #returns the offset of byte b in the unread bytes, or -1 when it is not there
+        cdef int first
+        cdef unsigned char *z
+        first = self.capacity - self._start
+        if first > self._length:
+            first = self._length
+        z = <unsigned char *>(memchr(self._buff + self._start, b, first))
+        if z != NULL:
+            return z - (self._buff + self._start)
+        if self._length > first:
+            z = <unsigned char *>(memchr(self._buff, b, self._length - first))
+            if z != NULL:
+                return first + (z - self._buff)
+        return -1
+
+    cdef void _copy_out(self, char *dst, int n):
+        #copies the first n unread bytes to dst
+        cdef int first
+        first = self.capacity - self._start
+        if n <= first:
+            memcpy(dst, self._buff + self._start, n)
+        else:
+            memcpy(dst, self._buff + self._start, first)
+            memcpy(dst + first, self._buff, n - first)
+
+    cdef object _read_bytes(self, int n):
+        if n > self._length:
+            raise BufferUnderflowError()
+        if self._start + n <= self.capacity:
+            s = PyString_FromStringAndSize(<char *>(self._buff + self._start), n)
+        else:
+            s = PyString_FromStringAndSize(NULL, n)
+            self._copy_out(PyString_AS_STRING(s), n)
+        self._consume(n)
+        return s
+
+    def recv(self, int fd):
+        """Reads as many bytes as will fit in the :attr:`free` space of the buffer from the filedescriptor *fd*.
+        Returns a tuple (bytes_read, bytes_free). If *bytes_read* is negative, a IO Error was encountered."""
+        cdef iovec iov[2]
+        cdef int end, n, b
+        end = self._start + self._length
+        if end < self.capacity:
+            iov[0].iov_base = self._buff + end
+            iov[0].iov_len = self.capacity - end
+            iov[1].iov_base = self._buff
+            iov[1].iov_len = self._start
+            if self._start > 0:
+                n = 2
+            else:
+                n = 1
+        else:
+            end = end - self.capacity
+            iov[0].iov_base = self._buff + end
+            iov[0].iov_len = self._start - end
+            n = 1
+        b = c_readv(fd, iov, n)
+        if b > 0: self._length = self._length + b
+        return b, self.capacity - self._length
+
+    def write_bytes(self, s):
+        """Appends the bytes of the python string s to the unread bytes. Raises :exc:`BufferOverflowError` 
+        if they don't fit in the :attr:`free` space."""
+        cdef char *b
+        cdef Py_ssize_t n
+        cdef int end, first
+        PyString_AsStringAndSize(s, &b, &n)
+        if n > self.capacity - self._length:
+            raise BufferOverflowError()
+        end = (self._start + self._length) % self.capacity
+        first = self.capacity - end
+        if n <= first:
+            memcpy(self._buff + end, b, n)
+        else:
+            memcpy(self._buff + end, b, first)
+            memcpy(self._buff, b + first, n - first)
+        self._length = self._length + n
+        return n
+
+    def skip(self, int n):
+        """Skips n unread bytes, raises :exc:`BufferUnderflowError` if there are not that many"""
+        if n > self._length:
+            raise BufferUnderflowError()
+        self._consume(n)
+        return n
+
+    def read_byte(self):
+        """Reads and returns a single byte from the buffer."""
+        cdef int b
+        if self._length == 0:
+            raise BufferUnderflowError()
+        b = self._buff[self._start]
+        self._consume(1)
+        return b
+
+    def read_short(self):
+        """Read a 2 byte little endian integer from buffer."""
+        cdef int s
+        if self._length < 2:
+            raise BufferUnderflowError()
+        s = self._byte_at(0) + (self._byte_at(1) << 8)
+        self._consume(2)
+        return s
+
+    def read_int(self):
+        """Read a 4 byte little endian unsigned integer from buffer, the bytes may wrap around the end of the buffer."""
+        cdef unsigned int i
+        if self._length < 4:
+            raise BufferUnderflowError()
+        i = self._byte_at(0) + (self._byte_at(1) << 8) + (self._byte_at(2) << 16) + (<unsigned int>self._byte_at(3) << 24)
+        self._consume(4)
+        return i
+
+    def read_bytes(self, int n = -1):
+        """Reads n bytes (or all remaining bytes if n is -1) from buffer and returns them as a python string,
+        if there are no n bytes available, a :exc:`BufferUnderflowError` is raised."""
+        if n == -1:
+            n = self._length
+        return self._read_bytes(n)
+
+    def read_bytes_until(self, int b):
+        """Reads bytes until character b is found, or end of buffer is reached in which case it will raise a :exc:`BufferUnderflowError`."""
+        cdef int n
+        if b < 0 or b > 255:
+            raise BufferInvalidArgumentError("b must in range [0..255]")
+        n = self._find(b)
+        if n == -1:
+            raise BufferUnderflowError()
+        s = self._read_bytes(n)
+        self._consume(1)
+        return s
+
+    def read_line(self, int include_separator = 0):
+        """Reads a single line of bytes from the buffer where the end of the line is indicated by either 'LF' or 'CRLF', 
+        the line may wrap around the end of the buffer. See :func:`Buffer.read_line`."""
+        cdef int n
+        n = self._find(10)
+        if n == -1:
+            raise BufferUnderflowError()
+        if include_separator:
+            return self._read_bytes(n + 1)
+        elif n > 0 and self._byte_at(n - 1) == 13: #\r\n
+            s = self._read_bytes(n - 1)
+            self._consume(2)
+            return s
+        else: #\n
+            s = self._read_bytes(n)
+            self._consume(1)
+            return s
+
+    def read_view(self, int n = -1):
+        """Like :func:`Buffer.read_view`, but when the n bytes wrap around the end of the buffer they are returned as 
+        a (copied) string."""
+        if n == -1:
+            n = self._length
+        if n < 0 or n > self._length:
+            raise BufferUnderflowError()
+        if self._start + n > self.capacity:
+            return self._read_bytes(n)
+        view = PyBuffer_FromObject(self, self._start, n)
+        self._consume(n)
+        return view
+
+    def read_into(self, target, Py_ssize_t offset = 0):
+        """Copies as many of the remaining bytes as fit into the writable python buffer object *target*
+        starting at *offset* in the target. Returns the number of bytes copied."""
+        cdef void *b
+        cdef Py_ssize_t size
+        cdef int n
+        PyObject_AsWriteBuffer(target, &b, &size)
+        if offset < 0 or offset > size:
+            raise BufferInvalidArgumentError("offset must be in range [0..len(target)]")
+        n = self._length
+        if n > size - offset:
+            n = size - offset
+        self._copy_out(<char *>b + offset, n)
+        self._consume(n)
+        return n
+
+    def __getsegcount__(self, Py_ssize_t *p):
+        if p != NULL:
+            p[0] = self.capacity
+        return 1
+
+    def __getreadbuffer__(self, Py_ssize_t i, void **p):
+        if i != 0:
+            raise SystemError("accessing non-existent buffer segment")
+        p[0] = self._buff
+        return self.capacity
+
+    def __repr__(self):
+        return '<RingBuffer capacity=%d start=%d remaining=%d>' % (self.capacity, self._start, self._length)
+
+IOV_MAX = 1024 #max nr of strings or buffers written by 1 writev call
+
+def writev(int fd, object items, int offset = 0):
+    """Writes the python strings and buffers (the bytes between their position and limit) of the list *items*
+    to the filedescriptor *fd* with a single writev call, without copying them. The first *offset* bytes are skipped.
+    At most :data:`IOV_MAX` items are written. Returns the number of bytes written. If this is negative, an IO Error was encountered.
+    Note that the position of the buffers is not updated."""
+    cdef iovec iov[1024]
+    cdef int n, length, i
+    cdef char *b
+    cdef Py_ssize_t slen
+    cdef Buffer buf
+    n = 0
+    for item in items:
+        if type(item) is Buffer:
+            buf = item
+            b = <char *>(buf._buff + buf._position)
+            length = buf._limit - buf._position
+        else:
+            PyString_AsStringAndSize(item, &b, &slen)
+            length = slen
+        if offset >= length:
+            offset = offset - length
+            continue
+        iov[n].iov_base = b + offset
+        iov[n].iov_len = length - offset
+        offset = 0
+        n = n + 1
+        if n == 1024:
+            break
+    if n == 0:
+        return 0
+    return c_writev(fd, iov, n)
+
+def sendfile(int out_fd, int in_fd, long long offset, long long count):
+    """Sends at most *count* bytes of the file *in_fd* starting at *offset* to the socket *out_fd*, without copying them
+    trough user space (on linux, freebsd and osx). Returns the number of bytes sent, which is 0 at the end of the file.
+    If this is negative, an IO Error was encountered."""
+    return io_sendfile(out_fd, in_fd, offset, count)
+
+DATAGRAM_BATCH = 64 #max nr of datagrams received or sent by 1 recvmmsg or sendmmsg call
+
+cdef int _set_address(io_datagram *datagram, int family, object address) except -1:
+    cdef int port
+    if family == AF_UNIX:
+        host = address
+        port = 0
+    else:
+        host = address[0]
+        port = address[1]
+    if type(host) is not str or io_sockaddr_set(datagram, family, host, port) < 0:
+        raise ValueError("not a numeric address: %r" % (address,))
+    return 0
+
+cdef object _get_address(io_datagram *datagram):
+    cdef char host[128]
+    cdef int port, family
+    family = io_sockaddr_get(datagram, host, 128, &port)
+    if family == AF_UNIX:
+        return PyString_FromString(host)
+    elif family > 0:
+        return (PyString_FromString(host), port)
+    else:
+        return None
+
+def recvfrom(int fd, Buffer buffer):
+    """Receives a datagram from the socket *fd* into *buffer* (between its position and limit, the rest of a larger datagram
+    is discarded). Returns a tuple (bytes_read, address), where address is a tuple (host, port) with a numeric host or the path of a
+    unix domain socket. If *bytes_read* is negative, an IO Error was encountered. The position of the buffer is updated."""
+    cdef io_datagram datagram
+    datagram.data = <char *>(buffer._buff + buffer._position)
+    datagram.len = buffer._limit - buffer._position
+    if io_recvmmsg(fd, &datagram, 1) < 0:
+        return -1, None
+    buffer._position = buffer._position + datagram.len
+    return datagram.len, _get_address(&datagram)
+
+def sendto(int fd, int family, Buffer buffer, object address):
+    """Sends the bytes of *buffer* between its position and limit as a datagram to *address* (a tuple (host, port) with a numeric
+    host, or the path of a unix domain socket) trough the socket *fd* of address *family*. Raises ValueError when the address
+    is not numeric. Returns the number of bytes sent, if this is negative, an IO Error was encountered.
+    The position of the buffer is updated."""
+    cdef io_datagram datagram
+    _set_address(&datagram, family, address)
+    datagram.data = <char *>(buffer._buff + buffer._position)
+    datagram.len = buffer._limit - buffer._position
+    if io_sendmmsg(fd, &datagram, 1) < 0:
+        return -1
+    buffer._position = buffer._limit
+    return datagram.len
+
+def recvmmsg(int fd, object buffers):
+    """Receives at most :data:`DATAGRAM_BATCH` datagrams from the socket *fd*, one in each buffer of the list *buffers*
+    (see :func:`recvfrom`), with a single system call where the platform supports it (recvmmsg on linux). Returns a list
+    of (bytes_read, address) tuples for the buffers that received a datagram, or None when an IO Error was encountered."""
+    cdef io_datagram datagrams[64]
+    cdef int n, i
+    cdef Buffer buf
+    n = 0
+    for item in buffers:
+        if n == 64:
+            break
+        buf = item
+        datagrams[n].data = <char *>(buf._buff + buf._position)
+        datagrams[n].len = buf._limit - buf._position
+        n = n + 1
+    n = io_recvmmsg(fd, datagrams, n)
+    if n < 0:
+        return None
+    result = []
+    for i from 0 <= i < n:
+        buf = buffers[i]
+        buf._position = buf._position + datagrams[i].len
+        result.append((datagrams[i].len, _get_address(&datagrams[i])))
+    return result
+
+def sendmmsg(int fd, int family, object items, int offset = 0):
+    """Sends at most :data:`DATAGRAM_BATCH` datagrams of the list *items*, starting at index *offset*, trough the socket *fd* of
+    address *family*, with a single system call where the platform supports it (sendmmsg on linux).
+    The items are (data, address) tuples, where data is a python string or a buffer (the bytes between its position and limit)
+    and address is as for :func:`sendto`. Raises ValueError when an address is not numeric. Returns the number of datagrams sent,
+    if this is negative, an IO Error was encountered. Note that the position of the buffers is not updated."""
+    cdef io_datagram datagrams[64]
+    cdef int n, end
+    cdef char *b
+    cdef Py_ssize_t slen
+    cdef Buffer buf
+    end = len(items)
+    if end > offset + 64:
+        end = offset + 64
+    n = 0
+    while offset + n < end:
+        data, address = items[offset + n]
+        _set_address(&datagrams[n], family, address)
+        if type(data) is Buffer:
+            buf = data
+            datagrams[n].data = <char *>(buf._buff + buf._position)
+            datagrams[n].len = buf._limit - buf._position
+        else:
+            PyString_AsStringAndSize(data, &b, &slen)
+            datagrams[n].data = b
+            datagrams[n].len = slen
+        n = n + 1
+    if n == 0:
+        return 0
+    return io_sendmmsg(fd, datagrams, n)
+
 def msgsendfd(dst_fd, fd):
     return sendfd(dst_fd, fd)
 
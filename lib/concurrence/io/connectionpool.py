@@ -0,0 +1,191 @@
+# Copyright (C) 2009, Hyves (Startphone Ltd.)
+#
+# This module is part of the Concurrence Framework and is released under
+# the New BSD License: http://www.opensource.org/licenses/bsd-license.php
+
+"""A pool of connected sockets keyed by endpoint, for clients that connect trough :class:`~concurrence.io.Connector`.
+
+Sockets are reused most recently used first, so that the warmest connections stay busy and the others time out.
+An idle socket that becomes readable was closed by the server (or is out of sync with it) and is closed and removed
+from the pool right away. When an endpoint has its maximum number of connections, tasks wait until a socket is returned::
+
+    from concurrence.io.connectionpool import ConnectionPool
+
+    pool = ConnectionPool(max_per_endpoint = 4)
+
+    with pool.connection(('localhost', 11211)) as socket:
+        ...
+
+The HTTP (:class:`~concurrence.http.client.HTTPConnection`), memcache and thrift clients accept a pool to take their
+connections from. The counters of the pool are :mod:`concurrence.statistic` objects (see :func:`ConnectionPool.statistics`).
+"""
+from __future__ import with_statement
+
+import logging
+
+from concurrence import Channel, TIMEOUT_NEVER
+from concurrence.io import Connector
+from concurrence.statistic import Statistic, StatisticExtra
+
+MAX_PER_ENDPOINT = 10 #default maximum nr of connections per endpoint
+IDLE_TIMEOUT = 60.0 #default seconds after which an idle connection is closed
+
+class _Endpoint(object):
+    __slots__ = ['endpoint', 'idle', 'connections', 'waiting']
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.idle = [] #the idle sockets, the most recently used last
+        self.connections = 0 #nr of sockets in use, idle, or being connected
+        self.waiting = Channel() #tasks waiting for a socket to be returned
+
+class _PooledConnection(object):
+    #returned by ConnectionPool.connection so that it can be used in a with statement
+    def __init__(self, pool, endpoint):
+        self._pool = pool
+        self._endpoint = endpoint
+        self._socket = None
+
+    def __enter__(self):
+        self._socket = self._pool.get(self._endpoint)
+        return self._socket
+
+    def __exit__(self, type, value, traceback):
+        self._pool.put(self._socket, close = type is not None)
+
+class ConnectionPool(object):
+    """A pool of at most *max_per_endpoint* sockets per endpoint, made by *connector*.
+    Idle sockets are closed after *idle_timeout* seconds (None to keep them open)."""
+    log = logging.getLogger('ConnectionPool')
+
+    def __init__(self, max_per_endpoint = MAX_PER_ENDPOINT, idle_timeout = IDLE_TIMEOUT, connector = Connector):
+        self.max_per_endpoint = max_per_endpoint
+        self.idle_timeout = idle_timeout
+        self._connector = connector
+        self._endpoints = {} #endpoint -> _Endpoint
+        self._in_use = {} #socket -> _Endpoint
+        self._created = Statistic(0) #nr of connections made
+        self._reused = Statistic(0) #nr of times an idle connection was handed out
+        self._failed = Statistic(0) #nr of connects that failed
+        self._closed_idle = Statistic(0) #nr of idle connections closed on the idle timeout
+        self._closed_broken = Statistic(0) #nr of idle connections that were closed by the server
+        self._wait = StatisticExtra() #time spent waiting for a connection to be returned
+
+    def get(self, endpoint):
+        """Returns a connected socket to *endpoint*, the most recently returned idle one, a new one when the endpoint has less
+        than *max_per_endpoint* connections, or else the next one that is returned to the pool (the current timeout applies
+        while waiting). The socket must be given back with :func:`put`."""
+        state = self._endpoints.get(endpoint)
+        if state is None:
+            state = self._endpoints[endpoint] = _Endpoint(endpoint)
+        if state.idle:
+            socket = state.idle.pop()
+            socket.readable.cancel()
+            self._reused += 1
+        elif state.connections < self.max_per_endpoint:
+            socket = self._connect(state)
+        else:
+            with self._wait.time():
+                socket = state.waiting.receive()
+            if socket is None:
+                #a connection was closed, so we may make a new one
+                socket = self._connect(state)
+            else:
+                self._reused += 1
+        self._in_use[socket] = state
+        return socket
+
+    def _connect(self, state):
+        state.connections += 1
+        try:
+            socket = self._connector.connect(state.endpoint)
+        except:
+            self._failed += 1
+            self._free(state)
+            raise
+        self._created += 1
+        return socket
+
+    def _free(self, state):
+        #a connection of state is gone, a waiting task may make a new one
+        state.connections -= 1
+        if state.waiting.has_receiver():
+            state.waiting.send(None)
+
+    def put(self, socket, close = False):
+        """Gives *socket* (as returned by :func:`get`) back to the pool. Pass *close* when the connection cannot be reused
+        (e.g. after an error, or when there are unread bytes left), it is closed instead."""
+        state = self._in_use.pop(socket)
+        if close or socket.is_closed():
+            if not socket.is_closed():
+                socket.close()
+            self._free(state)
+        elif state.waiting.has_receiver():
+            state.waiting.send(socket) #hand it to the task that waited longest
+        else:
+            state.idle.append(socket)
+            if self.idle_timeout is None:
+                timeout = TIMEOUT_NEVER
+            else:
+                timeout = self.idle_timeout
+            socket.readable.notify(lambda timed_out: self._on_idle_event(state, socket, timed_out), timeout)
+
+    def _on_idle_event(self, state, socket, timed_out):
+        #called by the dispatcher when an idle socket becomes readable or reaches its idle timeout
+        if timed_out:
+            self._closed_idle += 1
+        else:
+            self._closed_broken += 1
+            self.log.debug("connection to %s closed by server while idle", state.endpoint)
+        state.idle.remove(socket)
+        socket.close()
+        self._free(state)
+
+    def connection(self, endpoint):
+        """Returns a context manager for the with statement, that gets a socket to *endpoint* from the pool (see :func:`get`),
+        and puts it back at the end of the block, or closes it when the block raised an exception."""
+        return _PooledConnection(self, endpoint)
+
+    def close(self):
+        """Closes all idle connections"""
+        for state in self._endpoints.values():
+            while state.idle:
+                socket = state.idle.pop()
+                socket.readable.cancel()
+                socket.close()
+                self._free(state)
+
+    def statistics(self):
+        """Returns the nr of connections *created*, *reused*, *failed* to connect, closed on the idle timeout (*closed_idle*)
+        and closed by the server while idle (*closed_broken*) as :class:`~concurrence.statistic.Statistic` objects, the time
+        spent waiting for a connection (*wait*, a :class:`~concurrence.statistic.StatisticExtra`), and per endpoint the nr
+        of *connections*, *idle* connections and *waiting* tasks as a dict under the key *endpoints*."""
+        endpoints = {}
+        for endpoint, state in self._endpoints.items():
+            balance = state.waiting.balance
+            endpoints[endpoint] = {'connections': state.connections,
+                                   'idle': len(state.idle),
+                                   'waiting': -balance if balance < 0 else 0}
+        return {'created': self._created,
+                'reused': self._reused,
+                'failed': self._failed,
+                'closed_idle': self._closed_idle,
+                'closed_broken': self._closed_broken,
+                'wait': self._wait,
+                'endpoints': endpoints}
+
+_default = None
+
+def default():
+    """Returns the default :class:`ConnectionPool`. It is created on first use with :data:`MAX_PER_ENDPOINT` connections
+    per endpoint and an idle timeout of :data:`IDLE_TIMEOUT` seconds."""
+    global _default
+    if _default is None:
+        _default = ConnectionPool()
+    return _default
+
+def statistics():
+    """Returns the statistics of the default pool as a dict"""
+    if _default is None:
+        return {}
+    return _default.statistics()
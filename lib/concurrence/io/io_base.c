@@ -1,9 +1,14 @@
+#if defined(__linux__)
+#define _GNU_SOURCE //for recvmmsg and sendmmsg
+#endif
+
 #include "io_base.h"
 
 #include <stdio.h>
 #include <stdlib.h>
 #include <unistd.h>
 #include <string.h>
+#include <errno.h>
 
 #include <sys/types.h>
 #include <sys/socket.h>
@@ -53,13 +58,211 @@ int recvfd(int src_fd)
 	  .msg_iovlen = 1,
 	};
 
-	//TODO check return val
-	recvmsg(src_fd, &message, 0);
+	//returns -1 on error, with errno set to 0 when the other end was closed
+	errno = 0;
+	if(recvmsg(src_fd, &message, 0) <= 0) {
+		return -1;
+	}
 
 	struct cmsghdr *cmessage = CMSG_FIRSTHDR(&message);
+	if(cmessage == NULL || cmessage->cmsg_type != SCM_RIGHTS) {
+		errno = EBADMSG;
+		return -1;
+	}
 	memcpy(file_descriptors, CMSG_DATA(cmessage), sizeof file_descriptors);
 
 	return file_descriptors[0];
 }
 
 
+
+#if defined(__linux__)
+#include <sys/sendfile.h>
+#elif defined(__FreeBSD__) || defined(__APPLE__)
+#include <sys/uio.h>
+#endif
+
+long long io_sendfile(int out_fd, int in_fd, long long offset, long long count)
+{
+	//sends at most count bytes of in_fd starting at offset to the socket out_fd, without copying
+	//them trough user space where the os supports it. returns the nr of bytes sent (0 at the end of in_fd),
+	//or -1 on error (EAGAIN when the socket is not writable)
+#if defined(__linux__)
+	off_t off = offset;
+	return sendfile(out_fd, in_fd, &off, count);
+#elif defined(__FreeBSD__)
+	off_t sbytes = 0;
+	if(sendfile(in_fd, out_fd, offset, count, NULL, &sbytes, 0) < 0 && sbytes == 0) {
+		return -1;
+	}
+	return sbytes; //a partial write may fail with EAGAIN
+#elif defined(__APPLE__)
+	off_t len = count;
+	if(sendfile(in_fd, out_fd, offset, &len, NULL, 0) < 0 && len == 0) {
+		return -1;
+	}
+	return len;
+#else
+	char buffer[1024 * 16];
+	ssize_t n;
+	if(count > sizeof buffer) {
+		count = sizeof buffer;
+	}
+	n = pread(in_fd, buffer, count, offset);
+	if(n <= 0) {
+		return n;
+	}
+	return write(out_fd, buffer, n);
+#endif
+}
+
+#include <sys/un.h>
+#include <netinet/in.h>
+#include <arpa/inet.h>
+
+#if defined(__linux__) && defined(MSG_WAITFORONE)
+#define HAVE_MMSG
+#endif
+
+int io_recvmmsg(int fd, io_datagram *datagrams, int count)
+{
+	//receives at most count datagrams with a single system call where the os supports it. returns the nr of
+	//datagrams received, their len and source addr are updated. returns -1 on error (EAGAIN when none are waiting)
+	int i;
+	ssize_t n;
+	if(count > IO_DATAGRAM_BATCH) {
+		count = IO_DATAGRAM_BATCH;
+	}
+#if defined(HAVE_MMSG)
+	if(count > 1) {
+		struct mmsghdr msgs[IO_DATAGRAM_BATCH];
+		struct iovec iovs[IO_DATAGRAM_BATCH];
+		memset(msgs, 0, count * sizeof(struct mmsghdr));
+		for(i = 0; i < count; i++) {
+			iovs[i].iov_base = datagrams[i].data;
+			iovs[i].iov_len = datagrams[i].len;
+			msgs[i].msg_hdr.msg_iov = &iovs[i];
+			msgs[i].msg_hdr.msg_iovlen = 1;
+			msgs[i].msg_hdr.msg_name = &datagrams[i].addr;
+			msgs[i].msg_hdr.msg_namelen = sizeof(struct sockaddr_storage);
+		}
+		n = recvmmsg(fd, msgs, count, MSG_DONTWAIT, NULL);
+		for(i = 0; i < n; i++) {
+			datagrams[i].len = msgs[i].msg_len;
+			datagrams[i].addrlen = msgs[i].msg_hdr.msg_namelen;
+		}
+		return n;
+	}
+#endif
+	for(i = 0; i < count; i++) {
+		datagrams[i].addrlen = sizeof(struct sockaddr_storage);
+		n = recvfrom(fd, datagrams[i].data, datagrams[i].len, 0, (struct sockaddr *)&datagrams[i].addr, &datagrams[i].addrlen);
+		if(n < 0) {
+			return i > 0 ? i : -1;
+		}
+		datagrams[i].len = n;
+	}
+	return count;
+}
+
+int io_sendmmsg(int fd, io_datagram *datagrams, int count)
+{
+	//sends at most count datagrams with a single system call where the os supports it. returns the nr of
+	//datagrams sent, or -1 on error (EAGAIN when the socket is not writable)
+	int i;
+	if(count > IO_DATAGRAM_BATCH) {
+		count = IO_DATAGRAM_BATCH;
+	}
+#if defined(HAVE_MMSG)
+	if(count > 1) {
+		struct mmsghdr msgs[IO_DATAGRAM_BATCH];
+		struct iovec iovs[IO_DATAGRAM_BATCH];
+		memset(msgs, 0, count * sizeof(struct mmsghdr));
+		for(i = 0; i < count; i++) {
+			iovs[i].iov_base = datagrams[i].data;
+			iovs[i].iov_len = datagrams[i].len;
+			msgs[i].msg_hdr.msg_iov = &iovs[i];
+			msgs[i].msg_hdr.msg_iovlen = 1;
+			msgs[i].msg_hdr.msg_name = &datagrams[i].addr;
+			msgs[i].msg_hdr.msg_namelen = datagrams[i].addrlen;
+		}
+		return sendmmsg(fd, msgs, count, MSG_DONTWAIT);
+	}
+#endif
+	for(i = 0; i < count; i++) {
+		if(sendto(fd, datagrams[i].data, datagrams[i].len, 0, (struct sockaddr *)&datagrams[i].addr, datagrams[i].addrlen) < 0) {
+			return i > 0 ? i : -1;
+		}
+	}
+	return count;
+}
+
+int io_sockaddr_set(io_datagram *datagram, int family, const char *host, int port)
+{
+	//sets the addr of the datagram from a numeric host (or the path of a unix domain socket).
+	//returns -1 when host is not a numeric address of the family
+	memset(&datagram->addr, 0, sizeof(struct sockaddr_storage));
+	if(family == AF_INET) {
+		struct sockaddr_in *sin = (struct sockaddr_in *)&datagram->addr;
+		sin->sin_family = AF_INET;
+		sin->sin_port = htons(port);
+		datagram->addrlen = sizeof(struct sockaddr_in);
+		return inet_pton(AF_INET, host, &sin->sin_addr) == 1 ? 0 : -1;
+	}
+	else if(family == AF_INET6) {
+		struct sockaddr_in6 *sin6 = (struct sockaddr_in6 *)&datagram->addr;
+		sin6->sin6_family = AF_INET6;
+		sin6->sin6_port = htons(port);
+		datagram->addrlen = sizeof(struct sockaddr_in6);
+		return inet_pton(AF_INET6, host, &sin6->sin6_addr) == 1 ? 0 : -1;
+	}
+	else if(family == AF_UNIX) {
+		struct sockaddr_un *sun = (struct sockaddr_un *)&datagram->addr;
+		if(strlen(host) >= sizeof sun->sun_path) {
+			return -1;
+		}
+		sun->sun_family = AF_UNIX;
+		strcpy(sun->sun_path, host);
+		datagram->addrlen = sizeof(struct sockaddr_un);
+		return 0;
+	}
+	return -1;
+}
+
+int io_sockaddr_get(io_datagram *datagram, char *host, int hostlen, int *port)
+{
+	//gets the numeric host and port (or the path of a unix domain socket) from the addr of the datagram.
+	//returns the address family, 0 when there is no address (an unbound unix domain socket),
+	//or -1 when the family is not supported
+	struct sockaddr *sa = (struct sockaddr *)&datagram->addr;
+	host[0] = 0;
+	*port = 0;
+	if(datagram->addrlen == 0) {
+		return 0;
+	}
+	else if(sa->sa_family == AF_INET) {
+		struct sockaddr_in *sin = (struct sockaddr_in *)sa;
+		inet_ntop(AF_INET, &sin->sin_addr, host, hostlen);
+		*port = ntohs(sin->sin_port);
+	}
+	else if(sa->sa_family == AF_INET6) {
+		struct sockaddr_in6 *sin6 = (struct sockaddr_in6 *)sa;
+		inet_ntop(AF_INET6, &sin6->sin6_addr, host, hostlen);
+		*port = ntohs(sin6->sin6_port);
+	}
+	else if(sa->sa_family == AF_UNIX) {
+		struct sockaddr_un *sun = (struct sockaddr_un *)sa;
+		int n = datagram->addrlen - (int)((char *)sun->sun_path - (char *)sun);
+		if(n >= hostlen) {
+			n = hostlen - 1;
+		}
+		if(n > 0) {
+			memcpy(host, sun->sun_path, n);
+			host[n] = 0;
+		}
+	}
+	else {
+		return -1;
+	}
+	return sa->sa_family;
+}
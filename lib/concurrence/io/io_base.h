@@ -1,2 +1,19 @@
+#include <sys/types.h>
+#include <sys/socket.h>
+
+#define IO_DATAGRAM_BATCH 64 //max nr of datagrams received or sent by 1 call of io_recvmmsg/io_sendmmsg
+
+typedef struct io_datagram {
+	char *data; //the bytes of the datagram
+	int len; //nr of bytes of data to send, or available for receiving (updated to the nr received)
+	struct sockaddr_storage addr; //destination or source address
+	socklen_t addrlen;
+} io_datagram;
+
 extern int sendfd(int dst_fd, int fd);
 extern int recvfd(int src_fd);
+extern long long io_sendfile(int out_fd, int in_fd, long long offset, long long count);
+extern int io_recvmmsg(int fd, io_datagram *datagrams, int count);
+extern int io_sendmmsg(int fd, io_datagram *datagrams, int count);
+extern int io_sockaddr_set(io_datagram *datagram, int family, const char *host, int port);
+extern int io_sockaddr_get(io_datagram *datagram, char *host, int hostlen, int *port);
@@ -6,24 +6,41 @@
 import logging
 import _socket
 import types
+import time
 import os
 
+from signal import SIGCHLD, SIGTERM, SIGKILL
+
 from errno import EALREADY, EINPROGRESS, EWOULDBLOCK, ECONNRESET, ENOTCONN, ESHUTDOWN, EINTR, EISCONN, ENOENT, EAGAIN
 
 import _io
 
-from concurrence import Tasklet, FileDescriptorEvent, TIMEOUT_CURRENT
+from concurrence import Tasklet, Channel, FileDescriptorEvent, SignalEvent, TIMEOUT_CURRENT, TIMEOUT_NEVER, quit
 from concurrence.io import IOStream
 
 DEFAULT_BACKLOG = 512
-XMOD = 8
+ACCEPT_BATCH = 64 #max nr of connections accepted per readiness of a listening socket
+FAIRNESS_INTERVAL = 8 #max nr of consecutive reads/writes on a socket without waiting (e.g. giving other tasks a turn)
+PROBE_INTERVAL = 8 #a socket that predicts 'not ready' still tries the syscall first every this many reads
+
+SO_REUSEPORT = getattr(_socket, 'SO_REUSEPORT', None)
+
+#ways a prefork SocketServer can distribute the incoming connections over its workers
+DISTRIBUTE_REUSEPORT = 'reuseport' #every worker listens itself, the kernel balances connections (needs SO_REUSEPORT)
+DISTRIBUTE_SENDFD = 'sendfd' #the parent process accepts and passes the connections to the workers
+
+WORKER_RESTART_DELAY = 1.0 #a worker that exits within this many seconds after starting is restarted after this delay
+WORKER_STOP_TIMEOUT = 5.0 #on close, a worker that did not exit this many seconds after SIGTERM is sent a SIGKILL
+WORKER_REAP_INTERVAL = 0.05 #how often close checks whether the workers exited
 
 _interceptor = None
 
 class Socket(IOStream):
     log = logging.getLogger('Socket')
 
-    __slots__ = ['socket', 'fd', '_readable', '_writable', 'state']
+    __slots__ = ['socket', 'fd', '_readable', '_writable', 'state',
+                 '_read_score', '_write_ready', '_streak', '_probe',
+                 'reads', 'writes', 'wasted_reads', 'wasted_writes', 'waits']
 
     STATE_INIT = 0
     STATE_LISTENING = 1
@@ -32,8 +49,6 @@ class Socket(IOStream):
     STATE_CLOSING = 4
     STATE_CLOSED = 5
 
-    _x = 0
-
     def __init__(self, socket, state = STATE_INIT):
         """don't call directly pls use one of the provided classmethod to create a socket"""
         self.socket = socket
@@ -54,6 +69,17 @@ class Socket(IOStream):
         self._readable = None #will be created lazily
         self._writable = None #will be created lazily
         self.state = state
+        #readiness prediction, see read and write
+        self._read_score = 3 #0..3, try the read syscall before waiting when >= 2
+        self._write_ready = True #False after a partial write, e.g. the send buffer is full
+        self._streak = 0 #nr of consecutive reads/writes without waiting
+        self._probe = 0
+        #counters, see statistics
+        self.reads = 0
+        self.writes = 0
+        self.wasted_reads = 0
+        self.wasted_writes = 0
+        self.waits = 0
 
     @classmethod
     def set_interceptor(cls, interceptor):
@@ -121,6 +147,10 @@ class Socket(IOStream):
     def set_reuse_address(self, reuse_address):
         self.socket.setsockopt(_socket.SOL_SOCKET, _socket.SO_REUSEADDR, int(reuse_address))
 
+    def set_reuse_port(self, reuse_port):
+        assert SO_REUSEPORT is not None, "SO_REUSEPORT is not available on this platform"
+        self.socket.setsockopt(_socket.SOL_SOCKET, SO_REUSEPORT, int(reuse_port))
+
     def set_send_buffer_size(self, n):
         self.socket.setsockopt(_socket.SOL_SOCKET, _socket.SO_SNDBUF, n)
 
@@ -155,13 +185,38 @@ class Socket(IOStream):
 
             return self.__class__(s, self.STATE_CONNECTED)
 
-    def accept_iter(self):
+    def accept_many(self, n = ACCEPT_BATCH):
+        """waits on a listening socket for incoming connections, and accepts at most *n* of them
+        without waiting again (e.g. until the backlog is drained). returns a list of new socket_class instances"""
+        assert self.state == self.STATE_LISTENING, "make sure socket is listening before calling accept"
+        accepted = []
+        while True:
+            self.readable.wait()
+            while len(accepted) < n:
+                try:
+                    s, _ = self.socket.accept()
+                except _socket.error, (errno, _):
+                    if errno in [EAGAIN, EWOULDBLOCK]:
+                        break #backlog is drained (or another process accepted, see accept)
+                    elif accepted:
+                        break #return what we have, the error will be raised by the next call
+                    else:
+                        raise
+                accepted.append(self.__class__(s, self.STATE_CONNECTED))
+            if accepted:
+                return accepted
+
+    def accept_iter(self, n = ACCEPT_BATCH):
+        """yields the incoming connections of a listening socket, accepting at most *n* per readiness (see :func:`accept_many`)"""
         while True:
             try:
-                yield self.accept()
+                accepted = self.accept_many(n)
             except Exception:
                 self.log.exception("in accept_iter")
                 Tasklet.sleep(1.0) #prevent hogging
+                continue
+            for accepted_socket in accepted:
+                yield accepted_socket
 
     def _connect(self, addr, timeout = TIMEOUT_CURRENT):
         assert self.state == self.STATE_INIT, "make sure socket is not already connected or closed"
@@ -194,76 +249,184 @@ class Socket(IOStream):
         This method returns the total number of bytes written. This method could possible write 0 bytes"""
         assert self.state == self.STATE_CONNECTED, "socket must be connected in order to write to it"
 
-        Socket._x += 1
-        if Socket._x % XMOD == 0:
-            assume_writable = False
-
-        #by default assume that we can write to the socket without blocking
-        if assume_writable:
-            bytes_written, _ = buffer.send(self.fd) #write to fd from buffer
+        #try to write without waiting, unless the last write was partial (the send buffer of the socket was full),
+        #or we wrote too many times in a row without giving other tasks a turn
+        if assume_writable and self._write_ready and self._streak < FAIRNESS_INTERVAL:
+            self._streak += 1
+            self.writes += 1
+            bytes_written, remaining = buffer.send(self.fd) #write to fd from buffer
             if bytes_written < 0 and _io.get_errno() == EAGAIN:
                 #nope, need to wait before sending our data
+                self.wasted_writes += 1
                 assume_writable = False
             #else if error != EAGAIN, assume_writable will stay True, and we fall trough and raise error below
+        else:
+            assume_writable = False
 
         #if we cannot assume write-ability we will wait until data can be written again
         if not assume_writable:
+            self._streak = 0
+            self.waits += 1
             self.writable.wait(timeout = timeout)
-            bytes_written, _ = buffer.send(self.fd) #write to fd from buffer
+            self.writes += 1
+            bytes_written, remaining = buffer.send(self.fd) #write to fd from buffer
 
-        #print 'bw', bytes_written, buffer.capacity
-        #
+        self._write_ready = remaining == 0
         if bytes_written < 0:
             raise _io.error_from_errno(IOError)
         else:
             return bytes_written
 
+    def write_nowait(self, buffer):
+        """Writes as many bytes as possible from the given buffer to this socket without waiting.
+        The buffer position is updated according to the number of bytes written. Returns the number of bytes written,
+        which is 0 when the socket is not writable"""
+        assert self.state == self.STATE_CONNECTED, "socket must be connected in order to write to it"
+        self.writes += 1
+        bytes_written, remaining = buffer.send(self.fd)
+        if bytes_written < 0:
+            if _io.get_errno() == EAGAIN:
+                self.wasted_writes += 1
+                self._write_ready = False
+                return 0
+            raise _io.error_from_errno(IOError)
+        self._write_ready = remaining == 0
+        return bytes_written
+
     def read(self, buffer, timeout = TIMEOUT_CURRENT, assume_readable = True):
         """Reads as many bytes as possible the socket into the given buffer.
         The buffer position is updated according to the number of bytes read from the socket.
         This method could possible read 0 bytes. The method returns the total number of bytes read"""
         assert self.state == self.STATE_CONNECTED, "socket must be connected in order to read from it"
 
-        Socket._x += 1
-        if Socket._x % XMOD == 0:
+        #the read score predicts whether data is available. It goes down on every read that fails with EAGAIN
+        #(e.g. an idle keep-alive connection) and up on every read that succeeds without waiting, and a read that
+        #fills the buffer predicts that more data is waiting. While it predicts 'not ready' we wait first
+        #(saving the failed syscall), except for every PROBE_INTERVAL'th read to find out whether it is still right
+        if self._streak >= FAIRNESS_INTERVAL:
             assume_readable = False
+        elif assume_readable and self._read_score < 2:
+            self._probe += 1
+            assume_readable = self._probe % PROBE_INTERVAL == 0
 
-        #by default assume that we can read from the socket without blocking
         if assume_readable:
-            bytes_read, _ = buffer.recv(self.fd) #read from fd to
+            self._streak += 1
+            self.reads += 1
+            bytes_read, remaining = buffer.recv(self.fd) #read from fd to
             if bytes_read < 0 and _io.get_errno() == EAGAIN:
                 #nope, need to wait before reading our data
+                self.wasted_reads += 1
+                self._read_score = max(0, self._read_score - 2)
                 assume_readable = False
             #else if error != EAGAIN, assume_readable will stay True, and we fall trough and raise error below
+            elif self._read_score < 3:
+                self._read_score += 1
 
         #if we cannot assume readability we will wait until data can be read again
         if not assume_readable:
+            self._streak = 0
+            self.waits += 1
             self.readable.wait(timeout = timeout)
-            bytes_read, _ = buffer.recv(self.fd) #read from fd to
+            self.reads += 1
+            bytes_read, remaining = buffer.recv(self.fd) #read from fd to
 
-        #print 'br', bytes_read, buffer.capacity
-        #
+        if remaining == 0:
+            self._read_score = 3
         if bytes_read < 0:
             raise _io.error_from_errno(IOError)
         else:
             return bytes_read
 
+    def statistics(self):
+        """Returns the counters of this socket as a dict: the nr of read and write syscalls (*reads*, *writes*), the nr
+        of those that were wasted because they failed with EAGAIN (*wasted_reads*, *wasted_writes*) and the nr of times
+        a read or write waited for the socket to become ready (*waits*)"""
+        return {'reads': self.reads,
+                'writes': self.writes,
+                'wasted_reads': self.wasted_reads,
+                'wasted_writes': self.wasted_writes,
+                'waits': self.waits}
+
+    def writev(self, items, timeout = TIMEOUT_CURRENT):
+        """Writes all the python strings and buffers (the bytes between their position and limit) in the list *items* to
+        this socket, using as few writev system calls as possible, e.g. without copying the strings into a buffer first.
+        The position of the buffers is set to their limit. Returns the total number of bytes written."""
+        assert self.state == self.STATE_CONNECTED, "socket must be connected in order to write to it"
+        total = 0
+        for item in items:
+            if type(item) is str:
+                total += len(item)
+            else:
+                total += item.remaining
+        written = 0
+        while written < total:
+            bytes_written = _io.writev(self.fd, items, written)
+            if bytes_written < 0:
+                if _io.get_errno() == EAGAIN:
+                    self.writable.wait(timeout = timeout)
+                else:
+                    raise _io.error_from_errno(IOError)
+            elif bytes_written == 0:
+                raise EOFError("while writing")
+            else:
+                written += bytes_written
+        for item in items:
+            if type(item) is not str:
+                item.position = item.limit
+        return total
+
+    def sendfile(self, fd, offset = 0, count = -1, timeout = TIMEOUT_CURRENT):
+        """Sends *count* bytes (or everything up to the end of the file if *count* is -1) of the file *fd* (a file descriptor
+        or an object with a fileno method), starting at *offset*, to this socket. The bytes are not copied trough user space
+        where the os supports it. Returns the number of bytes sent, which is less than *count* only when the end of the file
+        was reached. Note that the file position of *fd* is not used nor updated."""
+        assert self.state == self.STATE_CONNECTED, "socket must be connected in order to write to it"
+        if not isinstance(fd, (int, long)):
+            fd = fd.fileno()
+        if count == -1:
+            count = os.fstat(fd).st_size - offset
+        sent = 0
+        while sent < count:
+            bytes_sent = _io.sendfile(self.fd, fd, offset + sent, count - sent)
+            if bytes_sent < 0:
+                if _io.get_errno() == EAGAIN:
+                    self.writable.wait(timeout = timeout)
+                else:
+                    raise _io.error_from_errno(IOError)
+            elif bytes_sent == 0:
+                break #end of file
+            else:
+                sent += bytes_sent
+        return sent
+
     def write_socket(self, socket, timeout = TIMEOUT_CURRENT):
         """writes a socket trough this socket"""
         self.writable.wait(timeout = timeout)
-        _io.msgsendfd(self.fd, socket.fd)
+        if _io.msgsendfd(self.fd, socket.fd) < 0:
+            raise _io.error_from_errno(IOError)
 
     def read_socket(self, socket_class = None, socket_family =  _socket.AF_INET, socket_type = _socket.SOCK_STREAM, socket_state = STATE_INIT, timeout = TIMEOUT_CURRENT):
-        """reads a socket from this socket"""
-        self.readable.wait(timeout = timeout)
-        fd = _io.msgrecvfd(self.fd)
-        return (socket_class or self.__class__).from_file_descriptor(fd, socket_family, socket_type, socket_state)
+        """reads a socket from this socket, raises EOFError when the other end was closed"""
+        while True:
+            self.readable.wait(timeout = timeout)
+            fd = _io.msgrecvfd(self.fd)
+            if fd >= 0:
+                break
+            errno = _io.get_errno()
+            if errno == 0:
+                raise EOFError("while reading socket")
+            elif errno != EAGAIN:
+                raise _io.error_from_errno(IOError)
+        try:
+            return (socket_class or self.__class__).from_file_descriptor(fd, socket_family, socket_type, socket_state)
+        finally:
+            os.close(fd) #from_file_descriptor made a dup
 
     def is_closed(self):
         return self.state == self.STATE_CLOSED
 
     def close(self):
-        assert self.state in [self.STATE_CONNECTED, self.STATE_LISTENING]
+        assert self.state in [self.STATE_INIT, self.STATE_CONNECTED, self.STATE_LISTENING]
         self.state = self.STATE_CLOSING
         if self._readable is not None:
             self._readable.close()
@@ -275,10 +438,175 @@ class Socket(IOStream):
         del self._writable
         self.state = self.STATE_CLOSED
 
+class DatagramSocket(object):
+    """A datagram (UDP or unix domain) socket. Datagrams are received into and sent from :class:`~concurrence.io.Buffer` objects.
+    Addresses are tuples (host, port), or paths for unix domain sockets. Received addresses always have a numeric host,
+    host names of destination addresses are looked up with :mod:`concurrence.dns`."""
+    log = logging.getLogger('DatagramSocket')
+
+    __slots__ = ['socket', 'fd', 'family', '_readable', '_writable']
+
+    def __init__(self, socket):
+        """don't call directly pls use one of the provided classmethod to create a socket"""
+        self.socket = socket
+        self.socket.setblocking(0)
+        self.fd = self.socket.fileno()
+        self.family = self.socket.family
+        self._readable = None #will be created lazily
+        self._writable = None #will be created lazily
+
+    @classmethod
+    def new(cls, family = _socket.AF_INET):
+        """creates a new unbound datagram socket of the given address *family*"""
+        return cls(_socket.socket(family, _socket.SOCK_DGRAM))
+
+    @classmethod
+    def server(cls, addr, reuse_address = True):
+        """creates a new datagram socket bound to the given address. If the addr is a string,
+        a UNIX Domain socket is assumed"""
+        if type(addr) == types.StringType:
+            s = cls.new(_socket.AF_UNIX)
+        elif ':' in addr[0]:
+            s = cls.new(_socket.AF_INET6)
+        else:
+            s = cls.new(_socket.AF_INET)
+        if reuse_address:
+            s.socket.setsockopt(_socket.SOL_SOCKET, _socket.SO_REUSEADDR, 1)
+        s.bind(addr)
+        return s
+
+    def bind(self, addr):
+        self.socket.bind(addr)
+
+    def _get_readable(self):
+        if self._readable is None:
+            self._readable = FileDescriptorEvent(self.fd, 'r')
+        return self._readable
+
+    readable = property(_get_readable)
+
+    def _get_writable(self):
+        if self._writable is None:
+            self._writable = FileDescriptorEvent(self.fd, 'w')
+        return self._writable
+
+    writable = property(_get_writable)
+
+    def _resolve(self, address):
+        #called once when an address was rejected as not numeric. returns the address with its host looked up, or raises
+        #ValueError when it can never be valid for this socket
+        from concurrence import dns
+        if self.family == _socket.AF_UNIX:
+            if type(address) is unicode:
+                return address.encode('utf-8')
+            return address
+        host = address[0]
+        if type(host) is unicode:
+            host = host.encode('idna')
+        family = dns._family(host)
+        if family is not None and family != self.family:
+            raise ValueError("address %r is not of the address family of the socket" % (address,))
+        return dns.resolve_endpoint((host,) + tuple(address[1:]), self.family)
+
+    def recvfrom(self, buffer, timeout = TIMEOUT_CURRENT):
+        """Receives a datagram into *buffer* (between its position and limit, the rest of a larger datagram is discarded),
+        waiting until one is available. Returns a tuple (bytes_read, address). The buffer position is updated."""
+        while True:
+            bytes_read, address = _io.recvfrom(self.fd, buffer)
+            if bytes_read >= 0:
+                return bytes_read, address
+            elif _io.get_errno() != EAGAIN:
+                raise _io.error_from_errno(IOError)
+            self.readable.wait(timeout = timeout)
+
+    def sendto(self, buffer, address, timeout = TIMEOUT_CURRENT):
+        """Sends the bytes of *buffer* between its position and limit as a datagram to *address*.
+        Returns the number of bytes sent. The buffer position is updated. Raises ValueError when *address* is not valid
+        for this socket."""
+        resolved = False
+        while True:
+            try:
+                bytes_written = _io.sendto(self.fd, self.family, buffer, address)
+            except ValueError:
+                if resolved:
+                    raise
+                address = self._resolve(address) #not numeric
+                resolved = True
+                continue
+            if bytes_written >= 0:
+                return bytes_written
+            elif _io.get_errno() != EAGAIN:
+                raise _io.error_from_errno(IOError)
+            self.writable.wait(timeout = timeout)
+
+    def recv_many(self, buffers, timeout = TIMEOUT_CURRENT):
+        """Receives the datagrams that are available, at most one in each buffer of the list *buffers* (as for :func:`recvfrom`),
+        waiting until at least one is available. Batches of at most :data:`~concurrence.io._io.DATAGRAM_BATCH` datagrams
+        are received with a single system call where the platform supports it (recvmmsg on linux). Returns a list of
+        (bytes_read, address) tuples for the first buffers, that received a datagram."""
+        while True:
+            received = _io.recvmmsg(self.fd, buffers)
+            if received is not None:
+                return received
+            elif _io.get_errno() != EAGAIN:
+                raise _io.error_from_errno(IOError)
+            self.readable.wait(timeout = timeout)
+
+    def send_many(self, items, timeout = TIMEOUT_CURRENT):
+        """Sends all the datagrams of the list *items*, (data, address) tuples where data is a python string or a buffer
+        (the bytes between its position and limit, its position is not updated). Batches of at most
+        :data:`~concurrence.io._io.DATAGRAM_BATCH` datagrams are sent with a single system call where the platform supports
+        it (sendmmsg on linux). Returns the number of datagrams sent. Raises ValueError when an address is not valid for
+        this socket."""
+        i, n = 0, len(items)
+        resolved = False
+        while i < n:
+            try:
+                sent = _io.sendmmsg(self.fd, self.family, items, i)
+            except ValueError:
+                if resolved:
+                    raise
+                items = items[:i] + [(data, self._resolve(address)) for data, address in items[i:]] #not numeric
+                resolved = True
+                continue
+            if sent >= 0:
+                i += sent
+            elif _io.get_errno() != EAGAIN:
+                raise _io.error_from_errno(IOError)
+            else:
+                self.writable.wait(timeout = timeout)
+        return n
+
+    def close(self):
+        if self._readable is not None:
+            self._readable.close()
+        if self._writable is not None:
+            self._writable.close()
+        self.socket.close()
+        self._readable = None
+        self._writable = None
+
 class SocketServer(object):
-    log = logging.getLogger('SocketServer')
+    """Accepts connections on *endpoint* and runs *handler* in a new task for each of them.
 
-    def __init__(self, endpoint, handler = None):
+    At most *accept_batch* connections are accepted per readiness of the listening socket. When *max_connections*
+    is set, at most that many connections are handled at the same time. Above the limit the server stops accepting
+    (the connections wait in the listen backlog) until a connection is closed, or, if *reject_when_full* is set, it
+    accepts and closes the new connections right away. The limits apply per process when serving with workers
+    (see :func:`serve`). These are attributes that can be changed while serving. See :func:`statistics` for the counters."""
+    log = logging.getLogger('SocketServer')
+    worker_stop_timeout = WORKER_STOP_TIMEOUT
+
+    def __init__(self, endpoint, handler = None, max_connections = None, reject_when_full = False, accept_batch = ACCEPT_BATCH):
+        self.max_connections = max_connections
+        self.reject_when_full = reject_when_full
+        self.accept_batch = accept_batch
+        self._connections = 0 #nr of connections being handled
+        self._pending = 0 #nr of accepted connections whose handler did not start yet
+        self._accepted = 0
+        self._rejected = 0
+        self._paused = 0 #nr of times accepting was paused because of max_connections
+        self._resume = Channel() #to wake up the accept task when a connection is closed while paused
         self._addr = None
         self._socket = None
         if isinstance(endpoint, Socket):
@@ -290,24 +618,67 @@ class SocketServer(object):
         self._handler_task_name = 'socket_handler'
         self._accept_task = None
         self._accept_task_name = 'socket_acceptor'
+        #prefork state
+        self._distribute = None
+        self._workers = {} #pid -> (worker_id, start time, socket to pass connections to the worker (sendfd only))
+        self._worker_id = None
+        self._next_worker = 0
+        self._child_event = None
+        self._parent_pipe = None
+        self._stopping = False
 
     @property
     def socket(self):
         return self._socket
 
+    @property
+    def worker_id(self):
+        """the number (0..workers-1) of this worker process, or None in the parent or when not serving with workers"""
+        return self._worker_id
+
+    @property
+    def workers(self):
+        """the pids of the currently running worker processes (only in the parent process)"""
+        return self._workers.keys()
+
     def _handle_accept(self, accepted_socket):
+        self._pending -= 1
         result = None
         try:
             result = self._handler(accepted_socket)
         except Exception:
             self.log.exception("unhandled exception in socket handler")
         finally:
+            self._connections -= 1
+            if self._resume.has_receiver():
+                self._resume.send(True)
             if result is None and not accepted_socket.is_closed():
                 try:
                     accepted_socket.close()
                 except Exception:
                     self.log.exception("unhandled exception while forcefully closing client")
 
+    def _start_handler(self, accepted_socket):
+        if self.max_connections is not None and self._connections >= self.max_connections:
+            #only when reject_when_full, otherwise we did not accept it
+            self._rejected += 1
+            accepted_socket.close()
+            return
+        self._accepted += 1
+        self._connections += 1
+        self._pending += 1
+        Tasklet.new(self._handle_accept, self._handler_task_name)(accepted_socket)
+
+    def _admit(self):
+        #returns the nr of connections that may be accepted now, waits while the server is full
+        if self.max_connections is None or self.reject_when_full:
+            return self.accept_batch
+        if self._connections >= self.max_connections:
+            self._paused += 1
+            while self._connections >= self.max_connections:
+                self._resume.receive()
+        return min(self.accept_batch, self.max_connections - self._connections)
+
     def _create_socket(self):
         if self._socket is None:
             if self._addr is None:
@@ -317,8 +688,18 @@ class SocketServer(object):
         return self._socket
 
     def _accept_task_loop(self):
-        accepted_socket = self._socket.accept()
-        Tasklet.new(self._handle_accept, self._handler_task_name)(accepted_socket)
+        for accepted_socket in self._socket.accept_many(self._admit()):
+            self._start_handler(accepted_socket)
+
+    def statistics(self):
+        """Returns the nr of connections being handled, the nr of accepted connections whose handler did not start yet
+        (pending), the total nr of accepted and rejected connections and the nr of times accepting was paused, as a dict"""
+        return {'connections': self._connections,
+                'max_connections': self.max_connections,
+                'pending': self._pending,
+                'accepted': self._accepted,
+                'rejected': self._rejected,
+                'paused': self._paused}
 
     def bind(self):
         """creates socket if needed, and binds it"""
@@ -330,21 +711,196 @@ class SocketServer(object):
         socket = self._create_socket()
         socket.listen(backlog)
 
-    def serve(self):
-        """listens and starts a new tasks accepting incoming connections on the configured address"""
+    def serve(self, workers = 0, distribute = None):
+        """listens and starts a new tasks accepting incoming connections on the configured address.
+
+        If *workers* > 0, the address is bound once and that many worker processes are forked to serve the
+        incoming connections, so that the server can use more than 1 cpu core. Workers that exit are restarted.
+        *distribute* determines how connections are distributed over the workers, it is either DISTRIBUTE_REUSEPORT
+        (the default when SO_REUSEPORT is available) or DISTRIBUTE_SENDFD. In a worker this method never returns; the
+        worker keeps serving until its parent process exits. Code following serve only runs in the parent process.
+        Note that a worker starts as a copy of its parent, including the other tasks of the parent. Serve with workers
+        at startup and let the parent do nothing but supervise the workers."""
+        if workers > 0:
+            if distribute is None:
+                if SO_REUSEPORT is not None and self._addr is not None and type(self._addr) == types.TupleType:
+                    distribute = DISTRIBUTE_REUSEPORT
+                else:
+                    distribute = DISTRIBUTE_SENDFD
+            assert distribute in [DISTRIBUTE_REUSEPORT, DISTRIBUTE_SENDFD], "unknown distribute: %s" % distribute
+            self._distribute = distribute
+
         if self._socket is None:
-            self.bind()
-            self.listen()
+            if self._distribute == DISTRIBUTE_REUSEPORT:
+                #we only bind to reserve the address (and to find the port when given as 0), the workers listen on their own socket
+                self._create_socket().set_reuse_port(True)
+                self.bind()
+                self._addr = self._socket.socket.getsockname()
+            else:
+                self.bind()
+                self.listen()
 
         if not callable(self._handler):
             assert False, "handler not set or not callable"
 
-        self._accept_task = Tasklet.loop(self._accept_task_loop, name = self._accept_task_name, daemon = True)()
-
-    def close(self):
-        self._accept_task.kill()
+        if workers > 0:
+            self._parent_pipe = os.pipe()
+            self._child_event = SignalEvent(SIGCHLD, self._on_child_exit)
+            for worker_id in range(workers):
+                self._start_worker(worker_id)
+            if self._distribute == DISTRIBUTE_SENDFD:
+                self._accept_task = Tasklet.loop(self._pass_task_loop, name = self._accept_task_name, daemon = True)()
+        else:
+            self._accept_task = Tasklet.loop(self._accept_task_loop, name = self._accept_task_name, daemon = True)()
+
+    def _start_worker(self, worker_id):
+        if self._worker_id is not None or self._stopping:
+            #we are a worker ourselves (this restart was scheduled before we were forked), or are closing down
+            return
+        parent_end, worker_end = None, None
+        if self._distribute == DISTRIBUTE_SENDFD:
+            parent_end, worker_end = _socket.socketpair(_socket.AF_UNIX, _socket.SOCK_STREAM)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self._run_worker(worker_id, worker_end)
+            except:
+                #a worker must never return into the code of its parent
+                self.log.exception("unhandled exception in worker %d", worker_id)
+                os._exit(1)
+        else:
+            self.log.info("started worker %d with pid %d", worker_id, pid)
+            if parent_end is not None:
+                worker_end.close()
+                parent_end = Socket(parent_end, Socket.STATE_CONNECTED)
+            self._workers[pid] = (worker_id, time.time(), parent_end)
+
+    def _run_worker(self, worker_id, worker_end):
+        self._worker_id = worker_id
+        #get rid of the things that only the parent uses
+        self._child_event.close()
+        self._child_event = None
+        for _, _, parent_end in self._workers.values():
+            if parent_end is not None:
+                parent_end.close()
+        self._workers = {}
+        os.close(self._parent_pipe[1])
+        if self._accept_task is not None:
+            self._accept_task.kill()
         self._socket.close()
 
+        if self._distribute == DISTRIBUTE_REUSEPORT:
+            self._socket = None
+            self._create_socket().set_reuse_port(True)
+            self.bind()
+            self.listen()
+            self._accept_task = Tasklet.loop(self._accept_task_loop, name = self._accept_task_name, daemon = True)()
+        else:
+            self._socket = Socket(worker_end, Socket.STATE_CONNECTED)
+            self._accept_task = Tasklet.new(self._receive_task, name = self._accept_task_name, daemon = True)()
+
+        #block the task that forked us until our parent goes away
+        FileDescriptorEvent(self._parent_pipe[0], 'r').wait(timeout = TIMEOUT_NEVER)
+        self.log.info("parent exited, stopping worker %d", worker_id)
+        quit()
+        Tasklet.sleep(TIMEOUT_NEVER) #never return in a worker
 
+    def _receive_task(self):
+        #reads the connections that are passed from the parent
+        while True:
+            self._admit()
+            try:
+                accepted_socket = self._socket.read_socket(socket_state = Socket.STATE_CONNECTED)
+            except EOFError:
+                return
+            self._start_handler(accepted_socket)
+
+    def _pass_task_loop(self):
+        #accepts connections and passes them to the next available worker
+        for accepted_socket in self._socket.accept_many(self.accept_batch):
+            self._accepted += 1
+            self._pass_socket(accepted_socket)
+
+    def _pass_socket(self, accepted_socket):
+        try:
+            workers = self._workers.values()
+            for i in range(len(workers)):
+                self._next_worker += 1
+                worker_id, _, parent_end = workers[self._next_worker % len(workers)]
+                try:
+                    parent_end.write_socket(accepted_socket)
+                    break
+                except IOError:
+                    self.log.warn("could not pass connection to worker %d", worker_id)
+            else:
+                self.log.warn("no worker available, dropping connection")
+        finally:
+            accepted_socket.close()
 
+    def _on_child_exit(self):
+        for pid in self._workers.keys():
+            try:
+                exited, status = os.waitpid(pid, os.WNOHANG)
+            except OSError:
+                exited, status = pid, -1
+            if exited == 0:
+                continue
+            worker_id, started, parent_end = self._workers.pop(pid)
+            if parent_end is not None:
+                parent_end.close()
+            if self._stopping:
+                continue
+            self.log.warn("worker %d with pid %d exited with status %d, restarting", worker_id, pid, status)
+            if time.time() - started < WORKER_RESTART_DELAY:
+                delay = WORKER_RESTART_DELAY
+            else:
+                delay = 0.0
+            Tasklet.later(delay, self._start_worker, name = 'socket_worker_restart')(worker_id)
+
+    def _kill_worker(self, pid, sig):
+        try:
+            os.kill(pid, sig)
+        except OSError:
+            pass
+
+    def _reap_workers(self, pids, timeout):
+        #waits (without blocking the dispatcher) at most timeout seconds for the workers to exit,
+        #returns the pids of the workers that are still running
+        deadline = time.time() + timeout
+        while True:
+            running = []
+            for pid in pids:
+                try:
+                    exited, _ = os.waitpid(pid, os.WNOHANG)
+                except OSError:
+                    exited = pid #not our child (anymore)
+                if exited == 0:
+                    running.append(pid)
+            pids = running
+            if not pids or time.time() >= deadline:
+                return pids
+            Tasklet.sleep(WORKER_REAP_INTERVAL)
 
+    def close(self):
+        self._stopping = True
+        if self._accept_task is not None:
+            self._accept_task.kill()
+        self._socket.close()
+        if self._child_event is not None:
+            self._child_event.close()
+            self._child_event = None
+            for pid, (_, _, parent_end) in self._workers.items():
+                if parent_end is not None:
+                    parent_end.close()
+                self._kill_worker(pid, SIGTERM)
+            pids = self._reap_workers(self._workers.keys(), self.worker_stop_timeout)
+            if pids:
+                self.log.warn("workers with pids %s did not exit after SIGTERM, sending SIGKILL", pids)
+                for pid in pids:
+                    self._kill_worker(pid, SIGKILL)
+                pids = self._reap_workers(pids, self.worker_stop_timeout)
+                if pids:
+                    self.log.error("could not reap workers with pids %s", pids)
+            self._workers = {}
+            os.close(self._parent_pipe[0])
+            os.close(self._parent_pipe[1])
@@ -7,7 +7,7 @@ from __future__ import with_statement
 import logging
 
 from concurrence import Tasklet, TaskletPool, Channel, DeferredQueue, QueueChannel, TIMEOUT_CURRENT, TimeoutError
-from concurrence.io import Socket, BufferedStream
+from concurrence.io import Connector, BufferedStream
 
 from concurrence.memcache import MemcacheError, MemcacheResult
 from concurrence.memcache.codec import MemcacheCodec
@@ -119,9 +119,11 @@ class MemcacheConnection(object):
     _tasklet_pool = TaskletPool(worker_timeout = 2.0, 
                                 worker_timeout_relative = False)
 
-    def __init__(self, address, protocol = "text", codec = "default"):
+    def __init__(self, address, protocol = "text", codec = "default", pool = None):
 
         self._address = address
+        self._pool = pool #optional ConnectionPool to take the socket from
+        self._socket = None
 
         self._stream = None
         self._read_queue = DeferredQueue(self._tasklet_pool.defer)
@@ -131,7 +133,11 @@ class MemcacheConnection(object):
         self._protocol.set_codec(MemcacheCodec.create(codec))
 
     def connect(self):
-        self._stream = BufferedStream(Socket.connect(self._address))
+        if self._pool is None:
+            self._socket = Connector.connect(self._address)
+        else:
+            self._socket = self._pool.get(self._address)
+        self._stream = BufferedStream(self._socket)
 
     def is_connected(self):
         return self._stream is not None
@@ -197,6 +203,10 @@ class MemcacheConnection(object):
         if self.is_connected():
             self._stream.close()
             self._stream = None
+            if self._pool is not None:
+                #commands may still be in flight, so the connection cannot be reused
+                self._pool.put(self._socket, close = True)
+            self._socket = None
 
     def __setitem__(self, key, data):
         self.set(key, data)
@@ -259,13 +269,15 @@ class MemcacheConnection(object):
 class MemcacheConnectionManager(object):
     _instance = None #TODO when we support multiple protocols, we need to have 1 instance per protocol
 
-    def __init__(self):
+    def __init__(self, pool = None):
+        """The connections are made trough the :class:`~concurrence.io.connectionpool.ConnectionPool` *pool* when given."""
         self._connections = {} #address -> connection
+        self._pool = pool
 
     def get_connection(self, address, protocol):
         """gets a connection to memcached servers at given address using given protocol."""
         if not address in self._connections:
-            self._connections[address] = MemcacheConnection(address, protocol)
+            self._connections[address] = MemcacheConnection(address, protocol, pool = self._pool)
         return self._connections[address]
 
     def close_all(self):
@@ -41,7 +41,8 @@ class MemcacheTextProtocol(MemcacheProtocol):
 
     def _write_storage(self, writer, cmd, key, value, expiration, flags):
         encoded_value, flags = self._codec.encode(value, flags)
-        writer.write_bytes("%s %s %d %d %d\r\n%s\r\n" % (cmd, key, flags, expiration, len(encoded_value), encoded_value))
+        #large values are sent without copying them into the write buffer
+        writer.write_many(["%s %s %d %d %d\r\n" % (cmd, key, flags, expiration, len(encoded_value)), encoded_value, "\r\n"])
 
     def write_cas(self, writer, key, value, expiration, flags, cas_unique):
         encoded_value, flags = self._codec.encode(value, flags)
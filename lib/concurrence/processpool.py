@@ -0,0 +1,247 @@
+# Copyright (C) 2009, Hyves (Startphone Ltd.)
+#
+# This module is part of the Concurrence Framework and is released under
+# the New BSD License: http://www.opensource.org/licenses/bsd-license.php
+
+"""Runs CPU bound calls (pickling, compression, template rendering etc.) in a pool of forked worker processes,
+so that they don't block the dispatcher.
+
+The calling tasklet blocks (cooperatively) until the call has completed in one of the workers, while other
+tasklets keep running. Calls and results are pickled and passed over a unix socket pair per worker, the parent
+end of which is a non-blocking :class:`~concurrence.io.socket.Socket`. When all workers are busy, callers wait
+for a worker to become idle (back-pressure)::
+
+    from concurrence.processpool import ProcessPool
+
+    pool = ProcessPool(4)
+    data = pool.run(zlib.compress, data, 9)
+
+The callable and its arguments must be picklable (e.g. *f* is a module level function), and so must the result.
+The workers are forked when the pool is created, so they can call any code that was imported at that time.
+A worker closes all file descriptors it inherited (except stdin, stdout and stderr), so that it does not keep the
+connections or listening sockets of the parent open.
+"""
+
+import os
+import errno
+import signal
+import struct
+import logging
+import _socket
+import cPickle as pickle
+
+from concurrence import Tasklet, Channel, Deque, TIMEOUT_CURRENT
+from concurrence.io import Socket, BufferedStream
+
+try:
+    MAXFD = os.sysconf('SC_OPEN_MAX')
+except (AttributeError, ValueError):
+    MAXFD = 256
+
+def _open_fds():
+    #the fds of this process as listed by the os, or None where it does not list them
+    for path in ['/proc/self/fd', '/dev/fd']:
+        try:
+            return [int(fd) for fd in os.listdir(path)]
+        except (OSError, ValueError):
+            pass
+    return None
+
+def _close_fds(keep):
+    #closes all fds except stdin, stdout, stderr and keep. when possible only the open fds are closed instead of
+    #every possible fd below MAXFD (which can be a million close calls)
+    fds = _open_fds()
+    if fds is None or keep not in fds: #some systems only list 0, 1 and 2 in /dev/fd
+        os.closerange(3, keep)
+        os.closerange(keep + 1, MAXFD)
+        return
+    for fd in fds:
+        if fd > 2 and fd != keep:
+            try:
+                os.close(fd)
+            except OSError:
+                pass #e.g. the fd of the listed directory itself
+
+class ProcessPoolError(Exception):
+    """Raised when a call could not be completed by a worker, e.g. because the worker died."""
+    pass
+
+class _Worker(object):
+    """the parent side of a worker process"""
+    def __init__(self, pid, socket):
+        self.pid = pid
+        self.socket = socket
+        self.stream = BufferedStream(socket)
+        self.channel = None #the channel of the caller of the current call, None when idle
+
+    def write_call(self, data):
+        writer = self.stream.writer
+        writer.write_int(len(data))
+        writer.write_bytes(data)
+        writer.flush()
+
+    def read_result(self):
+        reader = self.stream.reader
+        n, = struct.unpack('<I', reader.read_bytes(4))
+        return pickle.loads(reader.read_bytes(n))
+
+    def kill(self):
+        #the reader of the worker sees eof and cleans up
+        try:
+            os.kill(self.pid, signal.SIGTERM)
+        except OSError:
+            pass #already exited
+
+def _serve_calls(sock):
+    #the loop of a worker process, uses plain blocking io as there is no dispatcher in the worker
+    f = sock.makefile('rb', 0)
+    while True:
+        header = f.read(4)
+        if len(header) < 4:
+            return #parent closed the connection
+        n, = struct.unpack('<I', header)
+        data = f.read(n)
+        try:
+            call, args, kwargs = pickle.loads(data)
+            result = pickle.dumps((True, call(*args, **kwargs)), pickle.HIGHEST_PROTOCOL)
+        except Exception, e:
+            try:
+                result = pickle.dumps((False, e), pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                result = pickle.dumps((False, ProcessPoolError("unpicklable exception in worker: %r" % e)), pickle.HIGHEST_PROTOCOL)
+        sock.sendall(struct.pack('<I', len(result)) + result)
+
+class ProcessPool(object):
+    """A pool of *workers* forked worker processes that run calls for tasklets."""
+    log = logging.getLogger('ProcessPool')
+
+    def __init__(self, workers):
+        self._closed = False
+        self._workers = [] #all workers
+        self._idle = Deque() #the workers that are not running a call
+        self._submitted = 0
+        self._completed = 0
+        self._waiting = 0
+        self._max_waiting = 0
+        for i in range(workers):
+            self._start_worker()
+
+    def _start_worker(self):
+        parent_sock, child_sock = _socket.socketpair(_socket.AF_UNIX, _socket.SOCK_STREAM)
+        pid = os.fork()
+        if pid == 0:
+            #child, all fds of the parent must be closed: the parent ends of the other workers, so that these see eof when
+            #the parent closes them, and the connections of a running server, so that these are really closed when the parent
+            #closes them (a replacement worker is forked from a running server)
+            try:
+                #the signal handlers of the parent dispatcher are not ours
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                _close_fds(child_sock.fileno())
+                _serve_calls(child_sock)
+            except:
+                os._exit(1)
+            os._exit(0)
+        child_sock.close()
+        worker = _Worker(pid, Socket(parent_sock, Socket.STATE_CONNECTED))
+        self._workers.append(worker)
+        self._idle.append(worker)
+        Tasklet.new(self._read_results, name = 'process_pool_reader')(worker)
+
+    def _read_results(self, worker):
+        #reads the results of a worker and passes them to its callers, one task per worker
+        try:
+            while True:
+                result = worker.read_result()
+                channel, worker.channel = worker.channel, None
+                self._completed += 1
+                self._idle.append(worker)
+                if channel is not None and channel.has_receiver():
+                    channel.send(result)
+                #else the caller is gone (e.g. it timed out), so the result is dropped
+        except Exception, e:
+            if not self._closed:
+                self.log.warn("worker %d of process pool exited: %r", worker.pid, e)
+        self._stop_worker(worker)
+        if worker.channel is not None and worker.channel.has_receiver():
+            worker.channel.send((False, ProcessPoolError("worker exited while running call")))
+        if not self._closed:
+            self._start_worker()
+
+    def _stop_worker(self, worker):
+        worker.socket.close()
+        if worker in self._workers:
+            self._workers.remove(worker)
+        if worker in self._idle:
+            self._idle.remove(worker)
+        #the worker exits as soon as it sees that its socket was closed (if it did not exit already)
+        while True:
+            try:
+                pid, _ = os.waitpid(worker.pid, os.WNOHANG)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                break #already reaped
+            if pid != 0:
+                break
+            Tasklet.sleep(0.01)
+
+    def run(self, f, *args, **kwargs):
+        """Calls *f* with the given arguments in one of the worker processes and blocks the current task until the
+        call has completed. When all workers are busy, the current task first waits for a worker to become idle.
+        Returns the result of *f*, or raises the exception that was raised by *f* (without its traceback).
+        The current task's timeout applies (a :class:`~concurrence.core.TimeoutError` is raised), but
+        note that the call itself cannot be interrupted and keeps its worker busy until it completes."""
+        assert not self._closed, "process pool was closed"
+        data = pickle.dumps((f, args, kwargs), pickle.HIGHEST_PROTOCOL)
+        self._submitted += 1
+        if self._idle:
+            worker = self._idle.popleft()
+        else:
+            #all workers are busy, wait for one to become idle
+            self._waiting += 1
+            if self._waiting > self._max_waiting:
+                self._max_waiting = self._waiting
+            try:
+                worker = self._idle.popleft(True, TIMEOUT_CURRENT)
+            finally:
+                self._waiting -= 1
+        channel = Channel()
+        worker.channel = channel
+        try:
+            worker.write_call(data)
+        except:
+            worker.kill() #the call may have been written partially, the reader replaces the worker
+            raise
+        ok, result = channel.receive(TIMEOUT_CURRENT)
+        if ok:
+            return result
+        else:
+            raise result
+
+    def close(self):
+        """Stops the workers and waits for them to exit, calls that are still running fail with a :class:`ProcessPoolError`."""
+        self._closed = True
+        for worker in self._workers:
+            worker.kill()
+        while self._workers:
+            Tasklet.sleep(0.01)
+
+    @property
+    def workers(self):
+        """The nr of worker processes"""
+        return len(self._workers)
+
+    @property
+    def busy(self):
+        """The nr of workers currently running a call"""
+        return len(self._workers) - len(self._idle)
+
+    def statistics(self):
+        """Returns the nr of busy workers and the nr of callers waiting for a worker as a dict"""
+        return {'workers': self.workers,
+                'busy': self.busy,
+                'waiting': self._waiting,
+                'max_waiting': self._max_waiting,
+                'submitted': self._submitted,
+                'completed': self._completed}
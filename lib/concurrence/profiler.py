@@ -0,0 +1,191 @@
+# Copyright (C) 2009, Hyves (Startphone Ltd.)
+#
+# This module is part of the Concurrence Framework and is released under
+# the New BSD License: http://www.opensource.org/licenses/bsd-license.php
+
+"""A sampling profiler that is aware of tasklets.
+
+A profiling timer (SIGPROF) periodically samples the stack of the tasklet that is running. Optionally,
+the stacks of the tasklets that are blocked (waiting for IO, a channel, a timeout etc.) are sampled as well,
+from the dispatcher. Samples are aggregated by tasklet name and stack, and are written as collapsed stacks, one
+line per stack with its count, that can be turned into a flame graph (e.g. with flamegraph.pl)::
+
+    tasklet_name;outer_function (file.py:10);inner_function (file.py:20) 42
+
+Stacks of blocked tasklets have a ``[blocked]`` frame right after the tasklet name.
+
+The overhead is low enough to profile a production process under real load, and the profiler can be switched
+on and off at runtime, either with a signal (see :func:`install_signal`) or trough HTTP (see :class:`WSGIProfiler`)::
+
+    from concurrence import profiler
+
+    profiler.install_signal() #kill -USR2 <pid> to start, and again to stop and write the profile
+
+The whole run of a program can be profiled by passing the -Xprofile command line option.
+Note that only the tasklets in :attr:`~concurrence.core.Tasklet.all` are sampled when they are blocked
+(pooled tasklets are not, unless they are tracked).
+"""
+
+import os
+import signal
+import logging
+
+from concurrence import core
+from concurrence.core import Tasklet, SignalEvent, stackless
+
+SAMPLE_INTERVAL = 0.005 #seconds of cpu time between samples of the running tasklet
+BLOCKED_MARKER = '[blocked]'
+
+def _name(task):
+    return getattr(task, 'name', None) or '<main>'
+
+class SamplingProfiler(object):
+    """samples the stacks of tasklets, see the module documentation"""
+    log = logging.getLogger('SamplingProfiler')
+
+    def __init__(self, interval = SAMPLE_INTERVAL, blocked_interval = None):
+        """Samples the running tasklet every *interval* seconds of cpu time and, when *blocked_interval* is given,
+        the blocked tasklets every *blocked_interval* seconds."""
+        self.interval = interval
+        self.blocked_interval = blocked_interval
+        self.running = False
+        self._labels = {} #code object -> frame label
+        self._blocked_timer = None
+        self.reset()
+
+    def reset(self):
+        self.counts = {} #(tasklet name, frame label, ...) -> nr of samples
+        self.samples = 0
+
+    def _label(self, code):
+        try:
+            return self._labels[code]
+        except KeyError:
+            label = self._labels[code] = '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+            return label
+
+    def _add(self, name, frame, marker = None):
+        stack = []
+        while frame is not None:
+            stack.append(self._label(frame.f_code))
+            frame = frame.f_back
+        if marker is not None:
+            stack.append(marker)
+        stack.append(name)
+        stack.reverse()
+        key = tuple(stack)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.samples += 1
+
+    def _on_sample(self, signo, frame):
+        #the signal handler runs in the tasklet that was interrupted
+        self._add(_name(stackless.getcurrent()), frame)
+
+    def _on_blocked_sample(self):
+        #called from the dispatcher trough the timer wheel
+        self._blocked_timer = core._timers.add(self.blocked_interval, self._on_blocked_sample)
+        current = stackless.getcurrent()
+        for task in list(Tasklet.all):
+            if task is not current:
+                frame = task.frame
+                if frame is not None:
+                    self._add(_name(task), frame, BLOCKED_MARKER)
+
+    def start(self):
+        """starts sampling"""
+        if self.running:
+            return
+        self.running = True
+        signal.signal(signal.SIGPROF, self._on_sample)
+        signal.siginterrupt(signal.SIGPROF, False) #restart system calls that were interrupted by a sample
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        if self.blocked_interval is not None:
+            self._blocked_timer = core._timers.add(self.blocked_interval, self._on_blocked_sample)
+
+    def stop(self):
+        """stops sampling, the samples taken so far are kept"""
+        if not self.running:
+            return
+        self.running = False
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        if self._blocked_timer is not None:
+            self._blocked_timer.cancel()
+            self._blocked_timer = None
+
+    def collapsed(self):
+        """returns the samples as collapsed stacks, one stack per line (most samples first)"""
+        lines = ['%s %d' % (';'.join(stack), count) for stack, count in sorted(self.counts.items(), key = lambda item: -item[1])]
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def write(self, path = None):
+        """writes the collapsed stacks to *path* (by default ``profile.<pid>.collapsed`` in the current directory),
+        and returns the path"""
+        if path is None:
+            path = 'profile.%d.collapsed' % os.getpid()
+        f = open(path, 'w')
+        try:
+            f.write(self.collapsed())
+        finally:
+            f.close()
+        return path
+
+class WSGIProfiler(object):
+    """A WSGI application to control the profiler at runtime, e.g. mount it on ``/profile`` of a
+    :class:`~concurrence.web.Application` or :class:`~concurrence.wsgi.middleware.WSGISimpleRouter`:
+
+    * ``.../start`` enables the profiler (discarding any previous samples)
+    * ``.../stop`` stops the profiler
+    * anything else returns the collapsed stacks sampled so far as text/plain
+    """
+    def __init__(self, interval = SAMPLE_INTERVAL, blocked_interval = None):
+        self.interval = interval
+        self.blocked_interval = blocked_interval
+
+    def __call__(self, environ, start_response):
+        action = environ.get('PATH_INFO', '').rstrip('/').split('/')[-1]
+        if action == 'start':
+            enable(self.interval, self.blocked_interval)
+            text = 'started\n'
+        elif action == 'stop':
+            disable()
+            text = 'stopped\n'
+        elif _profiler is None:
+            text = ''
+        else:
+            text = _profiler.collapsed()
+        start_response('200 OK', [('Content-type', 'text/plain')])
+        return [text]
+
+_profiler = None
+
+def enable(interval = SAMPLE_INTERVAL, blocked_interval = None):
+    """Starts a new :class:`SamplingProfiler` and returns it. See :class:`SamplingProfiler` for a description of
+    the arguments."""
+    global _profiler
+    disable()
+    _profiler = SamplingProfiler(interval, blocked_interval)
+    _profiler.start()
+    return _profiler
+
+def disable():
+    """Stops the profiler. The samples that were taken are still available."""
+    if _profiler is not None:
+        _profiler.stop()
+
+def current():
+    """Returns the current :class:`SamplingProfiler`, or None when profiling was never enabled."""
+    return _profiler
+
+def install_signal(signo = signal.SIGUSR2, path = None, interval = SAMPLE_INTERVAL, blocked_interval = None):
+    """Installs a handler for signal *signo* that starts the profiler when it is not running, or else stops it
+    and writes the collapsed stacks to *path* (see :func:`SamplingProfiler.write`).
+    Returns the :class:`~concurrence.core.SignalEvent`, close it to uninstall the handler."""
+    def toggle():
+        if _profiler is not None and _profiler.running:
+            disable()
+            logging.warn("wrote profile to %s", _profiler.write(path))
+        else:
+            enable(interval, blocked_interval)
+            logging.warn("started profiler")
+    return SignalEvent(signo, toggle)
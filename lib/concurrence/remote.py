@@ -127,8 +127,8 @@ class RemoteServer(object):
         self._task_id_by_task[task] = task_id
         self._task_by_task_id[task_id] = task 
         
-    def serve(self, endpoint):  
-        return Server.serve(endpoint, self.handle)
+    def serve(self, endpoint, workers = 0):
+        return Server.serve(endpoint, self.handle, workers)
 
 class RemoteClient(object):
     """Remoteing client. This represents the connection to the remote server.
@@ -1,7 +1,8 @@
 import smtplib
 from smtplib import *
 from concurrence.io import Socket
-from concurrence.io.buffered import Buffer, BufferedReader, BufferedWriter
+from concurrence.io import bufferpool
+from concurrence.io.buffered import BufferedReader, BufferedWriter
 
 # Use class concurrence.smtp.SMTP exactly like smtplib.SMTP
 
@@ -9,8 +10,8 @@ class SMTP(smtplib.SMTP):
     """ This is a subclass derived from SMTP that connects over a Concurrence socket """
     def _get_socket(self, host, port, timeout):
         new_socket = Socket.connect((host, port))
-        self._reader = BufferedReader(new_socket, Buffer(1024))
-        self._writer = BufferedWriter(new_socket, Buffer(1024))
+        self._reader = BufferedReader(new_socket, bufferpool.default().get(1024))
+        self._writer = BufferedWriter(new_socket, bufferpool.default().get(1024))
         self.file = self._reader.file()
         return new_socket
 
@@ -30,6 +31,8 @@ class SMTP(smtplib.SMTP):
         if self.sock:
             self.sock.close()
             self.sock = None
+            bufferpool.default().put(self._reader.buffer)
+            bufferpool.default().put(self._writer.buffer)
             self._reader = None
             self._writer = None
             self.file = None
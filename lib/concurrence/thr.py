@@ -1,4 +1,7 @@
+from __future__ import with_statement
+
 import concurrence.io
+from concurrence.timer import Timeout
 from thrift.transport.TTransport import TTransportBase, TTransportException
 import socket
 
@@ -14,10 +17,15 @@ import socket
 class Socket(TTransportBase):
     "Thrift Socket implemetation on top of the Concurrence"
 
-    def __init__(self, hosts):
+    def __init__(self, hosts, pool = None):
+        """Connects to the first of *hosts* that accepts the connection, trough the
+        concurrence.io.connectionpool.ConnectionPool *pool* when given."""
         self.hosts = hosts
+        self.pool = pool
         self.handle = None
         self.timeout = -1
+        self._reusable = True #False after an error, when we don't know where we are in the reply
+        self._pending = 0 #nr of calls flushed for which the reply was not read yet
 
     def setTimeout(self, ms):
         if ms is None:
@@ -29,21 +37,34 @@ class Socket(TTransportBase):
         try:
             for host in self.hosts:
                 try:
-                    self.handle = concurrence.io.Socket.connect(host, self.timeout)
+                    if self.pool is None:
+                        self.handle = concurrence.io.Socket.connect(host, self.timeout)
+                    else:
+                        with Timeout.push(self.timeout):
+                            self.handle = self.pool.get(host)
                     self.stream = concurrence.io.BufferedStream(self.handle)
+                    self._reusable = True
+                    self._pending = 0
+                    break
                 except socket.error as e:
                     if host is not self.hosts[-1]:
                         continue
                     else:
                         raise e
-                    break
         except socket.error as e:
             message = "Could not connect to thrift socket"
             raise TTransportException(TTransportException.NOT_OPEN, message)
 
     def close(self):
         if self.handle:
-            self.handle.close()
+            if self.pool is None:
+                self.handle.close()
+            elif self._reusable and not self._pending and self.stream.release_reader() and self.stream.release_writer():
+                self.pool.put(self.handle)
+            else:
+                #a reply is still in flight, a call failed halfway, or there are unread or unflushed bytes
+                self.stream.close()
+                self.pool.put(self.handle, close = True)
             self.handle = None
             self.stream = None
 
@@ -51,13 +72,31 @@ class Socket(TTransportBase):
         return self.handle is not None
 
     def write(self, buff):
-        self.stream.writer.write_bytes(buff)
+        try:
+            self.stream.writer.write_bytes(buff)
+        except:
+            self._reusable = False
+            raise
 
     def flush(self):
-        self.stream.writer.flush()
+        #a flush sends a call, its reply is outstanding until it is read (one-way calls keep the connection from being reused)
+        try:
+            self._pending += 1
+            self.stream.writer.flush()
+        except:
+            self._reusable = False
+            raise
 
     def read(self, sz):
-        buff = self.stream.reader.read_bytes(sz)
+        try:
+            buff = self.stream.reader.read_bytes(sz)
+        except:
+            self._reusable = False
+            raise
         if len(buff) != sz:
+            self._reusable = False
             raise TTransportException("Thrift socket read %d bytes instead of %d" % (len(buff), sz))
+        #calls are not pipelined, so the reply was read completely when nothing more was received after it
+        if self._pending and not self.stream.reader.buffer.remaining:
+            self._pending -= 1
         return buff
@@ -0,0 +1,158 @@
+# Copyright (C) 2009, Hyves (Startphone Ltd.)
+#
+# This module is part of the Concurrence Framework and is released under
+# the New BSD License: http://www.opensource.org/licenses/bsd-license.php
+
+"""Runs blocking calls (file IO, blocking C libraries, name lookups etc.) in a pool of OS threads,
+so that they don't block the dispatcher.
+
+The calling tasklet blocks (cooperatively) until the call has completed in one of the threads, while other
+tasklets keep running. Threads are started on demand, up to a maximum. When a call completes, its thread
+passes the result to the dispatcher with :func:`~concurrence.core.call_soon_threadsafe`::
+
+    from concurrence import Tasklet
+
+    content = Tasklet.run_in_thread(read_file, path)
+
+Note that the threads use the real :mod:`threading` module, so this does not work after
+:func:`~concurrence.core.disable_threading` was called.
+"""
+
+import os
+import sys
+import time
+import threading
+import Queue
+
+from concurrence.core import Channel, TIMEOUT_CURRENT, call_soon_threadsafe
+
+MAX_THREADS = 10 #default maximum nr of threads of a pool
+
+class ThreadPool(object):
+    """A pool of at most *max_threads* OS threads that run blocking calls for tasklets."""
+
+    def __init__(self, max_threads = MAX_THREADS):
+        self.max_threads = max_threads
+        self._init()
+
+    def _init(self):
+        self._pid = os.getpid()
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = 0
+        self._idle = 0
+        self._busy_time = 0.0
+        self._thread_starts = 0.0 #sum of the start times of the threads, to compute their total lifetime
+        self._submitted = 0
+        self._completed = 0
+        self._max_queued = 0
+
+    def _start_thread(self):
+        t = threading.Thread(target = self._run_thread, name = 'ThreadPool-%d' % self._threads)
+        t.setDaemon(True) #don't keep the process alive for pending calls
+        self._threads += 1
+        self._thread_starts += time.time()
+        t.start()
+
+    def _run_thread(self):
+        while True:
+            with self._lock:
+                self._idle += 1
+            item = self._queue.get()
+            with self._lock:
+                self._idle -= 1
+            if item is None:
+                return #pool was closed
+            channel, f, args, kwargs = item
+            start = time.time()
+            try:
+                result = (True, f(*args, **kwargs))
+            except:
+                result = (False, sys.exc_info())
+            with self._lock:
+                self._busy_time += time.time() - start
+            call_soon_threadsafe(self._complete, channel, result)
+
+    def _complete(self, channel, result):
+        #called by the dispatcher
+        self._completed += 1
+        if channel.has_receiver():
+            channel.send(result)
+        #else the caller is gone (e.g. it timed out), so the result is dropped
+
+    def run(self, f, *args, **kwargs):
+        """Calls *f* with the given arguments in one of the threads of the pool and blocks the current task until the
+        call has completed. Returns the result of *f*, or raises the exception that was raised by *f*.
+        The current task's timeout applies (a :class:`~concurrence.core.TimeoutError` is raised), but
+        note that the call itself cannot be interrupted and keeps its thread busy until it completes."""
+        if self._pid != os.getpid():
+            self._init() #we were forked, the threads and dispatcher state of the parent are not ours
+        channel = Channel()
+        self._submitted += 1
+        self._queue.put((channel, f, args, kwargs))
+        queued = self._queue.qsize()
+        if queued > self._max_queued:
+            self._max_queued = queued
+        if queued > self._idle and self._threads < self.max_threads:
+            self._start_thread()
+        ok, result = channel.receive(TIMEOUT_CURRENT)
+        if ok:
+            return result
+        else:
+            raise result[0], result[1], result[2]
+
+    def close(self):
+        """Stops the threads of the pool when they have finished their current call."""
+        for i in range(self._threads):
+            self._queue.put(None)
+        self._threads = 0
+        self._thread_starts = 0.0
+
+    @property
+    def threads(self):
+        """The nr of threads started"""
+        return self._threads
+
+    @property
+    def busy(self):
+        """The nr of threads currently running a call"""
+        return max(0, self._threads - self._idle)
+
+    @property
+    def queued(self):
+        """The nr of calls waiting for a thread"""
+        return self._queue.qsize()
+
+    def statistics(self):
+        """Returns the queue depth, and the utilisation of the threads (the fraction of their lifetime they spent
+        running calls) as a dict"""
+        lifetime = self._threads * time.time() - self._thread_starts
+        if lifetime > 0.0:
+            utilisation = min(1.0, self._busy_time / lifetime)
+        else:
+            utilisation = 0.0
+        return {'threads': self._threads,
+                'max_threads': self.max_threads,
+                'busy': self.busy,
+                'queued': self.queued,
+                'max_queued': self._max_queued,
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'busy_time': self._busy_time,
+                'utilisation': utilisation}
+
+_default = None
+
+def default():
+    """Returns the default :class:`ThreadPool`, as used by :func:`~concurrence.core.Tasklet.run_in_thread`.
+    It is created on first use with :data:`MAX_THREADS` threads."""
+    global _default
+    if _default is None:
+        _default = ThreadPool()
+    return _default
+
+def statistics():
+    """Returns the statistics of the default pool as a dict"""
+    if _default is None:
+        return {}
+    return _default.statistics()
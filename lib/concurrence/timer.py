@@ -3,44 +3,17 @@
 # This module is part of the Concurrence Framework and is released under
 # the New BSD License: http://www.opensource.org/licenses/bsd-license.php
 
-import time
-
-from concurrence import Tasklet, TaskLocal, TIMEOUT_NEVER, TIMEOUT_CURRENT
-
-class _Timeout(object):
-    def __init__(self):
-        self._timeout_stack = [Tasklet.current()._timeout_time]
-
-    def push(self, timeout):
-        current_timeout = self._timeout_stack[-1]
-        assert current_timeout != TIMEOUT_CURRENT
-        if timeout == TIMEOUT_CURRENT:
-            self._timeout_stack.append(current_timeout)
-        elif timeout == TIMEOUT_NEVER and current_timeout == TIMEOUT_NEVER:
-            self._timeout_stack.append(timeout)
-        elif timeout == TIMEOUT_NEVER and current_timeout != TIMEOUT_NEVER:
-            self._timeout_stack.append(current_timeout)
-        else:
-            _timeout_time = time.time() + timeout
-            if current_timeout == TIMEOUT_NEVER:
-                self._timeout_stack.append(_timeout_time)
-            else:
-                self._timeout_stack.append(min(_timeout_time, current_timeout))
-
-        Tasklet.current()._timeout_time = self._timeout_stack[-1]
-
-    def pop(self):
-        assert len(self._timeout_stack) > 1, "unmatched pop, did you forget to push?"
-        self._timeout_stack.pop()
-        Tasklet.current()._timeout_time = self._timeout_stack[-1]
-        return len(self._timeout_stack) > 1
+from concurrence import Tasklet
 
+class _TimeoutContext(object):
+    #returned by Timeout.push so that it can be used in a with statement
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
         Timeout.pop()
 
+_timeout_context = _TimeoutContext()
 
 class Timeout:
     """Task based timeout. The :class:`Timeout` class lets you set a timeout for the current task.
@@ -62,28 +35,16 @@ class Timeout:
 
     """
 
-    _local = TaskLocal()
-
     @classmethod
     def push(cls, timeout):
         """Pushes a new *timeout* in seconds for the current task."""
-        try:
-            t = cls._local.t
-        except AttributeError:
-            t = _Timeout()
-            cls._local.t = t
-        t.push(timeout)
-        return t
+        Tasklet.current().push_timeout(timeout)
+        return _timeout_context
 
     @classmethod
     def pop(cls):
         """Pops the current timeout for the current task."""
-        try:
-            t = cls._local.t
-            if not t.pop():
-                del cls._local.t
-        except AttributeError:
-            assert False, "no timeout was pushed for the current task"
+        Tasklet.current().pop_timeout()
 
     @classmethod
     def current(cls):
@@ -31,48 +31,60 @@ class WSGISimpleMessage(WSGISimpleResponse):
         WSGISimpleResponse.__init__(self, httplib.OK, msg)
 
 class WSGISimpleStatic(WSGISimpleResponse):
+    """serves the files under *root* (a directory or a single file) on the uri-paths starting with *prefix*.
+    files are opened on each request (nothing is preloaded) and passed to the server's wsgi.file_wrapper, so that
+    the concurrence http server can send them with sendfile."""
     log = logging.getLogger('WSGISimpleStatic')
 
+    BLOCK_SIZE = 1024 * 32
+
     def __init__(self, root, prefix):
-        self._map = {}
-        self._load(root)
+        assert os.path.isfile(root) or os.path.isdir(root), "unknown path type (not a file or dir)"
         self._root = root
         self._prefix = prefix
         self._not_found = RESPONSE_NOT_FOUND
 
-    def _load(self, root):
-        if os.path.isfile(root):
-            self._load_file(root, root)
-        elif os.path.isdir(root):
-            for dirpath, dirnames, filenames in os.walk(root):
-                for filename in filenames:
-                    self._load_file(root, os.path.join(dirpath, filename))
-        else:
-            assert False, "unknown path type (not a file or dir)"
+    def _resolve(self, path_info):
+        #returns the path of the file to serve, or None when there is no such file (under root)
+        path = self._root + path_info
+        root = os.path.normpath(self._root)
+        normpath = os.path.normpath(path)
+        if normpath != root and not normpath.startswith(os.path.join(root, '')):
+            return None
+        if not os.path.isfile(path):
+            return None
+        return path
 
-    def _load_file(self, root, path):
-        f = open(path)
-        content = f.read()
-        f.close()
+    def __call__(self, environ, start_response):
+        path = self._resolve(environ['PATH_INFO'][len(self._prefix):])
+        if path is None:
+            return self._not_found(environ, start_response)
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return self._not_found(environ, start_response)
         content_type, _ = mimetypes.guess_type(path, False)
         if content_type is None:
             content_type = 'binary/octet-stream'
             self.log.debug("unknown content type for path %s", path)
-
-        content_length = len(content)
-        path = path[len(root):]
-        self.log.debug("preloading %s => %d, %s", path, content_length, content_type)
-        self._map[path] = (content, content_type, content_length)
-
-    def __call__(self, environ, start_response):
-        path_info = environ['PATH_INFO'][len(self._prefix):]
-        if path_info in self._map:
-            content, content_length, content_type = self._map[path_info]
-            response_line = "%d %s" % (200, httplib.responses[200])
-            start_response(response_line, [('Content-Type', content_type), ('Content-Length', content_length)])
-            return [content]
+        content_length = os.fstat(f.fileno()).st_size
+        response_line = "%d %s" % (200, httplib.responses[200])
+        start_response(response_line, [('Content-Type', content_type), ('Content-Length', str(content_length))])
+        file_wrapper = environ.get('wsgi.file_wrapper', None)
+        if file_wrapper is not None:
+            return file_wrapper(f, self.BLOCK_SIZE)
         else:
-            return self._not_found(environ, start_response)
+            return _iter_file(f, self.BLOCK_SIZE)
+
+def _iter_file(f, block_size):
+    try:
+        while True:
+            data = f.read(block_size)
+            if not data:
+                break
+            yield data
+    finally:
+        f.close()
 
 class WSGISimpleRouter(object):
     """a simple router middleware to dispatch to applications based on uri-path"""
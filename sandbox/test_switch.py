@@ -1,16 +1,68 @@
-import stackless
+#compares the cost of the basic stackless operations (switch, channel send/receive and tasklet spawn)
+#on the available backend. runs on stackless python, or on cpython with the greenlet based
+#emulation in concurrence._stackless, e.g:
+#
+#   PYTHONPATH=lib python sandbox/test_switch.py
+#   PYTHONPATH=lib stackless sandbox/test_switch.py
+import time
 
-def task1():
-    for i in range(100):
-        print '1', i
+try:
+    import stackless
+    backend = 'stackless'
+except ImportError:
+    import concurrence._stackless as stackless
+    backend = 'greenlet'
 
-def task2():
-    for i in range(100):
-        print '2', i
+N = 100000
 
-if __name__ == '__main__'
-    stackless.tasklet(task1)()
-    stackless.tasklet(task1)()
+def run():
     while stackless.getruncount() > 1:
         stackless.schedule()
 
+def bench(label, n, f, repeat = 3):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        f()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print '%s: %s, %d/sec' % (backend, label, n / best)
+
+def switch():
+    def task():
+        for i in range(N / 2):
+            stackless.schedule()
+    stackless.tasklet(task)()
+    stackless.tasklet(task)()
+    run()
+
+def send_receive(preference):
+    def f():
+        c = stackless.channel()
+        c.preference = preference
+        def sender():
+            for i in range(N):
+                c.send(i)
+        def receiver():
+            for i in range(N):
+                c.receive()
+        stackless.tasklet(sender)()
+        stackless.tasklet(receiver)()
+        run()
+    return f
+
+def spawn():
+    def task():
+        pass
+    for i in range(N / 100):
+        for j in range(100):
+            stackless.tasklet(task)()
+        run()
+
+if __name__ == '__main__':
+    bench('schedule switches', N, switch)
+    bench('send/receive, receiver preference', N, send_receive(-1))
+    bench('send/receive, no preference', N, send_receive(0))
+    bench('send/receive, sender preference', N, send_receive(1))
+    bench('tasklet spawn/exit', N, spawn)
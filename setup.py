@@ -22,6 +22,12 @@ if 'CONCURRENCE_LIBEVENT_PREFIX' in os.environ:
     libevent_include_dirs = ['%s/include' % prefix]
     libevent_library_dirs = ['%s/lib' % prefix]
 
+#the native epoll event backend is only available on linux
+import sys
+epoll_ext_modules = []
+if sys.platform.startswith('linux'):
+    epoll_ext_modules.append(Extension("concurrence._epoll", ["lib/concurrence/concurrence._epoll.pyx"]))
+
 VERSION = '0.3.2' #must be same as concurrence.__init__.py.__version__
 
 setup(
@@ -42,7 +48,7 @@ setup(
     Extension("concurrence.http._http", ["lib/concurrence/http/concurrence.http._http.pyx", "lib/concurrence/http/http11_parser.c", "lib/concurrence/http/http11_parser_alloc.c"], include_dirs=['lib/concurrence/io']),
     Extension("concurrence.database.mysql._mysql", ["lib/concurrence/database/mysql/concurrence.database.mysql._mysql.pyx"],
               include_dirs=['lib/concurrence/io']),
-    ],
+    ] + epoll_ext_modules,
   cmdclass = {'build_ext': build_ext},
     classifiers = [
              'Development Status :: 4 - Beta',
@@ -1,5 +1,5 @@
 from concurrence import unittest
-from concurrence.io.buffered import Buffer, BufferUnderflowError, BufferInvalidArgumentError
+from concurrence.io.buffered import Buffer, RingBuffer, BufferUnderflowError, BufferOverflowError, BufferInvalidArgumentError
 
 class TestBuffer(unittest.TestCase):
     def testDuplicate(self):
@@ -109,6 +109,15 @@ class TestBuffer(unittest.TestCase):
         b.write_int(0x4A3B2C1D)
         #write_int is little-endian
         self.assertEquals(['0x1d', '0x2c', '0x3b', '0x4a'], [hex(b[i]) for i in range(4)])
+        b.write_int(0xFFFFFFFF)
+        b.flip()
+        self.assertEquals(0x4A3B2C1D, b.read_int())
+        self.assertEquals(0xFFFFFFFF, b.read_int())
+        try:
+            b.read_int()
+            self.fail()
+        except BufferUnderflowError:
+            pass
 
     def testString1(self):
         S = 'Henk\0Punt'
@@ -279,11 +288,141 @@ class TestBuffer(unittest.TestCase):
         self.assertEquals(2, c[20])
         self.assertEquals(3, c[1023])
 
+    def testReadView(self):
+        import struct
+        b = Buffer(1024)
+        b.write_bytes('hello world!')
+        b.write_int(42)
+        b.flip()
 
+        view = b.read_view(5)
+        self.assertEquals(5, b.position)
+        self.assertEquals('hello', str(view))
+        self.assertEquals('world!', str(b.read_view(7))[1:])
+        #views can be passed to anything that accepts a buffer
+        self.assertEquals((42,), struct.unpack_from('<i', b.read_view()))
+        self.assertEquals(0, b.remaining)
 
+        b.flip()
+        try:
+            b.read_view(b.remaining + 1)
+            self.fail()
+        except BufferUnderflowError:
+            pass
+        self.assertEquals(0, b.position)
+        self.assertEquals(buffer('hello'), buffer(b, 0, 5))
 
+    def testReadInto(self):
+        b = Buffer(1024)
+        b.write_bytes('hello world!')
+        b.flip()
 
+        target = bytearray(5)
+        self.assertEquals(5, b.read_into(target))
+        self.assertEquals('hello', str(target))
+        self.assertEquals(5, b.position)
+        
+        target = bytearray(10)
+        self.assertEquals(7, b.read_into(target, 2))
+        self.assertEquals('\0\0 world!\0', str(target))
+        self.assertEquals(0, b.remaining)
 
+        try:
+            b.read_into(target, 11)
+            self.fail()
+        except BufferInvalidArgumentError:
+            pass
+
+        try:
+            b.read_into('immutable')
+            self.fail()
+        except TypeError:
+            pass
+
+
+
+
+
+
+
+class TestRingBuffer(unittest.TestCase):
+    def testWrap(self):
+        b = RingBuffer(8)
+        self.assertEquals(0, b.remaining)
+        self.assertEquals(8, b.free)
+        b.write_bytes('abcdef')
+        self.assertEquals('abcd', b.read_bytes(4))
+        #wraps around the end of the buffer
+        b.write_bytes('gh\r\nij')
+        self.assertEquals(0, b.free)
+        try:
+            b.write_bytes('x')
+            self.fail()
+        except BufferOverflowError:
+            pass
+        self.assertEquals('efgh', b.read_line())
+        self.assertEquals('ij', b.read_bytes(-1))
+        try:
+            b.read_bytes(1)
+            self.fail()
+        except BufferUnderflowError:
+            pass
+
+        b.write_bytes('0123456')
+        b.skip(5)
+        b.write_bytes('\n89\0\1\2')
+        self.assertEquals('56\n', b.read_line(True))
+        self.assertEquals('89', b.read_bytes_until(0))
+        self.assertEquals(0x0201, b.read_short())
+        self.assertEquals(0, b.remaining)
+
+        #an int wrapping around the end of the buffer
+        b.write_bytes('abcdefg')
+        b.skip(5)
+        b.write_bytes('\1\2\3\4\xff\xff')
+        self.assertEquals('fg', b.read_bytes(2))
+        self.assertEquals(0x04030201, b.read_int())
+        try:
+            b.read_int()
+            self.fail()
+        except BufferUnderflowError:
+            pass
+        b.write_bytes('\xff\xff')
+        self.assertEquals(0xffffffff, b.read_int())
+        self.assertEquals(0, b.remaining)
+
+    def testReadIntoAndView(self):
+        b = RingBuffer(8)
+        b.write_bytes('abcdef')
+        b.skip(5)
+        b.write_bytes('ghijk')
+        target = bytearray(4)
+        self.assertEquals(4, b.read_into(target))
+        self.assertEquals('fghi', str(target))
+        b.write_bytes('lmn')
+        #contiguous bytes are returned as a view, wrapped bytes as a string
+        view = b.read_view(2)
+        self.assertEquals(buffer, type(view))
+        self.assertEquals('jk', str(view))
+        self.assertEquals('lmn', str(b.read_view()))
+
+    def testRecv(self):
+        import os
+        r, w = os.pipe()
+        try:
+            b = RingBuffer(8)
+            os.write(w, 'abcdef')
+            self.assertEquals((6, 2), b.recv(r))
+            self.assertEquals('abcde', b.read_bytes(5))
+            #fills the free space at the end and at the start with one call
+            os.write(w, 'ghijklmnop')
+            self.assertEquals((7, 0), b.recv(r))
+            self.assertEquals('fghijklm', b.read_bytes(-1))
+            self.assertEquals((3, 5), b.recv(r))
+            self.assertEquals('nop', b.read_bytes(3))
+        finally:
+            os.close(r)
+            os.close(w)
 
 if __name__ == '__main__':
     unittest.main(timeout = 10)
@@ -1,6 +1,8 @@
+import itertools
+
 from concurrence import unittest
 from concurrence.io import IOStream
-from concurrence.io.buffered import Buffer, BufferedReader
+from concurrence.io.buffered import Buffer, RingBuffer, BufferedReader, BufferOverflowError
 
 class TestStream(IOStream):
     def __init__(self, s, chunk_size = 4):
@@ -20,6 +22,15 @@ class TestStream(IOStream):
 
         return n
 
+class TestRingStream(TestStream):
+    def read(self, buffer, timeout = -1.0):
+        if not self.s:
+            raise EOFError("while reading")
+        n = min(self.chunk_size, buffer.free, len(self.s))
+        buffer.write_bytes(self.s[:n])
+        self.s = self.s[n:]
+        return n
+
 class TestBuffered(unittest.TestCase):
     def testCompatibleReadLines(self):
         
@@ -81,6 +92,56 @@ class TestBuffered(unittest.TestCase):
                     i, f = test_stream('piet klaas aap' * x)
                     self.assertEquals(i.read(), f.read())
 
+    def testReadLongLines(self):
+        for buffer_size in [2, 3, 8, 1024]:
+            for chunk_size in [1, 3, 16]:
+                reader = BufferedReader(TestStream('a' * 20 + '\r\n\r\n' + 'b' * 7 + '\r\r\n' + 'c' * 100 + '\n', chunk_size = chunk_size), Buffer(buffer_size))
+                self.assertEquals('a' * 20, reader.read_line())
+                self.assertEquals(['', 'b' * 7 + '\r', 'c' * 100], list(itertools.islice(reader.read_lines(), 3)))
+
+                f = BufferedReader(TestStream('x' * 50 + '\r\nend', chunk_size = chunk_size), Buffer(buffer_size)).file()
+                self.assertEquals('x' * 50 + '\r\n', f.readline())
+                self.assertEquals('end', f.readline())
+
+    def testMaxLineLength(self):
+        reader = BufferedReader(TestStream('x' * 100 + '\r\n' + 'y' * 101 + '\n', chunk_size = 7), Buffer(16))
+        reader.max_line_length = 100
+        self.assertEquals('x' * 100, reader.read_line())
+        try:
+            reader.read_line()
+            self.fail("expected BufferOverflowError")
+        except BufferOverflowError:
+            pass
+
+    def testReadInto(self):
+        for chunk_size in [1, 3, 16]:
+            reader = BufferedReader(TestStream('piet klaas aap' * 10, chunk_size = chunk_size), Buffer(8))
+            target = bytearray(20)
+            self.assertEquals(16, reader.read_into(target, 4))
+            self.assertEquals('\0\0\0\0piet klaas aappi', str(target))
+            self.assertEquals('et ', str(reader.read_view(3)))
+            try:
+                reader.read_view(9)
+                self.fail()
+            except BufferOverflowError:
+                pass
+
+            f = reader.file()
+            target = bytearray(100)
+            self.assertEquals(100, f.readinto(target))
+            self.assertEquals(('klaas aap' + 'piet klaas aap' * 8)[:100], str(target))
+            self.assertEquals(21, f.readinto(target))
+            self.assertEquals(0, f.readinto(target))
+
+    def testReadInt(self):
+        data = '\x01\x02\x03\x04\x05\x06' * 10
+        for chunk_size in [1, 3, 16]:
+            for reader in [BufferedReader(TestStream(data, chunk_size = chunk_size), Buffer(8)),
+                           BufferedReader(TestRingStream(data, chunk_size = chunk_size), RingBuffer(8))]:
+                for i in range(10):
+                    self.assertEquals(0x04030201, reader.read_int())
+                    self.assertEquals(0x0605, reader.read_short())
+
     
 if __name__ == '__main__':
     unittest.main(timeout = 10)
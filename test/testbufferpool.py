@@ -0,0 +1,96 @@
+from concurrence import unittest, Tasklet
+from concurrence.io import Buffer, RingBuffer, BufferedStream, bufferpool
+from concurrence.io.bufferpool import BufferPool
+
+class TestBufferPool(unittest.TestCase):
+    def testSizeClasses(self):
+        pool = BufferPool([1024, 8192], max_pooled_bytes = 8192 * 2)
+        b1 = pool.get(1024)
+        self.assertEquals(1024, b1.capacity)
+        b2 = pool.get(1025)
+        self.assertEquals(8192, b2.capacity)
+        self.assertEquals(RingBuffer, type(pool.get(8192, RingBuffer)))
+        #not pooled
+        self.assertEquals(100, pool.get(100).capacity)
+        self.assertEquals(10000, pool.get(10000).capacity)
+
+        b2.write_bytes('dirty')
+        pool.put(b2)
+        b3 = pool.get(4096)
+        self.assertTrue(b2 is b3)
+        self.assertEquals(0, b3.position) #cleared
+
+        stats = pool.statistics()
+        self.assertEquals(2, stats['unpooled'].count)
+        self.assertEquals(2, stats[8192]['allocated'].count)
+        self.assertEquals(2, stats[8192]['in_use'].count)
+        self.assertEquals(0, stats[8192]['pooled'].count)
+        self.assertEquals(2 * 8192, stats[8192]['in_use_bytes'])
+
+        #the idle buffers kept per size class are capped
+        buffers = [pool.get(8192) for i in range(3)]
+        for buffer in buffers + [b3]:
+            pool.put(buffer)
+        stats = pool.statistics()
+        self.assertEquals(2, stats[8192]['pooled'].count)
+        self.assertEquals(2 * 8192, stats[8192]['pooled_bytes'])
+        self.assertEquals(1, stats[8192]['in_use'].count) #the ring buffer
+        pool.trim()
+        self.assertEquals(0, pool.statistics()[8192]['pooled'].count)
+
+    def testForeignAndDoublePut(self):
+        pool = BufferPool([1024])
+        in_use = lambda: pool.statistics()[1024]['in_use'].count
+        pooled = lambda: pool.statistics()[1024]['pooled'].count
+        #a buffer that did not come from the pool is not taken in
+        pool.put(Buffer(1024))
+        self.assertEquals(0, in_use())
+        self.assertEquals(0, pooled())
+        b1 = pool.get(1024)
+        self.assertEquals(1, in_use())
+        pool.put(b1)
+        pool.put(b1)
+        self.assertEquals(0, in_use())
+        self.assertEquals(1, pooled())
+        #so the buffer is handed out only once
+        b2, b3 = pool.get(1024), pool.get(1024)
+        self.assertTrue(b2 is b1)
+        self.assertTrue(b3 is not b1)
+        self.assertEquals(2, in_use())
+
+    def socketpair(self):
+        import _socket
+        from concurrence.io import Socket
+        a, b = _socket.socketpair(_socket.AF_UNIX, _socket.SOCK_STREAM)
+        return Socket(a, Socket.STATE_CONNECTED), Socket(b, Socket.STATE_CONNECTED)
+
+    def testStreamReturnsBuffers(self):
+        in_use = lambda: bufferpool.statistics()[8192]['in_use'].count
+        start = in_use()
+        a, b = self.socketpair()
+        sa, sb = BufferedStream(a), BufferedStream(b)
+        with sa.get_writer() as writer:
+            writer.write_bytes('hello\nworld\n')
+            self.assertEquals(start + 1, in_use())
+            writer.flush()
+        self.assertEquals(start, in_use())
+        with sb.get_reader() as reader:
+            self.assertEquals('hello', reader.read_line())
+        #there is still unread data, so the reader keeps its buffer
+        self.assertEquals(start + 1, in_use())
+        self.assertEquals('world', sb.reader.read_line())
+        #nothing buffered, so the reader does not hold a buffer while waiting
+        def write():
+            Tasklet.sleep(0.1)
+            sa.writer.write_bytes('again\n')
+            sa.writer.flush()
+        Tasklet.new(write)()
+        sb.wait_readable()
+        self.assertEquals(start + 1, in_use()) #the writer of sa
+        self.assertEquals('again', sb.reader.read_line())
+        sa.close()
+        sb.close()
+        self.assertEquals(start, in_use())
+
+if __name__ == '__main__':
+    unittest.main(timeout = 10)
@@ -0,0 +1,135 @@
+from __future__ import with_statement
+
+from concurrence import unittest, Tasklet, Channel, TimeoutError
+from concurrence.timer import Timeout
+from concurrence.io import SocketServer, BufferedStream
+from concurrence.io.connectionpool import ConnectionPool
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        def handler(socket):
+            #echoes lines until the client closes, or closes itself on 'close'
+            stream = BufferedStream(socket)
+            try:
+                while True:
+                    line = stream.reader.read_line()
+                    if line == 'close':
+                        break
+                    stream.writer.write_bytes(line + '\n')
+                    stream.writer.flush()
+            except EOFError:
+                pass
+            stream.close()
+        self.server = SocketServer(('127.0.0.1', 0), handler)
+        self.server.serve()
+        self.endpoint = self.server.socket.socket.getsockname()
+
+    def tearDown(self):
+        self.server.close()
+
+    def echo(self, socket, line):
+        stream = BufferedStream(socket)
+        stream.writer.write_bytes(line + '\n')
+        stream.writer.flush()
+        result = stream.reader.read_line()
+        stream.release_reader()
+        stream.release_writer()
+        return result
+
+    def testReuse(self):
+        pool = ConnectionPool()
+        a = pool.get(self.endpoint)
+        b = pool.get(self.endpoint)
+        self.assertTrue(a is not b)
+        self.assertEquals('a', self.echo(a, 'a'))
+        pool.put(a)
+        pool.put(b)
+        #the most recently used one first
+        self.assertTrue(pool.get(self.endpoint) is b)
+        self.assertTrue(pool.get(self.endpoint) is a)
+        self.assertEquals('a', self.echo(a, 'a'))
+        pool.put(a)
+        pool.put(b, close = True)
+        self.assertTrue(b.is_closed())
+        stats = pool.statistics()
+        self.assertEquals(2, stats['created'].count)
+        self.assertEquals(2, stats['reused'].count)
+        self.assertEquals({'connections': 1, 'idle': 1, 'waiting': 0}, stats['endpoints'][self.endpoint])
+        pool.close()
+        self.assertTrue(a.is_closed())
+        self.assertEquals(0, pool.statistics()['endpoints'][self.endpoint]['connections'])
+
+    def testMaxPerEndpoint(self):
+        pool = ConnectionPool(max_per_endpoint = 1)
+        a = pool.get(self.endpoint)
+        results = Channel()
+        def get():
+            results.send(pool.get(self.endpoint))
+        Tasklet.new(get)()
+        Tasklet.new(get)()
+        Tasklet.sleep(0.1)
+        self.assertEquals(2, pool.statistics()['endpoints'][self.endpoint]['waiting'])
+        #a returned connection is handed to the first waiting task
+        pool.put(a)
+        self.assertTrue(results.receive() is a)
+        #a closed connection lets the next waiting task connect
+        pool.put(a, close = True)
+        b = results.receive()
+        self.assertTrue(b is not a)
+        stats = pool.statistics()
+        self.assertEquals(2, stats['created'].count)
+        self.assertEquals(2, stats['wait'].count)
+        self.assertTrue(stats['wait'].avg > 0.0)
+        #the current timeout applies while waiting
+        try:
+            with Timeout.push(0.1):
+                pool.get(self.endpoint)
+            self.fail('expected timeout')
+        except TimeoutError:
+            pass
+        pool.put(b)
+        self.assertTrue(pool.get(self.endpoint) is b)
+
+    def testHealthCheck(self):
+        pool = ConnectionPool()
+        a = pool.get(self.endpoint)
+        stream = BufferedStream(a)
+        stream.writer.write_bytes('close\n')
+        stream.writer.flush()
+        stream.release_writer()
+        pool.put(a)
+        Tasklet.sleep(0.1)
+        #the server closed the idle connection
+        self.assertTrue(a.is_closed())
+        stats = pool.statistics()
+        self.assertEquals(1, stats['closed_broken'].count)
+        self.assertEquals(0, stats['endpoints'][self.endpoint]['idle'])
+        self.assertTrue(pool.get(self.endpoint) is not a)
+
+    def testIdleTimeout(self):
+        pool = ConnectionPool(idle_timeout = 0.1)
+        a = pool.get(self.endpoint)
+        pool.put(a)
+        Tasklet.sleep(0.05)
+        self.assertFalse(a.is_closed())
+        Tasklet.sleep(0.1)
+        self.assertTrue(a.is_closed())
+        self.assertEquals(1, pool.statistics()['closed_idle'].count)
+        self.assertEquals(0, pool.statistics()['endpoints'][self.endpoint]['connections'])
+
+    def testConnection(self):
+        pool = ConnectionPool()
+        with pool.connection(self.endpoint) as a:
+            self.assertEquals('x', self.echo(a, 'x'))
+        self.assertEquals(1, pool.statistics()['endpoints'][self.endpoint]['idle'])
+        try:
+            with pool.connection(self.endpoint) as b:
+                self.assertTrue(a is b)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertTrue(b.is_closed())
+        self.assertEquals(0, pool.statistics()['endpoints'][self.endpoint]['connections'])
+
+if __name__ == '__main__':
+    unittest.main(timeout = 10)
@@ -3,7 +3,9 @@ import logging
 import time
 import sys
 
-from concurrence import unittest, Tasklet, Channel, TimeoutError, TaskletError, JoinError, Message, TIMEOUT_NEVER
+from concurrence import unittest, Tasklet, Channel, TimeoutError, TaskletError, JoinError, Message, TimeoutEvent, TIMEOUT_NEVER
+from concurrence import core
+from concurrence.core import TimerWheel
 
 class TestTasklet(unittest.TestCase):
     def testSleep(self):
@@ -332,6 +334,54 @@ class TestTasklet(unittest.TestCase):
         current.timeout = TIMEOUT_NEVER
         self.assertEquals(TIMEOUT_NEVER, current.timeout)
 
+    def testSpawnPooled(self):
+        results = []
+        def f(i):
+            results.append((i, Tasklet.current(), Tasklet.get_current_timeout()))
+            Tasklet.set_current_timeout(10.0)
+        t1 = Tasklet.spawn_pooled(f)(1)
+        self.assertTrue(t1 not in Tasklet.all)
+        Tasklet.yield_()
+        #the finished tasklet is reused, and its timeout was reset
+        t2 = Tasklet.spawn_pooled(f, name = 'g')(2)
+        self.assertTrue(t1 is t2)
+        Tasklet.yield_()
+        self.assertEquals([(1, t1, TIMEOUT_NEVER), (2, t1, TIMEOUT_NEVER)], results)
+        self.assertEquals('g', t1.name)
+
+        #an exception is logged and the tasklet is still reused
+        def g():
+            raise Exception("test")
+        t3 = Tasklet.spawn_pooled(g)()
+        Tasklet.yield_()
+        self.assertTrue(t3 is Tasklet.spawn_pooled(f)(3))
+        Tasklet.yield_()
+
+        #a tracked tasklet is a child of the current task while it runs
+        def h():
+            results.append((Tasklet.current() in Tasklet.all, Tasklet.current().parent()))
+        t4 = Tasklet.spawn_pooled(h, track = True)()
+        self.assertTrue(t4 in Tasklet.all)
+        Tasklet.yield_()
+        self.assertEquals((True, Tasklet.current()), results[-1])
+        self.assertTrue(t4 not in Tasklet.all)
+        self.assertTrue(t4 not in Tasklet.current().children())
+
+    def testSpawnBenchmark(self):
+        N, M = 20000, 100 #in batches of M, so that there are not too many tasklets at the same time
+        count = [0]
+        def f():
+            count[0] += 1
+        for label, spawn in [('new', Tasklet.new), ('spawn_pooled', Tasklet.spawn_pooled)]:
+            count[0] = 0
+            with unittest.timer() as tmr:
+                for i in range(N / M):
+                    for j in range(M):
+                        spawn(f)()
+                    Tasklet.yield_()
+            self.assertEquals(N, count[0])
+            print 'Tasklet.%s spawn/exit, tasks/sec' % label, tmr.sec(N)
+
 class TestChannel(unittest.TestCase):
 
     def testSendRecv(self):
@@ -477,5 +527,240 @@ class TestChannel(unittest.TestCase):
 
         self.assertEquals(range(10), x)
 
+    def testTimedReceiveBenchmark(self):
+        """compares timed receives on the timer wheel with the old way of using a libevent TimeoutEvent per receive"""
+        N = 20000
+
+        class _TimeoutEventTimers(object):
+            def add(self, timeout, callback, *args):
+                def on_timeout():
+                    callback(*args)
+                event_timeout = TimeoutEvent(timeout, on_timeout)
+                event_timeout.cancel = event_timeout.close
+                return event_timeout
+
+        def timed_receives():
+            test_channel = Channel()
+            def sender():
+                for i in range(N):
+                    test_channel.send(i)
+            Tasklet.new(sender)()
+            with unittest.timer() as tmr:
+                for i in range(N):
+                    test_channel.receive(10.0)
+            return tmr.sec(N)
+
+        print 'timer wheel timed receives/sec', timed_receives()
+        timers = core._timers
+        core._timers = _TimeoutEventTimers()
+        try:
+            print 'libevent TimeoutEvent timed receives/sec', timed_receives()
+        finally:
+            core._timers = timers
+
+    def testSelect(self):
+        c1, c2 = Channel(), Channel()
+        def sender(c, value):
+            c.send(value)
+        Tasklet.new(sender)(c2, 2)
+        self.assertEquals((c2, 2), Channel.select([c1, c2]))
+        #a sender that is already waiting is picked right away
+        Tasklet.new(sender)(c1, 1)
+        Tasklet.yield_()
+        self.assertTrue(c1.has_sender())
+        self.assertEquals((c1, 1), Channel.select([c1, c2]))
+        #the channels are only watched during the select
+        self.assertEquals(None, c1._selectors)
+        self.assertEquals(None, c2._selectors)
+        try:
+            Channel.select([c1, c2], 0.1)
+            self.fail("expected timeout")
+        except TimeoutError:
+            pass
+        self.assertEquals(None, c1._selectors)
+        #exceptions are passed as well
+        def raiser():
+            c2.send_exception(ValueError, "select")
+        Tasklet.new(raiser)()
+        try:
+            Channel.select([c1, c2])
+            self.fail("expected ValueError")
+        except ValueError:
+            pass
+
+    def testSelectFileDescriptor(self):
+        import os
+        from concurrence import FileDescriptorEvent
+        r, w = os.pipe()
+        readable = FileDescriptorEvent(r, 'r')
+        try:
+            c = Channel()
+            def writer():
+                Tasklet.sleep(0.05)
+                os.write(w, 'x')
+            Tasklet.new(writer)()
+            self.assertEquals((readable, None), Channel.select([c, readable], 1.0))
+            #an event that was not the one ready is no longer watched
+            def sender():
+                c.send(3)
+            Tasklet.new(sender)()
+            self.assertEquals((c, 3), Channel.select([c, readable], 1.0))
+        finally:
+            readable.close()
+            os.close(r)
+            os.close(w)
+
+    def testSelectBenchmark(self):
+        """compares select on several channels with a fan-in of the channels trough helper tasks into a mailbox"""
+        N = 20000
+        M = 4
+        def run(receive_all):
+            channels = [Channel() for i in range(M)]
+            def sender(c):
+                for i in range(N / M):
+                    c.send(i)
+            for c in channels:
+                Tasklet.new(sender)(c)
+            with unittest.timer() as tmr:
+                receive_all(channels)
+            return tmr.sec(N)
+
+        def select(channels):
+            for i in range(N):
+                Channel.select(channels)
+
+        def mailbox(channels):
+            from concurrence import Deque
+            box = Deque()
+            def forward(c):
+                while True:
+                    box.append((c, c.receive()))
+            helpers = [Tasklet.new(forward)(c) for c in channels]
+            for i in range(N):
+                box.popleft(True)
+            for t in helpers:
+                t.kill()
+
+        print 'select fan-in receives/sec', run(select)
+        print 'mailbox fan-in receives/sec', run(mailbox)
+
+class TestThreadsafe(unittest.TestCase):
+
+    def testCallSoonThreadsafe(self):
+        import threading
+        from concurrence import call_soon_threadsafe
+        result = Channel()
+        def in_thread():
+            call_soon_threadsafe(result.send, threading.currentThread())
+        t = threading.Thread(target = in_thread)
+        t.start()
+        self.assertEquals(t, result.receive(2.0))
+        t.join()
+
+    def testCallAtRoundEnd(self):
+        from concurrence import call_at_round_end
+        calls = []
+        for i in range(2):
+            Tasklet.new(calls.append)(i)
+        call_at_round_end(calls.append, 'end')
+        #the round ends when all tasks are blocked, tasks started by the callback run before the dispatcher waits
+        call_at_round_end(lambda: Tasklet.new(calls.append)('task'))
+        Tasklet.sleep(0.1)
+        self.assertEquals([0, 1, 'end', 'task'], calls)
+
+    def testSendThreadsafe(self):
+        import threading
+        c = Channel()
+        def in_thread():
+            for i in range(100):
+                c.send_threadsafe(i)
+        t = threading.Thread(target = in_thread)
+        t.start()
+        #the receiver is not waiting for all sends, these are sent later from tasks
+        self.assertEquals(range(100), [c.receive(2.0) for i in range(100)])
+        t.join()
+
+    def testQuitWakeup(self):
+        #quit from another thread wakes up the dispatcher right away, no heartbeat is needed
+        import os
+        import subprocess
+        script = "import threading, time\n" \
+                 "from concurrence import dispatch, quit\n" \
+                 "def main():\n" \
+                 "    threading.Timer(0.1, quit, [3]).start()\n" \
+                 "dispatch(main)\n"
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        with unittest.timer() as tmr:
+            exitcode = subprocess.call([sys.executable, '-c', script], env = env)
+        self.assertEquals(3, exitcode)
+        self.assertTrue(1.0 / tmr.sec(1) < 0.9)
+
+class TestTimerWheel(unittest.TestCase):
+
+    def testAdvance(self):
+        wheel = TimerWheel(0.01, 16)
+        fired = []
+        now = time.time()
+
+        t1 = wheel.add(0.5, fired.append, 1)
+        t2 = wheel.add(0.05, fired.append, 2)
+        t3 = wheel.add(0.1, fired.append, 3)
+        t4 = wheel.add(0.0, fired.append, 4)
+        self.assertEquals(4, len(wheel))
+        self.assertEquals(0.0, wheel.next_timeout(now))
+
+        wheel.advance(now)
+        self.assertEquals([4], fired)
+        self.assertTrue(0.0 < wheel.next_timeout(now) <= 0.07)
+
+        t3.cancel()
+        t3.cancel() #should be harmless
+        self.assertEquals(2, len(wheel))
+
+        #t1 expires in a later revolution of the wheel, so should not fire yet
+        wheel.advance(now + 0.3)
+        self.assertEquals([4, 2], fired)
+
+        wheel.advance(now + 0.6)
+        self.assertEquals([4, 2, 1], fired)
+        self.assertEquals(0, len(wheel))
+        self.assertEquals(TIMEOUT_NEVER, wheel.next_timeout(now))
+
+    def testNextTimeout(self):
+        wheel = TimerWheel(0.01, 1024)
+        now = time.time()
+        far = wheel.add(5.0, lambda: None)
+        self.assertTrue(4.9 < wheel.next_timeout(now) <= 5.02)
+        #the first tick with timers is remembered, so the slots are not scanned on every call
+        self.assertEquals(far._tick, wheel._next_tick)
+        #an earlier timer moves the next timeout forward, when it is cancelled the slots are scanned again
+        near = wheel.add(0.1, lambda: None)
+        self.assertTrue(0.0 < wheel.next_timeout(now) <= 0.12)
+        near.cancel()
+        self.assertTrue(4.9 < wheel.next_timeout(now) <= 5.02)
+        #processing the remembered tick also makes it look again
+        near = wheel.add(0.1, lambda: None)
+        wheel.advance(now + 0.2)
+        self.assertEquals(None, near._slot)
+        self.assertTrue(4.7 < wheel.next_timeout(now + 0.2) <= 4.82)
+
+    def testOrder(self):
+        wheel = TimerWheel(0.01, 16)
+        fired = []
+        now = time.time()
+        for i in range(10):
+            wheel.add(0.2 - (i * 0.01), fired.append, i)
+        wheel.advance(now + 1.0)
+        self.assertEquals(range(9, -1, -1), fired)
+
+    def testSleepAccuracy(self):
+        for timeout in [0.05, 0.25]:
+            start = time.time()
+            Tasklet.sleep(timeout)
+            end = time.time()
+            self.assertTrue(end - start >= timeout)
+            self.assertAlmostEqual(timeout, end - start, places = 1)
+
 if __name__ == '__main__':
     unittest.main(timeout = 100.0)
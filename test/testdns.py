@@ -0,0 +1,240 @@
+from __future__ import with_statement
+
+import os
+import struct
+import tempfile
+
+from concurrence import unittest, Tasklet, Channel
+from concurrence.io import Buffer, DatagramSocket, SocketServer, BufferedStream, Connector
+from concurrence import dns
+from concurrence.dns import Resolver, Message, Record, DNSError, HostNotFoundError, TYPE_A, TYPE_AAAA, TYPE_CNAME, TYPE_SOA
+
+class DNSServer(object):
+    """a stand-in name server on a local port, answering from *records*, a dict (name, type) -> [Record],
+    names that are not in *records* do not exist"""
+    def __init__(self, records):
+        self.records = records
+        self.queries = [] #(name, type) of the queries received over udp and tcp
+        self.delay = 0.0
+        self.drop = False #don't answer at all
+        self.truncate = False #answer with the TC flag set over udp
+        self.socket = DatagramSocket.server(('127.0.0.1', 0))
+        self.address = self.socket.socket.getsockname()
+        self.tcp_server = SocketServer(self.address, self.handle_tcp)
+        self.tcp_server.serve()
+        self.task = Tasklet.new(self.serve)()
+
+    def answer(self, query):
+        question = query.questions[0]
+        self.queries.append(question)
+        name, type = question
+        response = Message(query.id, Message.FLAG_QR | Message.FLAG_RA, [question])
+        while (name, type) not in self.records and (name, TYPE_CNAME) in self.records:
+            cname = self.records[(name, TYPE_CNAME)][0]
+            response.answers.append(cname)
+            name = cname.data
+        if (name, type) in self.records:
+            response.answers.extend(self.records[(name, type)])
+        elif not [key for key in self.records if key[0] == name]:
+            response.flags |= dns.RCODE_NXDOMAIN
+            response.authority.append(Record('test', TYPE_SOA, 300, ('ns.test', 'admin.test', 1, 3600, 600, 86400, 1)))
+        return response
+
+    def serve(self):
+        buffer = Buffer(1024)
+        while True:
+            buffer.clear()
+            n, address = self.socket.recvfrom(buffer)
+            buffer.flip()
+            query = Message.decode(buffer.read_bytes(n))
+            if self.drop:
+                continue
+            response = self.answer(query)
+            if self.delay:
+                Tasklet.sleep(self.delay)
+            if self.truncate:
+                response.flags |= Message.FLAG_TC
+                response.answers = []
+            self.socket.send_many([(response.encode(), address)])
+
+    def handle_tcp(self, socket):
+        stream = BufferedStream(socket)
+        n = struct.unpack('!H', stream.reader.read_bytes(2))[0]
+        response = self.answer(Message.decode(stream.reader.read_bytes(n))).encode()
+        stream.writer.write_bytes(struct.pack('!H', len(response)) + response)
+        stream.writer.flush()
+        socket.close()
+
+    def close(self):
+        self.task.kill()
+        self.socket.close()
+        self.tcp_server.close()
+
+class TestDNS(unittest.TestCase):
+    def setUp(self):
+        self.server = DNSServer({
+            ('www.test', TYPE_A): [Record('www.test', TYPE_A, 1, '10.0.0.1'), Record('www.test', TYPE_A, 1, '10.0.0.2')],
+            ('www.test', TYPE_AAAA): [Record('www.test', TYPE_AAAA, 300, '::1')],
+            ('alias.test', TYPE_CNAME): [Record('alias.test', TYPE_CNAME, 300, 'www.test')],
+            ('local.test', TYPE_A): [Record('local.test', TYPE_A, 300, '127.0.0.1')],
+        })
+        self.resolver = Resolver([self.server.address], timeout = 0.5, attempts = 1, hosts = None, resolv_conf = None)
+
+    def tearDown(self):
+        self.server.close()
+
+    def testMessage(self):
+        message = Message(1234, Message.FLAG_QR, [('www.test', TYPE_A)], [Record('www.test', TYPE_A, 60, '10.0.0.1')])
+        data = message.encode()
+        #a compressed name pointing at the question
+        data = data[:12 + 14] + '\xc0\x0c' + data[12 + 14 + 10:]
+        decoded = Message.decode(data)
+        self.assertEquals(1234, decoded.id)
+        self.assertEquals([('www.test', TYPE_A)], decoded.questions)
+        self.assertEquals(('www.test', TYPE_A, 60, '10.0.0.1'), (decoded.answers[0].name, decoded.answers[0].type,
+                                                             decoded.answers[0].ttl, decoded.answers[0].data))
+        self.assertRaises(DNSError, Message.decode, data[:-2])
+        self.assertRaises(DNSError, Message.decode, data[:12] + '\xc0\x0c')
+
+    def testResolve(self):
+        self.assertEquals(['10.0.0.1', '10.0.0.2'], self.resolver.resolve('www.test'))
+        self.assertEquals(['10.0.0.1', '10.0.0.2'], self.resolver.resolve('WWW.test.'))
+        self.assertEquals(['::1'], self.resolver.resolve('www.test', dns._socket.AF_INET6))
+        self.assertEquals(['10.0.0.1', '10.0.0.2'], self.resolver.query('alias.test'))
+        self.assertEquals(['10.1.1.1'], self.resolver.resolve('10.1.1.1'))
+        self.assertEquals(('10.0.0.1', 80), self.resolver.resolve_endpoint(('www.test', 80)))
+        self.assertEquals('/tmp/some.sock', self.resolver.resolve_endpoint('/tmp/some.sock'))
+        self.assertEquals([('www.test', TYPE_A), ('www.test', TYPE_AAAA), ('alias.test', TYPE_A)], self.server.queries)
+        stats = self.resolver.statistics()
+        self.assertEquals(3, stats['queries'])
+        self.assertEquals(2, stats['hits'])
+
+    def testTTL(self):
+        self.resolver.resolve('www.test')
+        self.resolver.resolve('www.test')
+        self.assertEquals(1, len(self.server.queries))
+        Tasklet.sleep(1.1) #the records have a ttl of 1 second
+        self.resolver.resolve('www.test')
+        self.assertEquals(2, len(self.server.queries))
+
+    def testNotFound(self):
+        self.assertRaises(HostNotFoundError, self.resolver.resolve, 'nothere.test')
+        self.assertRaises(HostNotFoundError, self.resolver.resolve, 'nothere.test')
+        #the name exists, but has no such records
+        self.assertRaises(HostNotFoundError, self.resolver.resolve, 'local.test', dns._socket.AF_INET6)
+        self.assertEquals(2, len(self.server.queries))
+        #the negative answer is cached for the minimum ttl of the SOA record
+        Tasklet.sleep(1.1)
+        self.assertRaises(HostNotFoundError, self.resolver.resolve, 'nothere.test')
+        self.assertEquals(3, len(self.server.queries))
+
+    def testCoalesce(self):
+        self.server.delay = 0.1
+        results = Channel()
+        def resolve():
+            results.send(self.resolver.resolve('www.test'))
+        for i in range(10):
+            Tasklet.new(resolve)()
+        for i in range(10):
+            self.assertEquals(['10.0.0.1', '10.0.0.2'], results.receive())
+        self.assertEquals(1, len(self.server.queries))
+        self.assertEquals(9, self.resolver.statistics()['coalesced'])
+        #a failure is passed on to the waiting tasks as well
+        self.server.drop = True
+        def resolve_error():
+            try:
+                self.resolver.resolve('local.test')
+            except DNSError, e:
+                results.send(e)
+        for i in range(3):
+            Tasklet.new(resolve_error)()
+        for i in range(3):
+            error = results.receive()
+            self.assertTrue(isinstance(error, DNSError))
+            self.assertFalse(isinstance(error, HostNotFoundError))
+        self.assertEquals(1, self.resolver.statistics()['failures'])
+
+    def testTimeout(self):
+        self.server.drop = True
+        resolver = Resolver([self.server.address], timeout = 0.2, attempts = 2, hosts = None, resolv_conf = None)
+        with unittest.timer() as tmr:
+            self.assertRaises(DNSError, resolver.resolve, 'www.test')
+        self.assertTrue(tmr.sec(1) > 0.35)
+        #failures are not cached
+        self.server.drop = False
+        self.assertEquals(['127.0.0.1'], resolver.resolve('local.test'))
+
+    def testTruncated(self):
+        self.server.truncate = True
+        self.assertEquals(['10.0.0.1', '10.0.0.2'], self.resolver.resolve('www.test'))
+        self.assertEquals(2, len(self.server.queries)) #udp and tcp
+
+    def testSearch(self):
+        resolver = Resolver([self.server.address], timeout = 0.5, attempts = 1, hosts = None, resolv_conf = None,
+                            search = ['other', 'test'])
+        #a short name is looked up in the search domains first
+        self.assertEquals(['10.0.0.1', '10.0.0.2'], resolver.resolve('www'))
+        self.assertEquals([('www.other', TYPE_A), ('www.test', TYPE_A)], self.server.queries)
+        #a name with ndots dots is tried as is first
+        del self.server.queries[:]
+        self.assertEquals(['127.0.0.1'], resolver.resolve('local.test'))
+        self.assertEquals([('local.test', TYPE_A)], self.server.queries)
+        #a fully qualified name is not searched
+        del self.server.queries[:]
+        self.assertRaises(HostNotFoundError, resolver.resolve, 'www.')
+        self.assertEquals([('www', TYPE_A)], self.server.queries)
+        self.assertRaises(HostNotFoundError, resolver.resolve, 'nothere')
+        resolver.ndots = 2
+        del self.server.queries[:]
+        self.assertEquals(['127.0.0.1'], resolver.resolve('local.test'))
+        #local.test itself was answered from the cache
+        self.assertEquals([('local.test.other', TYPE_A), ('local.test.test', TYPE_A)], self.server.queries)
+
+    def testConfig(self):
+        path = tempfile.mktemp()
+        f = open(path, 'w')
+        f.write("#comment\nnameserver 10.0.0.53\nnameserver ::1 #local\noptions timeout:3 attempts:4 ndots:2\ndomain other\nsearch test\n")
+        f.close()
+        hosts_path = tempfile.mktemp()
+        f = open(hosts_path, 'w')
+        f.write("127.0.0.1 localhost\n192.168.0.1 Myhost myhost.test #comment\n::1 localhost ip6-localhost\n")
+        f.close()
+        try:
+            resolver = Resolver(hosts = hosts_path, resolv_conf = path)
+            self.assertEquals([('10.0.0.53', 53), ('::1', 53)], resolver.nameservers)
+            self.assertEquals(3.0, resolver.timeout)
+            self.assertEquals(4, resolver.attempts)
+            self.assertEquals(['test'], resolver.search)
+            self.assertEquals(2, resolver.ndots)
+            self.assertEquals(['192.168.0.1'], resolver.resolve('myhost'))
+            self.assertEquals(['192.168.0.1'], resolver.resolve('MyHost.test'))
+            self.assertEquals(['::1'], resolver.resolve('localhost', dns._socket.AF_INET6))
+        finally:
+            os.unlink(path)
+            os.unlink(hosts_path)
+
+    def testConnector(self):
+        def handler(socket):
+            stream = BufferedStream(socket)
+            stream.writer.write_bytes('hello\n')
+            stream.writer.flush()
+            socket.close()
+        server = SocketServer(('127.0.0.1', 0), handler)
+        server.serve()
+        port = server.socket.socket.getsockname()[1]
+        default = dns._default
+        dns._default = self.resolver
+        try:
+            socket = Connector.connect(('local.test', port))
+            self.assertEquals('hello', BufferedStream(socket).reader.read_line())
+            socket.close()
+            #a datagram socket looks up the host of the destination as well
+            client = DatagramSocket.new()
+            client.send_many([('ping', ('local.test', self.server.address[1]))])
+            client.close()
+        finally:
+            dns._default = default
+            server.close()
+
+if __name__ == '__main__':
+    unittest.main(timeout = 20)
@@ -0,0 +1,232 @@
+import os
+import signal
+import resource
+
+from concurrence import unittest, event
+
+class TestEvent(unittest.TestCase):
+
+    def _readable_fds(self, n):
+        """returns a pipe and *n* dups of its readable end, that will all be readable"""
+        r, w = os.pipe()
+        os.write(w, 'x')
+        return r, w, [os.dup(r) for i in range(n)]
+
+    def _close_fds(self, r, w, fds):
+        for fd in fds:
+            os.close(fd)
+        os.close(r)
+        os.close(w)
+
+    def testTriggered(self):
+        r, w, fds = self._readable_fds(2)
+        events = [event.event(fd, event.EV_READ, None) for fd in fds]
+        try:
+            for e in events:
+                e.add()
+            event.loop()
+            triggered = event.triggered()
+            self.assertFalse(event.has_next())
+            self.assertEquals(2, len([e for e in triggered[::2] if e in events]))
+            i = triggered.index(events[1])
+            self.assertEquals(event.EV_READ, triggered[i + 1])
+            #an event that is deleted before it is processed is replaced by None
+            events[1].delete()
+            self.assertEquals(None, triggered[i])
+            #process any other events as the dispatcher would
+            for i in range(0, len(triggered), 2):
+                e = triggered[i]
+                if e is not None and e not in events:
+                    e.data(triggered[i + 1])
+        finally:
+            for e in events:
+                e.delete()
+            self._close_fds(r, w, fds)
+
+    def testDispatchBenchmark(self):
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        for n in [1000, 10000]:
+            if n + 16 > hard:
+                print 'skipping %d fds, fd limit too low' % n
+                continue
+            if n + 16 > soft:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+            r, w, fds = self._readable_fds(n)
+            count = [0]
+            def callback(event_type):
+                count[0] += 1
+            events = [event.event(fd, event.EV_READ, callback) for fd in fds]
+
+            def next_loop():
+                for e in events:
+                    e.add()
+                event.loop()
+
+            try:
+                R = 10
+                count[0] = 0
+                with unittest.timer() as tmr:
+                    for i in range(R):
+                        next_loop()
+                        while event.has_next():
+                            e, event_type, fd = event.next()
+                            e.data(event_type)
+                print 'has_next/next dispatch of %d ready fds, events/sec' % n, tmr.sec(count[0])
+
+                count[0] = 0
+                with unittest.timer() as tmr:
+                    for i in range(R):
+                        next_loop()
+                        triggered = event.triggered()
+                        for i in range(0, len(triggered), 2):
+                            e = triggered[i]
+                            if e is not None:
+                                e.data(triggered[i + 1])
+                print 'triggered dispatch of %d ready fds, events/sec' % n, tmr.sec(count[0])
+            finally:
+                for e in events:
+                    e.delete()
+                self._close_fds(r, w, fds)
+
+try:
+    from concurrence import _epoll
+    _epoll.init()
+except ImportError:
+    _epoll = None
+
+class TestEpoll(unittest.TestCase):
+    """tests the native epoll backend directly, independent of the backend used by the dispatcher"""
+
+    def _loop(self, *events):
+        """loops until one of *events* is triggered, any other event (of the dispatcher when
+        it also uses epoll) is processed as the dispatcher would"""
+        while True:
+            _epoll.loop()
+            triggered = _epoll.triggered()
+            result = []
+            for i in range(0, len(triggered), 2):
+                e = triggered[i]
+                if e in events:
+                    result.append((e, triggered[i + 1]))
+                elif e is not None:
+                    e.data(triggered[i + 1])
+            if result:
+                return result
+
+    def testReadWrite(self):
+        r, w = os.pipe()
+        try:
+            er = _epoll.event(r, _epoll.EV_READ, None)
+            ew = _epoll.event(w, _epoll.EV_WRITE, None)
+            ew.add()
+            self.assertEquals([(ew, _epoll.EV_WRITE)], self._loop(er, ew))
+            self.assertEquals(0, ew.pending(_epoll.EV_WRITE))
+            os.write(w, 'x')
+            er.add()
+            self.assertEquals([(er, _epoll.EV_READ)], self._loop(er, ew))
+            #the interest for the write end was still registered, it is removed lazily
+            er.add(0.1)
+            os.read(r, 1)
+            self.assertEquals([(er, _epoll.EV_TIMEOUT)], self._loop(er, ew))
+            er.delete()
+            ew.delete()
+        finally:
+            os.close(r)
+            os.close(w)
+
+    def testPersist(self):
+        r, w = os.pipe()
+        try:
+            os.write(w, 'x')
+            e = _epoll.event(r, _epoll.EV_READ | _epoll.EV_PERSIST, None)
+            e.add()
+            for i in range(3):
+                self.assertEquals([(e, _epoll.EV_READ)], self._loop(e))
+                self.assertEquals(1, e.pending(_epoll.EV_READ))
+            e.delete()
+            self.assertEquals(0, e.pending(_epoll.EV_READ))
+        finally:
+            os.close(r)
+            os.close(w)
+
+    def testTimeout(self):
+        e1 = _epoll.event(-1, _epoll.EV_TIMEOUT, None)
+        e2 = _epoll.event(-1, _epoll.EV_TIMEOUT, None)
+        e1.add(0.2)
+        e2.add(0.1)
+        with unittest.timer() as tmr:
+            self.assertEquals([(e2, _epoll.EV_TIMEOUT)], self._loop(e1, e2))
+        self.assertTrue(0.05 < 1.0 / tmr.sec(1) < 0.5)
+        self.assertEquals([(e1, _epoll.EV_TIMEOUT)], self._loop(e1, e2))
+
+    def testManyTimeouts(self):
+        events = [_epoll.event(-1, _epoll.EV_TIMEOUT, None) for i in range(1000)]
+        for i, e in enumerate(events):
+            e.add(0.1 + (i % 10) * 0.01)
+        #changed and removed timeouts leave stale entries behind, these must not fire
+        for e in events[::2]:
+            e.add(0.05)
+        for e in events[::3]:
+            e.delete()
+        expected = set([e for i, e in enumerate(events) if i % 3 != 0])
+        fired = []
+        while len(fired) < len(expected):
+            fired.extend([e for e, event_type in self._loop(*events)])
+        self.assertEquals(expected, set(fired))
+        self.assertEquals(len(expected), len(fired))
+        #the events that were re-added with an earlier timeout fired first
+        early = [e for i, e in enumerate(events) if i % 2 == 0 and i % 3 != 0]
+        self.assertEquals(set(early), set(fired[:len(early)]))
+
+    def testManyTimeoutsBenchmark(self):
+        #many events with a far timeout should not make a loop more expensive
+        N = 10000
+        events = [_epoll.event(-1, _epoll.EV_TIMEOUT, None) for i in range(N)]
+        for e in events:
+            e.add(100.0)
+        now = _epoll.event(-1, _epoll.EV_TIMEOUT, None)
+        try:
+            with unittest.timer() as tmr:
+                for i in range(N):
+                    now.add(0.0)
+                    self._loop(now)
+            print 'loops/sec with %d timeouts' % N, tmr.sec(N)
+        finally:
+            for e in events:
+                e.delete()
+
+    def testClosedFd(self):
+        #an fd that is closed without deleting its event, and is then reused
+        r, w = os.pipe()
+        e1 = _epoll.event(r, _epoll.EV_READ, None)
+        e1.add()
+        os.close(r)
+        os.close(w)
+        r, w = os.pipe()
+        try:
+            os.write(w, 'x')
+            e2 = _epoll.event(r, _epoll.EV_READ, None)
+            e2.add()
+            self.assertEquals([(e2, _epoll.EV_READ)], self._loop(e1, e2))
+            self.assertEquals(0, e1.pending(_epoll.EV_READ))
+            e1.delete()
+            e2.delete()
+        finally:
+            os.close(r)
+            os.close(w)
+
+    def testSignal(self):
+        e = _epoll.event(signal.SIGUSR1, _epoll.EV_SIGNAL | _epoll.EV_PERSIST, None)
+        e.add()
+        try:
+            os.kill(os.getpid(), signal.SIGUSR1)
+            self.assertEquals([(e, _epoll.EV_SIGNAL)], self._loop(e))
+        finally:
+            e.delete()
+
+if _epoll is None:
+    del TestEpoll
+
+if __name__ == '__main__':
+    unittest.main(timeout = 100.0)
@@ -4,7 +4,7 @@ import time
 
 from concurrence import Tasklet, TimeoutError, unittest
 from concurrence.http import HTTPError, WSGIServer, HTTPConnection
-from concurrence.wsgi import WSGISimpleRouter, WSGISimpleMessage
+from concurrence.wsgi import WSGISimpleRouter, WSGISimpleMessage, WSGISimpleStatic
 from concurrence.io import Buffer, Socket
 
 SERVER_PORT = 9090
@@ -33,6 +33,7 @@ class TestHTTP(unittest.TestCase):
         application.map('/sleep', WSGISleeper('zzz...'))
         application.map('/post', self.saver)
 
+        self.application = application
         self.server = WSGIServer(application)
         self.socket_server = self.server.serve(('0.0.0.0', SERVER_PORT))
 
@@ -156,6 +157,41 @@ class TestHTTP(unittest.TestCase):
         r2 = self.fetch10(s, '/hello/2')
         self.assertEquals('', r2)
 
+    def testHTTP10Iterable(self):
+        #a response that can be iterated only once, its length must be known before the body is sent
+        from StringIO import StringIO
+        body = ''.join([chr(i % 256) for i in range(100000)])
+        def wrapped(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', str(len(body)))])
+            return environ['wsgi.file_wrapper'](StringIO(body), 1000)
+        def generated(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return (body[i:i + 1000] for i in range(0, len(body), 1000))
+        self.application.map('/wrapped', wrapped)
+        self.application.map('/generated', generated)
+        for uri in ['/wrapped', '/generated']:
+            s = Socket.connect(('localhost', SERVER_PORT))
+            try:
+                b = Buffer(1024)
+                b.write_bytes("GET %s HTTP/1.0\r\n\r\n" % uri)
+                b.flip()
+                s.write(b)
+                #a HTTP/1.0 connection is closed after the response
+                data = []
+                b = Buffer(1024 * 64)
+                while True:
+                    b.clear()
+                    if not s.read(b):
+                        break
+                    b.flip()
+                    data.append(b.read_bytes(b.remaining))
+                header, content = ''.join(data).split('\r\n\r\n', 1)
+                self.assertEquals(1, header.lower().count('content-length'))
+                self.assertTrue(('Content-length: %d' % len(body)) in header)
+                self.assertEquals(body, content)
+            finally:
+                s.close()
+
     def testHTTPReadTimeout(self):
         self.server.read_timeout = 2
     
@@ -183,6 +219,56 @@ class TestHTTP(unittest.TestCase):
         finally:
             cnn.close()
 
+    def testStatic(self):
+        import os
+        import shutil
+        import tempfile
+        root = tempfile.mkdtemp()
+        cnn = HTTPConnection()
+        try:
+            content = ''.join([chr(i % 256) for i in range(1024 * 1024 + 17)])
+            f = open(os.path.join(root, 'large.bin'), 'wb')
+            f.write(content)
+            f.close()
+            f = open(os.path.join(root, 'small.html'), 'wb')
+            f.write('<html/>')
+            f.close()
+            self.application.map('/static', WSGISimpleStatic(root, '/static'))
+
+            cnn.connect(('localhost', SERVER_PORT))
+            response = cnn.perform(cnn.get('/static/large.bin'))
+            self.assertEquals(200, response.status_code)
+            self.assertEquals(content, response.body)
+            response = cnn.perform(cnn.get('/static/small.html'))
+            self.assertEquals('text/html', response.get_header('Content-Type'))
+            self.assertEquals('<html/>', response.body)
+            for path in ['/static/missing', '/static/../../../../../../etc/passwd', '/static/']:
+                self.assertEquals(404, cnn.perform(cnn.get(path)).status_code)
+            #the connection is still usable after sending files
+            self.assertEquals('Hello World 1', cnn.perform(cnn.get('/hello/1')).body)
+        finally:
+            cnn.close()
+            shutil.rmtree(root)
+
+    def testPool(self):
+        from concurrence.io.connectionpool import ConnectionPool
+        pool = ConnectionPool()
+        for i in range(3):
+            cnn = HTTPConnection(pool)
+            cnn.connect(('localhost', SERVER_PORT))
+            response = cnn.perform(cnn.get('/hello/%d' % i))
+            self.assertEquals('Hello World %d' % i, response.body)
+            cnn.close()
+        stats = pool.statistics()
+        self.assertEquals(1, stats['created'].count)
+        self.assertEquals(2, stats['reused'].count)
+        #a connection that is not at the end of a response is closed instead of returned
+        cnn = HTTPConnection(pool)
+        cnn.connect(('localhost', SERVER_PORT))
+        cnn.send(cnn.get('/hello/1'))
+        cnn.close()
+        self.assertEquals(0, pool.statistics()['endpoints'][('localhost', SERVER_PORT)]['connections'])
+
     def testHTTPPost(self):
         cnn = HTTPConnection()
 
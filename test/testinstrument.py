@@ -0,0 +1,80 @@
+import time
+
+from concurrence import unittest, Tasklet, Channel, instrument
+from concurrence import core
+
+class TestInstrument(unittest.TestCase):
+    def tearDown(self):
+        instrument.disable()
+        unittest.TestCase.tearDown(self)
+
+    def busy(self, duration):
+        end = time.time() + duration
+        while time.time() < end:
+            pass
+
+    def testRunTime(self):
+        ins = instrument.enable()
+        def hog():
+            for i in range(3):
+                self.busy(0.02)
+                Tasklet.yield_()
+        t = Tasklet.new(hog, name = 'hog')()
+        Tasklet.join(t)
+        stat = ins.by_name['hog']
+        self.assertTrue(stat.run_time >= 0.06)
+        self.assertTrue(stat.switches >= 3)
+        self.assertTrue(0.02 <= stat.longest_slice < 0.06)
+        self.assertTrue('hog' in instrument.statistics()['by_name'])
+
+    def testLongSlice(self):
+        long_slices = []
+        def on_long_slice(task, duration):
+            long_slices.append((task.name, duration))
+        instrument.enable(slice_threshold = 0.03, on_long_slice = on_long_slice)
+        def quick():
+            self.busy(0.001)
+        def hog():
+            self.busy(0.05)
+        Tasklet.join_all([Tasklet.new(quick, name = 'quick')(), Tasklet.new(hog, name = 'hog')()])
+        self.assertEquals(['hog'], [name for name, _ in long_slices])
+        self.assertTrue(long_slices[0][1] >= 0.05)
+
+    def testLag(self):
+        ins = instrument.enable()
+        for i in range(5):
+            Tasklet.sleep(0.01)
+        Tasklet.new(self.busy)(0.03)
+        Tasklet.sleep(0.01)
+        self.assertTrue(ins.lag.count >= 5)
+        self.assertTrue(ins.longest_lag >= 0.03)
+        #the time blocking in the loop is not accounted to the dispatcher
+        self.assertTrue(ins.by_name['<main>'].run_time < 0.04)
+
+    def testDisable(self):
+        ins = instrument.enable()
+        self.assertTrue(core._instrument is ins)
+        instrument.disable()
+        self.assertEquals(None, core._instrument)
+        switches = sum([stat.switches for stat in ins.by_name.values()])
+        Tasklet.sleep(0.01)
+        self.assertEquals(switches, sum([stat.switches for stat in ins.by_name.values()]))
+
+    def testOverheadBenchmark(self):
+        N = 20000
+        def pingpong():
+            ch = Channel()
+            def sender():
+                for i in range(N):
+                    ch.send(i)
+            Tasklet.new(sender)()
+            with unittest.timer() as tmr:
+                for i in range(N):
+                    ch.receive()
+            return tmr.sec(N)
+        print 'channel pingpong, instrumentation disabled, msgs/sec', pingpong()
+        instrument.enable()
+        print 'channel pingpong, instrumentation enabled, msgs/sec', pingpong()
+
+if __name__ == '__main__':
+    unittest.main(timeout = 100.0)
@@ -1,7 +1,13 @@
+import os
+import _socket
+import errno
+import signal
+from signal import SIGTERM, SIGKILL
 
-from concurrence import unittest, dispatch, TimeoutError, Tasklet
+from concurrence import unittest, dispatch, TimeoutError, Tasklet, Channel, TIMEOUT_NEVER
 from concurrence.core import FileDescriptorEvent
-from concurrence.io import Socket
+from concurrence.io import Socket, SocketServer, BufferedStream, DatagramSocket, Buffer
+from concurrence.io import socket
 
 
 class TestIO(unittest.TestCase):
@@ -17,5 +23,666 @@ class TestIO(unittest.TestCase):
 
         #TODO test why is socket.readable event not deallocated immediatly?
 
+    def socketpair(self):
+        import _socket
+        a, b = _socket.socketpair(_socket.AF_UNIX, _socket.SOCK_STREAM)
+        return Socket(a, Socket.STATE_CONNECTED), Socket(b, Socket.STATE_CONNECTED)
+
+    def read_all(self, socket, n):
+        stream = BufferedStream(socket)
+        return stream.reader.read_bytes(n)
+
+    def testWritev(self):
+        from concurrence.io import Buffer
+        a, b = self.socketpair()
+        try:
+            buffer = Buffer(16)
+            buffer.write_bytes('header')
+            buffer.flip()
+            #large enough to fill up the socket buffers, so that writev must wait and continue after partial writes
+            items = [buffer] + ['%d' % i for i in range(2000)] + ['x' * (1024 * 1024)]
+            expected = 'header' + ''.join(items[1:])
+            reader = Tasklet.new(self.read_all)(b, len(expected))
+            self.assertEquals(len(expected), a.writev(items))
+            self.assertEquals(0, buffer.remaining)
+            self.assertEquals(expected, Tasklet.join(reader))
+        finally:
+            a.close()
+            b.close()
+
+    def testSendfile(self):
+        import tempfile
+        content = ''.join([chr(i % 256) for i in range(1024 * 1024 * 4)])
+        f = tempfile.TemporaryFile()
+        f.write(content)
+        f.flush()
+        a, b = self.socketpair()
+        try:
+            #larger than the socket buffers, so that sendfile must wait for the reader
+            reader = Tasklet.new(self.read_all)(b, len(content) + 100)
+            self.assertEquals(len(content), a.sendfile(f))
+            self.assertEquals(100, a.sendfile(f.fileno(), 1000, 100))
+            self.assertEquals(content + content[1000:1100], Tasklet.join(reader))
+            #sends less when the end of the file is reached
+            reader = Tasklet.new(self.read_all)(b, 10)
+            self.assertEquals(10, a.sendfile(f, len(content) - 10, 100))
+            self.assertEquals(content[-10:], Tasklet.join(reader))
+        finally:
+            f.close()
+            a.close()
+            b.close()
+
+    def testWriteMany(self):
+        a, b = self.socketpair()
+        try:
+            reader = Tasklet.new(self.read_all)(b, 100016)
+            stream = BufferedStream(a, buffer_size = 64)
+            stream.writer.write_bytes('header\n')
+            stream.writer.write_many(['small', '\n']) #fits in the buffer
+            self.assertEquals(13, stream.writer.buffer.position)
+            stream.writer.write_large('y' * 100000) #sent right away with the buffered bytes
+            self.assertEquals(0, stream.writer.buffer.position)
+            stream.writer.write_bytes('end')
+            stream.writer.flush()
+            self.assertEquals('header\nsmall\n' + 'y' * 100000 + 'end', Tasklet.join(reader))
+        finally:
+            a.close()
+            b.close()
+
+    def testWriteLargeBenchmark(self):
+        a, b = self.socketpair()
+        N, size = 200, 256 * 1024
+        data = 'z' * size
+        def drain():
+            stream = BufferedStream(b, buffer_size = 64 * 1024)
+            while True:
+                stream.reader.read_bytes_available()
+        t = Tasklet.new(drain)()
+        try:
+            stream = BufferedStream(a)
+            for name, write in [('write_bytes', stream.writer.write_bytes), ('write_large', stream.writer.write_large)]:
+                with unittest.timer() as tmr:
+                    for i in range(N):
+                        write(data)
+                        stream.writer.flush()
+                print '%s of %d byte payloads, MB/sec' % (name, size), tmr.sec(N * size / (1024.0 * 1024.0))
+        finally:
+            t.kill()
+            a.close()
+            b.close()
+
+    def testRingBuffer(self):
+        from concurrence.io import RingBuffer
+        a, b = self.socketpair()
+        try:
+            lines = ['line %d %s' % (i, 'x' * (i % 13)) for i in range(2000)]
+            data = ''.join([line + '\r\n' for line in lines])
+            def write():
+                #small writes, so that the reader sees partial lines
+                for i in range(0, len(data), 37):
+                    a.writev([data[i:i + 37]])
+                    Tasklet.yield_()
+            writer = Tasklet.new(write)()
+            #a small buffer, so that lines wrap around its end
+            stream = BufferedStream(b, buffer_size = 64, read_buffer_class = RingBuffer)
+            self.assertTrue(isinstance(stream.reader.buffer, RingBuffer))
+            for line in lines:
+                self.assertEquals(line, stream.reader.read_line())
+            Tasklet.join(writer)
+        finally:
+            a.close()
+            b.close()
+
+    def testRingBufferBenchmark(self):
+        from concurrence.io import Buffer, RingBuffer
+        #pipelined memcache like responses, read from a large buffer, most reads end in a partial frame
+        N = 20000
+        value = 'v' * 700
+        response = 'VALUE key 0 %d\r\n%s\r\nEND\r\n' % (len(value), value)
+        for buffer_class in [Buffer, RingBuffer]:
+            a, b = self.socketpair()
+            def write():
+                stream = BufferedStream(a, buffer_size = 64 * 1024)
+                for i in range(N):
+                    stream.writer.write_bytes(response)
+                stream.writer.flush()
+            writer = Tasklet.new(write)()
+            try:
+                reader = BufferedStream(b, buffer_size = 64 * 1024, read_buffer_class = buffer_class).reader
+                with unittest.timer() as tmr:
+                    for i in range(N):
+                        header = reader.read_line()
+                        reader.read_bytes(int(header.split()[3]) + 2)
+                        reader.read_line()
+                print 'pipelined responses with %s, responses/sec' % buffer_class.__name__, tmr.sec(N)
+                Tasklet.join(writer)
+            finally:
+                a.close()
+                b.close()
+
+    def testReadinessPrediction(self):
+        a, b = self.socketpair()
+        try:
+            N = 40
+            client, server = BufferedStream(a), BufferedStream(b)
+            def respond():
+                for i in range(N):
+                    self.assertEquals('request', server.reader.read_line())
+                    server.writer.write_bytes('response\n')
+                    server.writer.flush()
+            t = Tasklet.new(respond)()
+            for i in range(N):
+                Tasklet.sleep(0.001) #the server reads before the request is there, like an idle keep-alive connection
+                client.writer.write_bytes('request\n')
+                client.writer.flush()
+                self.assertEquals('response', client.reader.read_line())
+            Tasklet.join(t)
+            stats = b.statistics()
+            #the server socket learns that it has to wait first, only its probes are wasted
+            self.assertTrue(stats['wasted_reads'] <= 2 + N // socket.PROBE_INTERVAL, stats)
+            self.assertEquals(0, stats['wasted_writes'])
+            self.assertEquals(stats['reads'], N + stats['wasted_reads'])
+        finally:
+            a.close()
+            b.close()
+
+    def testReadinessBenchmark(self):
+        def serve(stream, n, response):
+            #reads n requests of 1 line each and answers each request on its own
+            for i in range(n):
+                stream.reader.read_line()
+                stream.writer.write_bytes(response)
+                if not stream.reader.buffer.remaining:
+                    stream.writer.flush()
+            stream.writer.flush()
+        def report(name, n, client, server):
+            for side, sock in [('client', client), ('server', server)]:
+                stats = sock.statistics()
+                print '%s %s syscalls/request: read %.2f, write %.2f, wasted read %.2f, wasted write %.2f, waits %.2f' % \
+                    (name, side, stats['reads'] / float(n), stats['writes'] / float(n),
+                     stats['wasted_reads'] / float(n), stats['wasted_writes'] / float(n), stats['waits'] / float(n))
+        #keep-alive http like: 1 request in flight per connection
+        N = 5000
+        request = 'GET / HTTP/1.1\r\n'
+        response = 'HTTP/1.1 200 OK\r\nContent-length: 5\r\n\r\nhello'
+        a, b = self.socketpair()
+        try:
+            client, server = BufferedStream(a), BufferedStream(b)
+            t = Tasklet.new(serve)(server, N, response)
+            with unittest.timer() as tmr:
+                for i in range(N):
+                    client.writer.write_bytes(request)
+                    client.writer.flush()
+                    client.reader.read_bytes(len(response))
+            print 'keep-alive requests/sec', tmr.sec(N)
+            Tasklet.join(t)
+            report('keep-alive', N, a, b)
+        finally:
+            a.close()
+            b.close()
+        #pipelined memcache like: batches of gets written at once
+        N, M = 200, 100
+        request = 'get key\r\n'
+        response = 'VALUE key 0 100\r\n%s\r\nEND\r\n' % ('v' * 100)
+        a, b = self.socketpair()
+        try:
+            client, server = BufferedStream(a), BufferedStream(b)
+            t = Tasklet.new(serve)(server, N * M, response)
+            with unittest.timer() as tmr:
+                for i in range(N):
+                    for j in range(M):
+                        client.writer.write_bytes(request)
+                    client.writer.flush()
+                    for j in range(M):
+                        client.reader.read_bytes(len(response))
+            print 'pipelined gets/sec', tmr.sec(N * M)
+            Tasklet.join(t)
+            report('pipelined', N * M, a, b)
+        finally:
+            a.close()
+            b.close()
+
+    def testDeferredFlush(self):
+        a, b = self.socketpair()
+        try:
+            stream = BufferedStream(a, deferred_flush = True)
+            def write(i):
+                stream.writer.write_bytes('line %d\n' % i)
+                stream.writer.flush()
+            for i in range(10):
+                Tasklet.new(write)(i)
+            Tasklet.sleep(0.01) #let the writers run, the round ends when all tasks are blocked
+            self.assertEquals(1, a.writes) #the 10 flushes were written at once
+            reader = BufferedStream(b).reader
+            self.assertEquals(['line %d' % i for i in range(10)], [reader.read_line() for i in range(10)])
+            #a forced flush writes right away
+            stream.writer.write_bytes('now\n')
+            stream.writer.flush(True)
+            self.assertEquals(2, a.writes)
+            self.assertEquals('now', reader.read_line())
+            #close writes a pending flush
+            stream.writer.write_bytes('bye\n')
+            stream.writer.flush()
+            stream.close()
+            self.assertEquals('bye', reader.read_line())
+        finally:
+            b.close()
+
+    def testDeferredFlushFull(self):
+        #more bytes than fit in the socket buffer, the rest is written by a flusher task while more bytes are added
+        a, b = self.socketpair()
+        try:
+            stream = BufferedStream(a, buffer_size = 1024 * 64, deferred_flush = True)
+            data = ''.join([chr(i % 256) for i in range(1024 * 16)])
+            n = 0
+            while stream.writer._flusher is None:
+                stream.writer.write_bytes(data)
+                stream.writer.flush()
+                Tasklet.sleep(0.01)
+                n += 1
+            #the flusher task keeps the bytes that did not fit, new bytes are added after them
+            stream.writer.write_bytes('end')
+            stream.writer.flush()
+            result = Channel()
+            Tasklet.new(lambda: result.send(self.read_all(b, len(data) * n)))()
+            stream.writer.flush(True)
+            self.assertEquals(data * n + 'end', result.receive() + self.read_all(b, 3))
+            self.assertEquals(None, stream.writer._flusher)
+            #an error of a deferred flush is raised by the next flush
+            b.close()
+            stream.writer.write_bytes('x')
+            stream.writer.flush()
+            Tasklet.sleep(0.01)
+            self.assertRaises(IOError, stream.writer.flush)
+        finally:
+            a.close()
+            if not b.is_closed():
+                b.close()
+
+    def testDeferredFlushNotRead(self):
+        #the peer does not read, so the rest of a deferred flush can never be written
+        data = 'x' * (1024 * 16)
+        for close in [True, False]:
+            a, b = self.socketpair()
+            try:
+                stream = BufferedStream(a, buffer_size = 1024 * 64, deferred_flush = True)
+                writer = stream.writer
+                writer.flush_timeout = 0.2
+                while writer._flusher is None:
+                    writer.write_bytes(data)
+                    writer.flush()
+                    Tasklet.sleep(0.01)
+                flusher = writer._flusher
+                if close:
+                    #close does not wait for the peer, the rest is dropped and the flusher is stopped
+                    with unittest.timer() as tmr:
+                        stream.close()
+                    self.assertTrue(1.0 / tmr.sec(1) < 0.1)
+                    Tasklet.sleep(0.01)
+                    self.assertTrue(flusher.has_finished())
+                else:
+                    #the flusher gives up after the flush timeout, the next flush raises the timeout
+                    Tasklet.sleep(0.4)
+                    self.assertEquals(None, writer._flusher)
+                    self.assertRaises(TimeoutError, writer.flush)
+                    stream.close()
+            finally:
+                b.close()
+
+    def testDeferredFlushBenchmark(self):
+        #chat like: many tasks each send a short message to the writer task of a connection, which writes and flushes it
+        from concurrence.io import buffered
+        N, M = 1000, 20
+        message = 'some chat message\n'
+        def drain(socket):
+            reader = BufferedStream(socket).reader
+            for i in range(N * M):
+                reader.read_line()
+        def writer(stream, lines):
+            for i in range(N * M):
+                stream.writer.write_bytes(lines.receive())
+                stream.writer.flush()
+            stream.writer.flush(True)
+        for deferred_flush in [False, True]:
+            a, b = self.socketpair()
+            try:
+                stream = BufferedStream(a, deferred_flush = deferred_flush)
+                lines = Channel()
+                tasks = [Tasklet.new(drain)(b), Tasklet.new(writer)(stream, lines)]
+                stats = buffered.statistics()
+                syscalls, bytes = stats['syscalls'].count, stats['bytes'].count
+                with unittest.timer() as tmr:
+                    for i in range(N):
+                        for j in range(M):
+                            Tasklet.new(lines.send)(message)
+                        Tasklet.sleep(0.0)
+                    Tasklet.join_all(tasks)
+                stats = buffered.statistics()
+                syscalls, bytes = stats['syscalls'].count - syscalls, stats['bytes'].count - bytes
+                print 'deferred flush %s, messages/sec %d, bytes/syscall %.1f' % (deferred_flush, tmr.sec(N * M), bytes / float(syscalls))
+                if deferred_flush:
+                    self.assertTrue(syscalls <= N + 1)
+                else:
+                    self.assertEquals(N * M, syscalls)
+            finally:
+                a.close()
+                b.close()
+
+class TestSocketServer(unittest.TestCase):
+    def handler(self, client_socket):
+        stream = BufferedStream(client_socket)
+        if stream.reader.read_line() == 'crash':
+            os._exit(1)
+        stream.writer.write_bytes('%d\n' % os.getpid())
+        stream.writer.flush()
+        client_socket.close()
+
+    def request(self, addr, msg):
+        client_socket = Socket.connect(addr)
+        try:
+            stream = BufferedStream(client_socket)
+            stream.writer.write_bytes(msg + '\n')
+            stream.writer.flush()
+            return int(stream.reader.read_line())
+        finally:
+            client_socket.close()
+
+    def servePrefork(self, distribute):
+        #the server is started in a separate process, because the workers start as a copy
+        #of the process that serves (and we don't want them to continue running this test)
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            server = SocketServer(('127.0.0.1', 0), self.handler)
+            server.serve(workers = 2, distribute = distribute)
+            os.write(w, '%d' % server.socket.socket.getsockname()[1])
+            Tasklet.sleep(TIMEOUT_NEVER)
+        os.close(w)
+        try:
+            addr = ('127.0.0.1', int(os.read(r, 100)))
+
+            pids = set([self.request(addr, 'pid') for i in range(20)])
+            self.assertTrue(pid not in pids)
+            self.assertTrue(os.getpid() not in pids)
+
+            #a crashed worker is restarted
+            try:
+                self.request(addr, 'crash')
+                self.fail('expected worker to crash')
+            except EOFError:
+                pass
+            Tasklet.sleep(socket.WORKER_RESTART_DELAY + 0.5)
+            restarted_pids = set([self.request(addr, 'pid') for i in range(20)])
+            self.assertTrue(len(restarted_pids - pids) > 0)
+        finally:
+            os.close(r)
+            os.kill(pid, SIGTERM)
+            os.waitpid(pid, 0)
+
+    def testAcceptBatch(self):
+        server_socket = Socket.server(('127.0.0.1', 0))
+        addr = server_socket.socket.getsockname()
+        clients = []
+        try:
+            #connections that are in the backlog are accepted without waiting again
+            clients = [Socket.connect(addr) for i in range(10)]
+            Tasklet.sleep(0.1)
+            accepted = server_socket.accept_many(4)
+            self.assertEquals(4, len(accepted))
+            accepted.extend(server_socket.accept_many())
+            self.assertEquals(10, len(accepted))
+            for s in accepted:
+                s.close()
+        finally:
+            for s in clients:
+                s.close()
+            server_socket.close()
+
+    def testMaxConnections(self):
+        release = Channel()
+        def handler(client_socket):
+            release.receive()
+            client_socket.close()
+        for reject_when_full in [False, True]:
+            server = SocketServer(('127.0.0.1', 0), handler, max_connections = 3, reject_when_full = reject_when_full)
+            server.serve()
+            addr = server.socket.socket.getsockname()
+            clients = []
+            try:
+                clients = [Socket.connect(addr) for i in range(5)]
+                Tasklet.sleep(0.1)
+                stats = server.statistics()
+                self.assertEquals(3, stats['connections'])
+                self.assertEquals(3, stats['accepted'])
+                if reject_when_full:
+                    self.assertEquals(2, stats['rejected'])
+                else:
+                    #the other 2 are waiting in the backlog until a connection is closed
+                    self.assertEquals(0, stats['rejected'])
+                    self.assertEquals(1, stats['paused'])
+                    release.send(True)
+                    Tasklet.sleep(0.1)
+                    self.assertEquals(3, server.statistics()['connections'])
+                    self.assertEquals(4, server.statistics()['accepted'])
+                while release.has_receiver():
+                    release.send(True)
+                Tasklet.sleep(0.1)
+                self.assertEquals(0, server.statistics()['pending'])
+            finally:
+                while release.has_receiver():
+                    release.send(True)
+                for s in clients:
+                    s.close()
+                server.close()
+
+    def testPreforkReusePort(self):
+        if socket.SO_REUSEPORT is None:
+            return
+        self.servePrefork(socket.DISTRIBUTE_REUSEPORT)
+
+    def testPreforkSendFd(self):
+        self.servePrefork(socket.DISTRIBUTE_SENDFD)
+
+    def testPreforkClose(self):
+        #workers that ignore SIGTERM are killed after worker_stop_timeout, without blocking the dispatcher meanwhile
+        r, w = os.pipe()
+        cr, cw = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            #never return into the test runner, the parent would wait for us forever
+            try:
+                os.close(r)
+                os.close(cw)
+                signal.signal(SIGTERM, signal.SIG_IGN) #inherited by the workers
+                server = SocketServer(('127.0.0.1', 0), self.handler)
+                server.worker_stop_timeout = 0.5
+                server.serve(workers = 2, distribute = socket.DISTRIBUTE_SENDFD)
+                os.write(w, '%d %s\n' % (server.socket.socket.getsockname()[1], ' '.join(map(str, server.workers))))
+                FileDescriptorEvent(cr, 'r').wait(timeout = TIMEOUT_NEVER)
+                ticks = []
+                ticker = Tasklet.interval(0.1, lambda: ticks.append(1), daemon = True)()
+                with unittest.timer() as tmr:
+                    server.close()
+                ticker.kill()
+                os.write(w, '%f %d %d\n' % (1.0 / tmr.sec(1), len(ticks), len(server.workers)))
+            finally:
+                os._exit(0)
+        os.close(w)
+        os.close(cr)
+        f = os.fdopen(r)
+        try:
+            line = f.readline().split()
+            addr, worker_pids = ('127.0.0.1', int(line[0])), map(int, line[1:])
+            self.assertEquals(2, len(worker_pids))
+            self.assertTrue(self.request(addr, 'pid') in worker_pids)
+
+            os.write(cw, 'x')
+            elapsed, ticks, workers = f.readline().split()
+            self.assertTrue(0.5 <= float(elapsed) < 2.0)
+            self.assertTrue(int(ticks) >= 3)
+            self.assertEquals(0, int(workers))
+            #the workers were killed and reaped
+            for worker_pid in worker_pids:
+                try:
+                    os.kill(worker_pid, 0)
+                    self.fail('expected worker %d to be gone' % worker_pid)
+                except OSError, e:
+                    self.assertEquals(errno.ESRCH, e.errno)
+        finally:
+            f.close()
+            os.close(cw)
+            try:
+                os.kill(pid, SIGKILL)
+            except OSError:
+                pass
+            os.waitpid(pid, 0)
+
+class TestDatagramSocket(unittest.TestCase):
+    def testSendRecv(self):
+        server = DatagramSocket.server(('127.0.0.1', 0))
+        client = DatagramSocket.new()
+        try:
+            port = server.socket.getsockname()[1]
+            def reply():
+                buffer = Buffer(1024)
+                n, address = server.recvfrom(buffer)
+                buffer.flip()
+                server.sendto(buffer, address)
+            t = Tasklet.new(reply)()
+            buffer = Buffer(1024)
+            buffer.write_bytes('hello')
+            buffer.flip()
+            self.assertEquals(5, client.sendto(buffer, ('localhost', port))) #the host name is looked up
+            self.assertEquals(0, buffer.remaining)
+            buffer.clear()
+            n, address = client.recvfrom(buffer)
+            self.assertEquals(5, n)
+            self.assertEquals(('127.0.0.1', port), address)
+            buffer.flip()
+            self.assertEquals('hello', buffer.read_bytes(5))
+            Tasklet.join(t)
+            #a datagram that does not fit is truncated
+            buffer.clear()
+            buffer.write_bytes('x' * 100)
+            buffer.flip()
+            client.sendto(buffer, ('127.0.0.1', port))
+            small = Buffer(10)
+            self.assertEquals(10, server.recvfrom(small)[0])
+            self.assertRaises(TimeoutError, server.recvfrom, small, timeout = 0.1)
+        finally:
+            server.close()
+            client.close()
+
+    def testMany(self):
+        N = 500
+        server = DatagramSocket.server(('127.0.0.1', 0))
+        client = DatagramSocket.new()
+        try:
+            address = server.socket.getsockname()
+            messages = ['message %d' % i for i in range(N)]
+            received = []
+            batches = 0
+            #in rounds, so that the datagrams fit in the receive buffer of the socket
+            for i in range(0, N, 100):
+                self.assertEquals(100, client.send_many([(message, address) for message in messages[i:i + 100]]))
+                while len(received) < i + 100:
+                    buffers = [Buffer(64) for j in range(100)]
+                    result = server.recv_many(buffers)
+                    batches += 1
+                    for buffer, (n, sender) in zip(buffers, result):
+                        self.assertEquals(('127.0.0.1', client.socket.getsockname()[1]), sender)
+                        buffer.flip()
+                        received.append(buffer.read_bytes(n))
+            self.assertEquals(messages, received)
+            self.assertTrue(batches < N)
+            #buffers are sent from their position, which is not updated
+            buffer = Buffer(64)
+            buffer.write_bytes('buffer')
+            buffer.flip()
+            client.send_many([(buffer, ('localhost', address[1]))] * 2)
+            self.assertEquals(0, buffer.position)
+            buffers = [Buffer(64), Buffer(64)]
+            n = 0
+            while n < 2:
+                n += len(server.recv_many(buffers[n:]))
+            self.assertEquals(['buffer', 'buffer'], [b.flip() or b.read_bytes(6) for b in buffers])
+        finally:
+            server.close()
+            client.close()
+
+    def testBenchmark(self):
+        N, M = 200, 50
+        server = DatagramSocket.server(('127.0.0.1', 0))
+        client = DatagramSocket.new()
+        try:
+            address = server.socket.getsockname()
+            data = Buffer(64)
+            data.write_bytes('x' * 32)
+            data.flip()
+            buffers = [Buffer(64) for i in range(M)]
+            with unittest.timer() as tmr:
+                for i in range(N):
+                    for j in range(M):
+                        data.position = 0
+                        client.sendto(data, address)
+                    for buffer in buffers:
+                        buffer.clear()
+                        server.recvfrom(buffer)
+            print 'sendto/recvfrom datagrams/sec', tmr.sec(N * M)
+            items = [(data, address)] * M
+            with unittest.timer() as tmr:
+                for i in range(N):
+                    client.send_many(items)
+                    n = 0
+                    while n < M:
+                        for buffer in buffers:
+                            buffer.clear()
+                        n += len(server.recv_many(buffers[:M - n]))
+            print 'send_many/recv_many datagrams/sec', tmr.sec(N * M)
+        finally:
+            server.close()
+            client.close()
+
+    def testUnix(self):
+        import tempfile
+        path = tempfile.mktemp()
+        server = DatagramSocket.server(path)
+        client = DatagramSocket.server(path + '.client')
+        try:
+            client.send_many([('a', path), ('bc', path)])
+            buffers = [Buffer(16), Buffer(16)]
+            self.assertEquals([(1, path + '.client'), (2, path + '.client')], server.recv_many(buffers))
+        finally:
+            server.close()
+            client.close()
+            os.unlink(path)
+            os.unlink(path + '.client')
+
+    def testInvalidAddress(self):
+        server = DatagramSocket.server(('127.0.0.1', 0))
+        port = server.socket.getsockname()[1]
+        client = DatagramSocket.new()
+        unix = DatagramSocket.new(_socket.AF_UNIX)
+        try:
+            #a unicode host is converted
+            client.send_many([('a', (u'127.0.0.1', port))])
+            self.assertEquals(1, client.sendto(self.buffer('b'), (u'127.0.0.1', port)))
+            self.assertEquals([(1, ('127.0.0.1', client.socket.getsockname()[1]))] * 2, server.recv_many([Buffer(16), Buffer(16)]))
+            #addresses that can never be valid raise instead of being looked up again
+            for sock, address in [(client, ('::1', port)), (unix, '/tmp/' + 'x' * 108)]:
+                self.assertRaises(ValueError, sock.sendto, self.buffer('c'), address)
+                self.assertRaises(ValueError, sock.send_many, [('c', address)])
+        finally:
+            server.close()
+            client.close()
+            unix.close()
+
+    def buffer(self, s):
+        buffer = Buffer(len(s))
+        buffer.write_bytes(s)
+        buffer.flip()
+        return buffer
+
 if __name__ == '__main__':
     unittest.main(timeout = 10.0)
@@ -26,6 +26,26 @@ class TestMySQL(unittest.TestCase):
         rs.close()
         cnn.close()
 
+    def testConnectFailedReturnsBuffer(self):
+        from concurrence.io import Socket, bufferpool
+        #a 'server' that closes the connection instead of sending the handshake
+        server = Socket.server(('127.0.0.1', 0))
+        def close_client():
+            server.accept().close()
+        Tasklet.new(close_client)()
+        in_use = lambda: bufferpool.statistics()[16 * 1024]['in_use'].count
+        start = in_use()
+        cnn = client.Connection()
+        try:
+            cnn.connect(host = '127.0.0.1', port = server.socket.getsockname()[1])
+            self.fail('expected connect to fail')
+        except Exception:
+            pass
+        self.assertEquals(client.Connection.STATE_ERROR, cnn.state)
+        self.assertEquals(None, cnn.socket)
+        self.assertEquals(start, in_use())
+        server.close()
+
     def testConnectNoDb(self):
         cnn = client.connect(host = DB_HOST, user = DB_USER, passwd = DB_PASSWD)
 
@@ -0,0 +1,123 @@
+import os
+import time
+import select
+
+from concurrence import unittest, Tasklet, TimeoutError
+from concurrence import processpool
+from concurrence.processpool import ProcessPool, ProcessPoolError
+
+def add(a, b):
+    return a + b
+
+def fail():
+    raise ValueError("in worker")
+
+def die():
+    os._exit(1)
+
+class TestProcessPool(unittest.TestCase):
+
+    def testRun(self):
+        pool = ProcessPool(2)
+        try:
+            self.assertEquals(3, pool.run(add, 1, b = 2))
+            self.assertEquals('x' * 100000 + 'y', pool.run(add, 'x' * 100000, 'y'))
+            try:
+                pool.run(fail)
+                self.fail("expected ValueError")
+            except ValueError, e:
+                self.assertEquals("in worker", str(e))
+            self.assertEquals(3, pool.statistics()['completed'])
+        finally:
+            pool.close()
+        self.assertEquals(0, pool.workers)
+
+    def testParallel(self):
+        pool = ProcessPool(4)
+        try:
+            with unittest.timer() as tmr:
+                tasks = [Tasklet.new(pool.run)(time.sleep, 0.2) for i in range(4)]
+                Tasklet.join_all(tasks)
+            self.assertTrue(1.0 / tmr.sec(1) < 0.4)
+        finally:
+            pool.close()
+
+    def testBackPressure(self):
+        pool = ProcessPool(2)
+        try:
+            tasks = [Tasklet.new(pool.run)(time.sleep, 0.1) for i in range(6)]
+            Tasklet.sleep(0.05)
+            self.assertEquals(2, pool.busy)
+            self.assertEquals(4, pool.statistics()['waiting'])
+            with unittest.timer() as tmr:
+                Tasklet.join_all(tasks)
+            self.assertTrue(1.0 / tmr.sec(1) > 0.15)
+            self.assertEquals(0, pool.busy)
+            self.assertEquals(4, pool.statistics()['max_waiting'])
+        finally:
+            pool.close()
+
+    def testWorkerDied(self):
+        pool = ProcessPool(1)
+        try:
+            try:
+                pool.run(die)
+                self.fail("expected ProcessPoolError")
+            except ProcessPoolError:
+                pass
+            #the worker was replaced
+            self.assertEquals(3, pool.run(add, 1, 2))
+            self.assertEquals(1, pool.workers)
+        finally:
+            pool.close()
+
+    def testTimeout(self):
+        pool = ProcessPool(1)
+        try:
+            try:
+                Tasklet.set_current_timeout(0.1)
+                pool.run(time.sleep, 0.3)
+                self.fail("expected timeout")
+            except TimeoutError:
+                pass
+            Tasklet.set_current_timeout(-1)
+            self.assertEquals(3, pool.run(add, 1, 2))
+        finally:
+            pool.close()
+
+    def testWorkerClosesFds(self):
+        #a connection of the parent sees eof when the parent closes it, also when a worker was forked while it was open
+        r, w = os.pipe()
+        pool = ProcessPool(1)
+        try:
+            pool.run(die) #the replacement worker is forked from the running pool
+        except ProcessPoolError:
+            pass
+        try:
+            self.assertEquals(3, pool.run(add, 1, 2))
+            os.close(w)
+            self.assertEquals([r], select.select([r], [], [], 2.0)[0])
+            self.assertEquals('', os.read(r, 1))
+        finally:
+            os.close(r)
+            pool.close()
+
+    def testWorkerStartsFast(self):
+        #a worker only closes the fds that are open, not every fd up to the fd limit
+        if processpool._open_fds() is None:
+            return
+        maxfd = processpool.MAXFD
+        processpool.MAXFD = 1 << 30
+        try:
+            with unittest.timer() as tmr:
+                pool = ProcessPool(2)
+                try:
+                    self.assertEquals(3, pool.run(add, 1, 2))
+                finally:
+                    pool.close()
+            self.assertTrue(1.0 / tmr.sec(1) < 2.0)
+        finally:
+            processpool.MAXFD = maxfd
+
+if __name__ == '__main__':
+    unittest.main(timeout = 20.0)
@@ -0,0 +1,72 @@
+import os
+import time
+import signal
+
+from concurrence import unittest, Tasklet, Channel, profiler
+
+def busy(duration):
+    end = time.time() + duration
+    while time.time() < end:
+        pass
+
+class TestProfiler(unittest.TestCase):
+    def tearDown(self):
+        profiler.disable()
+        unittest.TestCase.tearDown(self)
+
+    def testRunning(self):
+        prof = profiler.enable(interval = 0.001)
+        def hog():
+            busy(0.2)
+        Tasklet.join(Tasklet.new(hog, name = 'hog')())
+        profiler.disable()
+        self.assertFalse(prof.running)
+        self.assertTrue(prof.samples > 10)
+        hog_samples = sum([count for stack, count in prof.counts.items() if stack[0] == 'hog' and 'busy' in stack[-1]])
+        self.assertTrue(hog_samples > prof.samples / 2)
+        line = prof.collapsed().split('\n')[0]
+        self.assertTrue(line.startswith('hog;'))
+        self.assertTrue(line.split(';')[-1].startswith('busy (testprofiler.py:'))
+
+    def testBlocked(self):
+        prof = profiler.enable(blocked_interval = 0.01)
+        c = Channel()
+        def waiter():
+            c.receive()
+        t = Tasklet.new(waiter, name = 'waiter')()
+        Tasklet.sleep(0.2)
+        c.send(None)
+        Tasklet.join(t)
+        profiler.disable()
+        blocked = [count for stack, count in prof.counts.items() if stack[:2] == ('waiter', profiler.BLOCKED_MARKER)]
+        self.assertTrue(sum(blocked) > 5)
+
+    def testSignalToggle(self):
+        path = 'profile.test.collapsed'
+        event = profiler.install_signal(signal.SIGUSR2, path, interval = 0.001)
+        try:
+            os.kill(os.getpid(), signal.SIGUSR2)
+            Tasklet.sleep(0.05)
+            self.assertTrue(profiler.current().running)
+            busy(0.1)
+            os.kill(os.getpid(), signal.SIGUSR2)
+            Tasklet.sleep(0.05)
+            self.assertFalse(profiler.current().running)
+            self.assertTrue(os.path.getsize(path) > 0)
+        finally:
+            event.close()
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def testWSGI(self):
+        app = profiler.WSGIProfiler(interval = 0.001)
+        def start_response(status, headers):
+            self.assertEquals('200 OK', status)
+        self.assertEquals(['started\n'], app({'PATH_INFO': '/profile/start'}, start_response))
+        busy(0.1)
+        self.assertEquals(['stopped\n'], app({'PATH_INFO': '/profile/stop'}, start_response))
+        text = app({'PATH_INFO': '/profile'}, start_response)[0]
+        self.assertTrue('busy (testprofiler.py:' in text)
+
+if __name__ == '__main__':
+    unittest.main(timeout = 20.0)
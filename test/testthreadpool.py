@@ -0,0 +1,72 @@
+import time
+
+from concurrence import unittest, Tasklet, TimeoutError, threadpool
+
+class TestThreadPool(unittest.TestCase):
+
+    def testRunInThread(self):
+        self.assertEquals(3, Tasklet.run_in_thread(lambda a, b: a + b, 1, b = 2))
+        def fail():
+            raise ValueError("in thread")
+        try:
+            Tasklet.run_in_thread(fail)
+            self.fail("expected ValueError")
+        except ValueError, e:
+            self.assertEquals("in thread", str(e))
+        self.assertTrue(threadpool.statistics()['completed'] >= 2)
+
+    def testDispatcherKeepsRunning(self):
+        pool = threadpool.ThreadPool(4)
+        ticks = [0]
+        def ticker():
+            while True:
+                Tasklet.sleep(0.01)
+                ticks[0] += 1
+        t = Tasklet.new(ticker)()
+        try:
+            with unittest.timer() as tmr:
+                tasks = [Tasklet.new(pool.run)(time.sleep, 0.2) for i in range(4)]
+                Tasklet.join_all(tasks)
+            #the 4 calls ran in parallel and did not block the other task
+            self.assertTrue(1.0 / tmr.sec(1) < 0.4)
+            self.assertTrue(ticks[0] > 5)
+            stats = pool.statistics()
+            self.assertEquals(4, stats['threads'])
+            self.assertEquals(4, stats['completed'])
+            self.assertEquals(0, stats['busy'])
+            self.assertTrue(0.0 < stats['utilisation'] <= 1.0)
+        finally:
+            t.kill()
+            pool.close()
+
+    def testBounded(self):
+        pool = threadpool.ThreadPool(2)
+        try:
+            tasks = [Tasklet.new(pool.run)(time.sleep, 0.1) for i in range(6)]
+            Tasklet.sleep(0.05)
+            self.assertEquals(2, pool.threads)
+            self.assertEquals(2, pool.busy)
+            self.assertEquals(4, pool.queued)
+            Tasklet.join_all(tasks)
+            self.assertEquals(2, pool.threads)
+            self.assertTrue(pool.statistics()['max_queued'] >= 4)
+        finally:
+            pool.close()
+
+    def testTimeout(self):
+        pool = threadpool.ThreadPool(1)
+        try:
+            Tasklet.set_current_timeout(0.1)
+            try:
+                pool.run(time.sleep, 0.3)
+                self.fail("expected timeout")
+            except TimeoutError:
+                pass
+            Tasklet.set_current_timeout(-1)
+            #the pool is still usable when the late result has arrived
+            self.assertEquals(10, pool.run(lambda: 10))
+        finally:
+            pool.close()
+
+if __name__ == '__main__':
+    unittest.main(timeout = 20.0)
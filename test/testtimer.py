@@ -99,6 +99,38 @@ class TestTimer(unittest.TestCase):
             end = time.time()
             self.assertAlmostEqual(2.5, end - start, places = 1)
 
+    def testDeadlineCount(self):
+        self.assertEquals(0, Tasklet._deadline_count)
+        with Timeout.push(10):
+            self.assertEquals(1, Tasklet._deadline_count)
+            with Timeout.push(5):
+                self.assertEquals(1, Tasklet._deadline_count)
+            self.assertEquals(1, Tasklet._deadline_count)
+        self.assertEquals(0, Tasklet._deadline_count)
+
+        #a task that exits without popping its timeout must not leave a deadline behind
+        def child():
+            Timeout.push(10)
+        Tasklet.join(Tasklet.new(child)())
+        Tasklet.yield_() #let the child finish completely
+        self.assertEquals(0, Tasklet._deadline_count)
+
+    def testJoinAllCurrentTimeout(self):
+        def child():
+            Tasklet.sleep(10.0)
+
+        children = [Tasklet.new(child)() for i in range(2)]
+        start = time.time()
+        try:
+            with Timeout.push(1.0):
+                Tasklet.join_all(children)
+            self.fail('expected timeout')
+        except TimeoutError:
+            end = time.time()
+            self.assertAlmostEqual(1.0, end - start, places = 1)
+        finally:
+            for child in children:
+                child.kill()
 
 if __name__ == '__main__':
     unittest.main(timeout = 10)